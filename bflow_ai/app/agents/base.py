@@ -8,6 +8,7 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Generator
 from enum import Enum
+from operator import itemgetter
 
 
 class AgentRole(Enum):
@@ -195,7 +196,7 @@ class AgentOrchestrator(ABC):
                 candidates.append((agent, confidence))
 
         # Sort by confidence descending
-        candidates.sort(key=lambda x: x[1], reverse=True)
+        candidates.sort(key=itemgetter(1), reverse=True)
         return candidates
 
     @abstractmethod
@@ -6,8 +6,7 @@ Chuyên gia về:
 - So sánh tài khoản giữa TT200 và TT99
 - So sánh tổng quan giữa 2 thông tư
 """
-import json
-import os
+import logging
 import re
 from collections import defaultdict
 from typing import Optional, List, Dict, Any
@@ -17,53 +16,29 @@ import numpy as np
 from .base import BaseAgent, AgentRole, AgentResult, AgentContext, Tool
 from ..core.config import settings
 from ..core.ollama_client import get_ollama_client
-from ..core.embeddings import get_embed_model, batch_cosine_similarity, encode_batch
-from ..services.stream_utils import stream_by_char
+from ..core.embeddings import get_embed_model, encode_batch_cached, encode_query
+from ..services.rag_data import load_rag_json, COA_99_JSON, COA_200_JSON, COA_COMPARE_JSON
+from ..services.stream_utils import stream_by_char, StreamMarkerWatcher
 from .templates import get_lookup_template, get_compare_template, get_compare_circular_template
 
+logger = logging.getLogger(__name__)
+
 
 # =============================================================================
 # CONFIG & DATA LOADING
 # =============================================================================
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-COA_99_FILE = os.path.join(BASE_DIR, "services", "rag_json", "coa_99.json")
-COA_200_FILE = os.path.join(BASE_DIR, "services", "rag_json", "coa_200.json")
-COA_COMPARE_FILE = os.path.join(BASE_DIR, "services", "rag_json", "coa_compare_99_vs_200.json")
-
-# Load TT99
-if not os.path.exists(COA_99_FILE):
-    print(f"[WARN] {COA_99_FILE} not found.")
-    COA_99_DATA = []
-else:
-    with open(COA_99_FILE, "r", encoding="utf-8") as f:
-        COA_99_DATA = json.load(f)
-
-# Load TT200
-if not os.path.exists(COA_200_FILE):
-    print(f"[WARN] {COA_200_FILE} not found.")
-    COA_200_DATA = []
-else:
-    with open(COA_200_FILE, "r", encoding="utf-8") as f:
-        COA_200_DATA = json.load(f)
-
-# Load Compare Data
-if not os.path.exists(COA_COMPARE_FILE):
-    print(f"[WARN] {COA_COMPARE_FILE} not found.")
-    COA_COMPARE_DATA = []
-else:
-    with open(COA_COMPARE_FILE, "r", encoding="utf-8") as f:
-        COA_COMPARE_DATA = json.load(f)
+COA_99_DATA = load_rag_json(COA_99_JSON)
+COA_200_DATA = load_rag_json(COA_200_JSON)
+COA_COMPARE_DATA = load_rag_json(COA_COMPARE_JSON)
 
 # Build indexes
 COA_DATA = COA_99_DATA
 COA_BY_CODE = {acc["code"]: acc for acc in COA_99_DATA}
-COA_BY_TYPE = {}
+COA_BY_TYPE = defaultdict(list)
 for acc in COA_99_DATA:
-    type_name = acc["type_name"]
-    if type_name not in COA_BY_TYPE:
-        COA_BY_TYPE[type_name] = []
-    COA_BY_TYPE[type_name].append(acc)
+    COA_BY_TYPE[acc["type_name"]].append(acc)
+COA_BY_TYPE = dict(COA_BY_TYPE)
 
 COA_200_BY_CODE = {acc["code"]: acc for acc in COA_200_DATA}
 
@@ -71,6 +46,54 @@ COA_COMPARE_BY_TYPE = defaultdict(list)
 for item in COA_COMPARE_DATA:
     COA_COMPARE_BY_TYPE[item["change_type"]].append(item)
 
+# Text dùng cho embedding search, song song với COA_DATA
+COA_EMBED_TEXTS = [
+    f"{acc['code']} {acc['name']} {acc.get('name_en', '')} {acc['type_name']}"
+    for acc in COA_DATA
+]
+
+
+# =============================================================================
+# KEYWORD SCAN - 1 lần quét regex cho tất cả nhóm keyword
+# =============================================================================
+
+_ACCOUNT_CODE_RE = re.compile(r'\b(\d{3,5})\b')
+
+# Flag theo nhóm keyword (bitmask)
+KW_COA = 1             # liên quan tài khoản / thông tư
+KW_COMPARE = 2         # so sánh (rộng, dùng cho can_handle)
+KW_STRONG_COMPARE = 4  # so sánh rõ ràng (quyết định nhánh compare khi execute)
+
+_KEYWORD_GROUPS = {
+    KW_COA: ("tài khoản", "tk", "số hiệu", "thông tư", "tt99", "tt200",
+             "hệ thống tài khoản", "danh mục tài khoản", "tk ", " tk"),
+    KW_COMPARE: ("so sánh", "khác gì", "khác nhau", "giữa", "và"),
+    KW_STRONG_COMPARE: ("so sánh", "khác gì", "khác nhau"),
+}
+_KEYWORD_FLAGS = defaultdict(int)
+for _flag, _keywords in _KEYWORD_GROUPS.items():
+    for _kw in _keywords:
+        _KEYWORD_FLAGS[_kw] |= _flag
+# Lookahead chỉ bắt alternative dài nhất tại mỗi vị trí -> gộp flag của các keyword là prefix của nó
+_KEYWORD_SCAN_FLAGS = {}
+for _kw in _KEYWORD_FLAGS:
+    _flags = 0
+    for _other, _other_flags in _KEYWORD_FLAGS.items():
+        if _kw.startswith(_other):
+            _flags |= _other_flags
+    _KEYWORD_SCAN_FLAGS[_kw] = _flags
+_KEYWORD_SCAN_RE = re.compile(
+    "(?=(" + "|".join(re.escape(kw) for kw in sorted(_KEYWORD_SCAN_FLAGS, key=len, reverse=True)) + "))"
+)
+
+
+def keyword_flags(question_lower: str) -> int:
+    """OR flag của mọi keyword xuất hiện (substring) trong câu hỏi - 1 lần quét C-level"""
+    flags = 0
+    for m in _KEYWORD_SCAN_RE.finditer(question_lower):
+        flags |= _KEYWORD_SCAN_FLAGS[m.group(1)]
+    return flags
+
 
 # =============================================================================
 # COA AGENT
@@ -87,7 +110,9 @@ class COAAgent(BaseAgent):
     """
 
     _embed_model = None
-    _coa_embeddings = None
+    _coa_embeddings = None  # (N, D) normalized matrix, hàng i ứng với _coa_codes[i]
+    _coa_codes: List[str] = []
+    _circular_context = None  # (diff, context string) - build lần đầu so sánh tổng quan
 
     def __init__(self):
         super().__init__()
@@ -147,22 +172,13 @@ class COAAgent(BaseAgent):
         - Có từ khóa so sánh + nhắc đến thông tư
         - Hỏi về tài khoản, hệ thống tài khoản
         """
-        question = context.question.lower()
-
-        # Check keywords liên quan đến COA
-        coa_keywords = [
-            "tài khoản", "tk", "số hiệu", "thông tư", "tt99", "tt200",
-            "hệ thống tài khoản", "danh mục tài khoản", "tk ", " tk"
-        ]
-
-        has_coa_keyword = any(kw in question for kw in coa_keywords)
+        # 1 lần quét cho cả keyword COA + so sánh
+        flags = keyword_flags(context.question.lower())
+        has_coa_keyword = bool(flags & KW_COA)
+        has_compare_keyword = bool(flags & KW_COMPARE)
 
         # Check account number pattern
-        has_account_number = bool(re.search(r'\b(\d{3,5})\b', context.question))
-
-        # Check comparison keywords
-        compare_keywords = ["so sánh", "khác gì", "khác nhau", "giữa", "và"]
-        has_compare_keyword = any(kw in question for kw in compare_keywords)
+        has_account_number = bool(_ACCOUNT_CODE_RE.search(context.question))
 
         # Determine confidence
         confidence = 0.0
@@ -185,8 +201,8 @@ class COAAgent(BaseAgent):
         question_lower = question.lower()
 
         # Determine query type
-        code_match = re.search(r'\b(\d{3,5})\b', question)
-        has_compare = any(kw in question_lower for kw in ["so sánh", "khác gì", "khác nhau"])
+        code_match = _ACCOUNT_CODE_RE.search(question)
+        has_compare = bool(keyword_flags(question_lower) & KW_STRONG_COMPARE)
 
         if has_compare:
             if code_match:
@@ -260,7 +276,7 @@ Hãy trả lời theo định dạng sau:
                 sources=sources
             )
         except Exception as e:
-            print(f"[COAAgent Error] {e}")
+            logger.error("[COAAgent Error] %s", e)
             return AgentResult(
                 agent_name=self.name,
                 content=self._generate_fallback(accounts),
@@ -275,7 +291,7 @@ Hãy trả lời theo định dạng sau:
         question = context.question
 
         # Extract account code
-        code_match = re.search(r'\b(\d{3,5})\b', question)
+        code_match = _ACCOUNT_CODE_RE.search(question)
         if not code_match:
             return AgentResult(
                 agent_name=self.name,
@@ -334,7 +350,7 @@ Hãy trả lời theo định dạng sau:
                 sources=sources
             )
         except Exception as e:
-            print(f"[COAAgent Compare Error] {e}")
+            logger.error("[COAAgent Compare Error] %s", e)
             return AgentResult(
                 agent_name=self.name,
                 content=self._generate_compare_fallback(code, acc_99, acc_200),
@@ -346,8 +362,7 @@ Hãy trả lời theo định dạng sau:
         import ollama
 
         question = context.question
-        diff = self._analyze_circular_diff()
-        ctx = self._build_circular_context(diff)
+        diff, ctx = self._get_circular_context()
 
         system_prompt = """Bạn là chuyên gia kế toán Việt Nam. LUÔN trả lời bằng TIẾNG VIỆT.
 Dựa trên dữ liệu so sánh được cung cấp, hãy tóm tắt những điểm khác biệt chính giữa Thông tư 200/2014/TT-BTC và Thông tư 99/2025/TT-BTC về hệ thống tài khoản kế toán.
@@ -384,7 +399,7 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ theo format sau:
                 sources=["TT200", "TT99"]
             )
         except Exception as e:
-            print(f"[COAAgent CompareCircular Error] {e}")
+            logger.error("[COAAgent CompareCircular Error] %s", e)
             return AgentResult(
                 agent_name=self.name,
                 content=self._generate_circular_fallback(diff),
@@ -403,8 +418,8 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ theo format sau:
         question_lower = question.lower()
 
         # Determine query type
-        code_match = re.search(r'\b(\d{3,5})\b', question)
-        has_compare = any(kw in question_lower for kw in ["so sánh", "khác gì", "khác nhau"])
+        code_match = _ACCOUNT_CODE_RE.search(question)
+        has_compare = bool(keyword_flags(question_lower) & KW_STRONG_COMPARE)
 
         if has_compare:
             if code_match:
@@ -459,19 +474,19 @@ Hãy trả lời theo định dạng sau:
                 options=settings.OLLAMA_OPTIONS,
                 stream=True
             )
-            slm_output = ""
+            watcher = StreamMarkerWatcher("1.")
             for char in stream_by_char(stream):
-                slm_output += char
+                watcher.feed(char)
                 yield char
 
             # Fallback if needed
-            if not slm_output or "1." not in slm_output:
+            if not watcher.length or not watcher.found:
                 yield self._generate_fallback(accounts)
             else:
                 yield "\n\n(Căn cứ: Phụ lục II - Thông tư 99/2025/TT-BTC)"
 
         except Exception as e:
-            print(f"[COAAgent Stream Error] {e}")
+            logger.error("[COAAgent Stream Error] %s", e)
             yield self._generate_fallback(accounts)
 
     def _stream_compare(self, context: AgentContext):
@@ -480,7 +495,7 @@ Hãy trả lời theo định dạng sau:
 
         question = context.question
 
-        code_match = re.search(r'\b(\d{3,5})\b', question)
+        code_match = _ACCOUNT_CODE_RE.search(question)
         if not code_match:
             yield "Vui lòng chỉ định số tài khoản cần so sánh (ví dụ: 'So sánh TK 156 giữa TT200 và TT99')."
             return
@@ -515,16 +530,16 @@ Hãy trả lời theo định dạng sau:
                 options=settings.OLLAMA_OPTIONS,
                 stream=True
             )
-            slm_output = ""
+            watcher = StreamMarkerWatcher("SO SÁNH", upper=True)
             for char in stream_by_char(stream):
-                slm_output += char
+                watcher.feed(char)
                 yield char
 
-            if not slm_output or "SO SÁNH" not in slm_output.upper():
+            if not watcher.length or not watcher.found:
                 yield self._generate_compare_fallback(code, acc_99, acc_200)
 
         except Exception as e:
-            print(f"[COAAgent Compare Stream Error] {e}")
+            logger.error("[COAAgent Compare Stream Error] %s", e)
             yield self._generate_compare_fallback(code, acc_99, acc_200)
 
     def _stream_compare_circular(self, context: AgentContext):
@@ -532,8 +547,7 @@ Hãy trả lời theo định dạng sau:
         import ollama
 
         question = context.question
-        diff = self._analyze_circular_diff()
-        ctx = self._build_circular_context(diff)
+        diff, ctx = self._get_circular_context()
 
         system_prompt = """Bạn là chuyên gia kế toán Việt Nam. LUÔN trả lời bằng TIẾNG VIỆT.
 Dựa trên dữ liệu so sánh được cung cấp, hãy tóm tắt những điểm khác biệt chính giữa Thông tư 200/2014/TT-BTC và Thông tư 99/2025/TT-BTC về hệ thống tài khoản kế toán.
@@ -558,16 +572,16 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ theo format sau:
                 options=settings.OLLAMA_OPTIONS,
                 stream=True
             )
-            slm_output = ""
+            output_len = 0
             for char in stream_by_char(stream):
-                slm_output += char
+                output_len += len(char)
                 yield char
 
-            if not slm_output or len(slm_output) < 50:
+            if output_len < 50:
                 yield self._generate_circular_fallback(diff)
 
         except Exception as e:
-            print(f"[COAAgent CompareCircular Stream Error] {e}")
+            logger.error("[COAAgent CompareCircular Stream Error] %s", e)
             yield self._generate_circular_fallback(diff)
 
     # =========================================================================
@@ -580,32 +594,44 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ theo format sau:
         Lazy init embeddings với batch processing.
 
         Optimized: Encode tất cả accounts trong 1 batch thay vì loop.
+        Matrix (N, D) + list code build 1 lần, search chỉ còn 1 phép dot.
         """
         if cls._embed_model is None:
             cls._embed_model = get_embed_model()
 
             # Batch encode tất cả accounts - nhanh hơn loop rất nhiều
             if COA_DATA:
-                texts = []
-                codes = []
-                for acc in COA_DATA:
-                    text = f"{acc['code']} {acc['name']} {acc.get('name_en', '')} {acc['type_name']}"
-                    texts.append(text)
-                    codes.append(acc["code"])
+                # Batch encode - nhanh hơn 10-20x so với loop (cache .npy theo hash nội dung COA)
+                embeddings = encode_batch_cached(COA_EMBED_TEXTS, "coa_99")
+
+                cls._coa_codes = [acc["code"] for acc in COA_DATA]
+                cls._coa_embeddings = embeddings
+                logger.info("[COAAgent] Batch encoded %d accounts", len(cls._coa_codes))
+
+    @classmethod
+    def _search_accounts(cls, query: str, top_k: int, min_score: float = 0.3) -> list:
+        """
+        Semantic search top_k tài khoản (exhaustive dot product trên matrix đã build sẵn).
 
-                # Batch encode - nhanh hơn 10-20x so với loop
-                from ..core.embeddings import encode_batch
-                embeddings = encode_batch(texts, normalize=True)
+        Với vài trăm tài khoản, 1 phép dot (N, D) @ (D,) rẻ hơn dựng index ANN.
+        """
+        cls._init_embeddings()
+        if cls._coa_embeddings is None or not len(cls._coa_codes):
+            return []
 
-                cls._coa_embeddings = {
-                    code: emb for code, emb in zip(codes, embeddings)
-                }
-                print(f"[COAAgent] Batch encoded {len(codes)} accounts")
+        # encode_query: cache + micro-batch với request đồng thời
+        scores = cls._coa_embeddings @ encode_query(query)
+
+        top_k = min(top_k, len(scores))
+        top_k_indices = np.argpartition(scores, -top_k)[-top_k:]
+        top_k_indices = top_k_indices[np.argsort(-scores[top_k_indices])]
+
+        return [COA_BY_CODE[cls._coa_codes[i]] for i in top_k_indices if scores[i] > min_score]
 
     def _find_accounts(self, question: str, question_lower: str) -> list:
         """Tìm tài khoản phù hợp"""
         # 1. Tìm theo code
-        code_match = re.search(r'\b(\d{3,5})\b', question)
+        code_match = _ACCOUNT_CODE_RE.search(question)
         if code_match:
             code = code_match.group(1)
             acc = COA_BY_CODE.get(code)
@@ -635,23 +661,7 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ theo format sau:
                 if results: return results
 
         # 4. Embedding search (optimized with batch operations)
-        self._init_embeddings()
-
-        # Build embeddings matrix for batch similarity
-        codes = list(self._coa_embeddings.keys())
-        embeddings_matrix = np.array([self._coa_embeddings[c] for c in codes])
-
-        # Encode query
-        query_emb = self._embed_model.encode(question, normalize_embeddings=True)
-
-        # Batch compute similarities (vectorized)
-        scores = batch_cosine_similarity(query_emb, embeddings_matrix)
-
-        # Get top 3
-        top_3_indices = np.argpartition(scores, -3)[-3:]
-        top_3_indices = top_3_indices[np.argsort(-scores[top_3_indices])]
-
-        return [COA_BY_CODE[codes[i]] for i in top_3_indices if scores[i] > 0.3]
+        return self._search_accounts(question, top_k=3)
 
     def _generate_fallback(self, accounts: list) -> str:
         """Fallback khi SLM không hoạt động"""
@@ -767,6 +777,17 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ theo format sau:
             'total_changes': len(COA_COMPARE_DATA)
         }
 
+    def _get_circular_context(self) -> tuple:
+        """
+        (diff, context) cho so sánh tổng quan.
+
+        Dữ liệu so sánh là file tĩnh -> build 1 lần, các request sau dùng lại prompt context.
+        """
+        if COAAgent._circular_context is None:
+            diff = self._analyze_circular_diff()
+            COAAgent._circular_context = (diff, self._build_circular_context(diff))
+        return COAAgent._circular_context
+
     def _build_circular_context(self, diff: dict) -> str:
         """Build context cho so sánh tổng quan"""
         lines = [
@@ -865,24 +886,7 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ theo format sau:
 
         Uses batch vectorized operations instead of loop.
         """
-        self._init_embeddings()
-
-        # Build embeddings matrix
-        codes = list(self._coa_embeddings.keys())
-        embeddings_matrix = np.array([self._coa_embeddings[c] for c in codes])
-
-        # Encode query
-        query_emb = self._embed_model.encode(query, normalize_embeddings=True)
-
-        # Batch compute similarities (vectorized - nhanh hơn loop rất nhiều)
-        scores = batch_cosine_similarity(query_emb, embeddings_matrix)
-
-        # Get top k
-        top_k = min(top_k, len(scores))
-        top_k_indices = np.argpartition(scores, -top_k)[-top_k:]
-        top_k_indices = top_k_indices[np.argsort(-scores[top_k_indices])]
-
-        return [COA_BY_CODE[codes[i]] for i in top_k_indices if scores[i] > 0.3]
+        return self._search_accounts(query, top_k=top_k)
 
     def _tool_compare_accounts(self, code: str) -> dict:
         """Tool: So sánh tài khoản giữa TT200 và TT99"""
@@ -9,6 +9,7 @@ Orchestrator:
 5. Stream response về user
 """
 import json
+import logging
 import re
 from typing import Optional, List
 import numpy as np
@@ -19,12 +20,41 @@ from .posting_engine_agent import PostingEngineAgent
 from .general_accounting_agent import GeneralAccountingAgent, GeneralFreeAgent
 from ..core.config import settings
 from ..core.ollama_client import get_ollama_client
-from ..core.embeddings import get_embed_model
+from ..core.embeddings import get_embed_model, encode_batch, encode_query
 from ..services.llm_service import get_llm_service
 from ..services.streaming_cache import cached_stream, _simulate_streaming
 from ..services.history_search import find_in_history_before_llm
 from ..services.session_manager import get_session_manager
 
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# FAST ROUTING PATTERNS - compile 1 lần lúc import
+# =============================================================================
+
+def _compile_keyword_union(keywords) -> "re.Pattern":
+    """
+    Gộp list keyword thành 1 regex alternation (1 lần scan C-level thay vì any()).
+
+    Sort theo độ dài giảm dần để alternation ưu tiên match dài hơn.
+    """
+    ordered = sorted(set(keywords), key=len, reverse=True)
+    return re.compile("|".join(re.escape(kw) for kw in ordered), re.IGNORECASE)
+
+
+_ACCOUNT_NUMBER_RE = re.compile(r'\b\d{3,5}\b')
+
+_COMPARE_RE = _compile_keyword_union(["so sánh", "khác gì", "khác nhau", "giữa"])
+
+_POSTING_RE = _compile_keyword_union([
+    "hạch toán", "định khoản", "bút toán", "ghi nhận",
+    "nợ", "có", "phiếu thu", "phiếu chi", "xuất hóa đơn",
+    "nhập kho", "xuất kho", "bán hàng", "mua hàng"
+])
+
+_CIRCULAR_RE = _compile_keyword_union(["tt99", "tt200", "thông tư 99", "thông tư 200"])
+
 
 # =============================================================================
 # SMART CLASSIFICATION - Few-shot Examples
@@ -159,7 +189,8 @@ class AccountingOrchestrator(AgentOrchestrator):
 
     # Embedding model for semantic classification
     _embed_model = None
-    _agent_embeddings = None
+    _agent_embeddings = None  # (A, D) centroid matrix, hàng i ứng với _agent_names[i]
+    _agent_names: List[str] = []
 
     def __init__(self):
         super().__init__()
@@ -201,13 +232,18 @@ class AccountingOrchestrator(AgentOrchestrator):
             }
 
             # Create embeddings cho mỗi agent type
-            cls._agent_embeddings = {}
-            for agent_name, examples in agent_examples.items():
-                embeddings = cls._embed_model.encode(examples, normalize_embeddings=True)
-                cls._agent_embeddings[agent_name] = {
-                    "embeddings": embeddings,
-                    "centroid": np.mean(embeddings, axis=0)
-                }
+            # 1 batch encode tất cả examples, centroid xếp thành matrix (A, D) float32 liền mạch
+            names = list(agent_examples.keys())
+            texts = [ex for name in names for ex in agent_examples[name]]
+            embeddings = encode_batch(texts, normalize=True)
+            centroids = []
+            start = 0
+            for name in names:
+                end = start + len(agent_examples[name])
+                centroids.append(embeddings[start:end].mean(axis=0))
+                start = end
+            cls._agent_names = names
+            cls._agent_embeddings = np.ascontiguousarray(np.stack(centroids), dtype=np.float32)
 
     def _semantic_classify(self, question: str) -> Optional[str]:
         """
@@ -216,19 +252,18 @@ class AccountingOrchestrator(AgentOrchestrator):
         if self._agent_embeddings is None:
             self._init_embeddings()
 
-        query_emb = self._embed_model.encode(question, normalize_embeddings=True)
+        query_emb = encode_query(question)
 
-        scores = {}
-        for agent_name, data in self._agent_embeddings.items():
-            # Tính similarity với centroid của mỗi agent
-            sim = float(np.dot(query_emb, data["centroid"]))
-            scores[agent_name] = sim
+        # Similarity với centroid của mỗi agent: 1 phép (A, D) @ (D,)
+        sims = self._agent_embeddings @ query_emb
+        scores = {name: float(sim) for name, sim in zip(self._agent_names, sims)}
 
-        best_agent = max(scores.keys(), key=lambda k: scores[k])
+        best_idx = int(np.argmax(sims))
+        best_agent = self._agent_names[best_idx]
         best_score = scores[best_agent]
 
-        print(f"[Orchestrator] Semantic scores: {scores}")
-        print(f"[Orchestrator] Semantic best: {best_agent} (score: {best_score:.3f})")
+        logger.debug("[Orchestrator] Semantic scores: %s", scores)
+        logger.debug("[Orchestrator] Semantic best: %s (score: %.3f)", best_agent, best_score)
 
         # Only use if confidence is high enough
         if best_score > 0.3:
@@ -252,36 +287,31 @@ class AccountingOrchestrator(AgentOrchestrator):
 
         # === FAST RULE-BASED ROUTING (O(1) lookup) ===
         # Pattern 1: Có số tài khoản -> COA
-        if re.search(r'\b\d{3,5}\b', context.question):
+        if _ACCOUNT_NUMBER_RE.search(context.question):
             # Có 3-5 chữ số liên tiếp -> có thể là tài khoản
             # Check thêm keywords để phân loại COA vs COMPARE
-            if any(kw in question_lower for kw in ["so sánh", "khác gì", "khác nhau", "giữa"]):
-                print("[Orchestrator] Fast route: COMPARE (account number + compare keyword)")
+            if _COMPARE_RE.search(question_lower):
+                logger.debug("[Orchestrator] Fast route: COMPARE (account number + compare keyword)")
                 return self.get_agent("COA")  # COA agent handles compare
             else:
-                print("[Orchestrator] Fast route: COA (account number)")
+                logger.debug("[Orchestrator] Fast route: COA (account number)")
                 return self.get_agent("COA")
 
         # Pattern 2: Keywords mạnh -> POSTING_ENGINE
-        posting_keywords = [
-            "hạch toán", "định khoản", "bút toán", "ghi nhận",
-            "nợ", "có", "phiếu thu", "phiếu chi", "xuất hóa đơn",
-            "nhập kho", "xuất kho", "bán hàng", "mua hàng"
-        ]
-        if any(kw in question_lower for kw in posting_keywords):
-            print("[Orchestrator] Fast route: POSTING_ENGINE (posting keyword)")
+        if _POSTING_RE.search(question_lower):
+            logger.debug("[Orchestrator] Fast route: POSTING_ENGINE (posting keyword)")
             return self.get_agent("POSTING_ENGINE")
 
         # Pattern 3: So sánh thông tư -> COA (compare circular)
-        if any(kw in question_lower for kw in ["tt99", "tt200", "thông tư 99", "thông tư 200"]):
+        if _CIRCULAR_RE.search(question_lower):
             if "so sánh" in question_lower or "khác" in question_lower:
-                print("[Orchestrator] Fast route: COA (circular compare)")
+                logger.debug("[Orchestrator] Fast route: COA (circular compare)")
                 return self.get_agent("COA")
 
         # === SLM CLASSIFICATION ===
         slm_agent = self._classify_with_slm(context.question)
         if slm_agent:
-            print(f"[Orchestrator] SLM classified to: {slm_agent.name}")
+            logger.debug("[Orchestrator] SLM classified to: %s", slm_agent.name)
             return slm_agent
 
         # === SEMANTIC FALLBACK ===
@@ -289,11 +319,11 @@ class AccountingOrchestrator(AgentOrchestrator):
         if semantic_agent_name:
             agent = self.get_agent(semantic_agent_name)
             if agent:
-                print(f"[Orchestrator] Semantic classified to: {semantic_agent_name}")
+                logger.debug("[Orchestrator] Semantic classified to: %s", semantic_agent_name)
                 return agent
 
         # === FINAL FALLBACK ===
-        print("[Orchestrator] Using default: GENERAL_ACCOUNTING")
+        logger.debug("[Orchestrator] Using default: GENERAL_ACCOUNTING")
         return self.get_agent("GENERAL_ACCOUNTING")
 
     def _classify_with_slm(self, question: str) -> Optional[BaseAgent]:
@@ -321,7 +351,7 @@ class AccountingOrchestrator(AgentOrchestrator):
             )
 
             response = llm_service.chat(
-                model=settings.GENERATION_MODEL,  # Use 3b for better accuracy
+                model=settings.ROUTER_MODEL,  # Model nhỏ cho routing, model lớn chỉ dùng để trả lời
                 messages=[
                     {"role": "user", "content": full_prompt}
                 ],
@@ -335,7 +365,7 @@ class AccountingOrchestrator(AgentOrchestrator):
             agent_name = result.get("agent")
             reasoning = result.get("reasoning", "")
 
-            print(f"[Orchestrator] SLM Reasoning: {reasoning[:200]}...")  # Truncate for cleaner log
+            logger.debug("[Orchestrator] SLM Reasoning: %s...", reasoning[:200])  # Truncate for cleaner log
 
             # Get agent by name
             agent = self.get_agent(agent_name)
@@ -343,7 +373,7 @@ class AccountingOrchestrator(AgentOrchestrator):
                 return agent
 
         except Exception as e:
-            print(f"[Orchestrator] SLM Classification Error: {e}")
+            logger.error("[Orchestrator] SLM Classification Error: %s", e)
 
         return None
 
@@ -370,7 +400,7 @@ class AccountingOrchestrator(AgentOrchestrator):
         # Tạo session mới nếu chưa có
         if not session_id:
             session_id = sm.create_session()
-            print(f"[Orchestrator] Created new session: {session_id}")
+            logger.debug("[Orchestrator] Created new session: %s", session_id)
 
         # Yield session_id đầu tiên
         yield f"__SESSION_ID__:{session_id}\n"
@@ -388,7 +418,7 @@ class AccountingOrchestrator(AgentOrchestrator):
 
         # Chế độ FREE: Bỏ qua orchestration, dùng GeneralFreeAgent trực tiếp
         if chat_type == "free":
-            print(f"[Orchestrator] Mode: FREE - Direct general response")
+            logger.debug("[Orchestrator] Mode: FREE - Direct general response")
             agent = self.get_agent("GENERAL_FREE")
             for chunk in agent.stream_execute(context):
                 full_response += chunk
@@ -397,7 +427,7 @@ class AccountingOrchestrator(AgentOrchestrator):
             return
 
         # Chế độ THINKING: Orchestration thông minh
-        print(f"[Orchestrator] Mode: THINKING - Smart routing")
+        logger.debug("[Orchestrator] Mode: THINKING - Smart routing")
 
         # Route đến agent phù hợp
         agent = self.route(context)
@@ -407,7 +437,7 @@ class AccountingOrchestrator(AgentOrchestrator):
         # Tìm trong history bằng độ tương đồng (similarity)
         # Câu hỏi giống → trả lời ngay (không cần gọi LLM)
         if session_id and settings.ENABLE_SEMANTIC_HISTORY:
-            print(f"[Orchestrator] Checking history for similar question...")
+            logger.debug("[Orchestrator] Checking history for similar question...")
             history_response = find_in_history_before_llm(
                 question=question,
                 session_id=session_id,
@@ -417,7 +447,7 @@ class AccountingOrchestrator(AgentOrchestrator):
 
             if history_response:
                 # Tìm thấy trong history → simulate streaming
-                print(f"[Orchestrator] Found in history! Simulating streaming...")
+                logger.debug("[Orchestrator] Found in history! Simulating streaming...")
                 for chunk in _simulate_streaming(
                     history_response,
                     chars_per_chunk=settings.CACHE_CHARS_PER_CHUNK,
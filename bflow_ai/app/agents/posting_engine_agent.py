@@ -7,46 +7,78 @@ Chuyên gia về:
 - Tư vấn bút toán kế toán
 """
 import json
+import logging
 import os
+import re
+import sys
+import threading
 from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import itemgetter
 
 import numpy as np
-import networkx as nx
+from rapidfuzz import fuzz, process
 
 from .base import BaseAgent, AgentRole, AgentResult, AgentContext, Tool
 from ..core.config import settings
 from ..core.ollama_client import get_ollama_client
-from ..core.embeddings import get_embed_model
+from ..core.embeddings import encode_batch_cached, encode_query
+from ..services.rag_data import load_rag_json, rag_json_path, COA_99_JSON, POSTING_ENGINE_JSON
 from ..services.stream_utils import stream_by_char
 from .templates import get_response_template
 
+logger = logging.getLogger(__name__)
+
 
 # =============================================================================
 # CONFIG LOADING
 # =============================================================================
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-POSTING_CONFIG_FILE = os.path.join(BASE_DIR, "services", "rag_json", "posting_engine.json")
-COA_99_FILE = os.path.join(BASE_DIR, "services", "rag_json", "coa_99.json")
+POSTING_CONFIG_FILE = rag_json_path(POSTING_ENGINE_JSON)
 
 if not os.path.exists(POSTING_CONFIG_FILE):
     raise FileNotFoundError(f"posting_engine.json not found at {POSTING_CONFIG_FILE}")
 
-with open(POSTING_CONFIG_FILE, "r", encoding="utf-8") as f:
-    CONFIG = json.load(f)
+CONFIG = load_rag_json(POSTING_ENGINE_JSON)
 
+# Rules là config tĩnh -> sort theo priority 1 lần lúc import, resolve không cần sort lại
+# (sorted() tạo list mới, không sửa CONFIG đang share qua load_rag_json)
 DOCUMENT_TYPES = {d["transaction_key"]: d for d in CONFIG["document_types"]}
-POSTING_RULES = {r["je_doc_type"]: r["rules"] for r in CONFIG["posting_rules"]}
+POSTING_RULES = {r["je_doc_type"]: sorted(r["rules"], key=itemgetter("priority")) for r in CONFIG["posting_rules"]}
 GL_MAPPING = CONFIG["gl_mapping"]
 POSTING_GROUPS = {g["code"]: g for g in CONFIG["posting_groups"]}
 ROLE_KEYS = CONFIG["role_keys"]
 
-# Load ACCOUNT_NAMES
-ACCOUNT_NAMES = {}
-if os.path.exists(COA_99_FILE):
-    with open(COA_99_FILE, "r", encoding="utf-8") as f:
-        coa_data = json.load(f)
-        ACCOUNT_NAMES = {item["code"]: item["name"] for item in coa_data}
+
+@dataclass(frozen=True, slots=True)
+class PostingRule:
+    """Posting rule đã compile - truy cập attribute thay vì dict .get()"""
+    side: str
+    priority: int
+    role_key: str
+    source_type: str
+    fixed_account_code: str
+    description: str
+
+
+COMPILED_POSTING_RULES = {
+    tx: tuple(
+        PostingRule(
+            side=r["side"],
+            priority=r["priority"],
+            role_key=r["role_key"],
+            source_type=r.get("account_source_type", "FIXED"),
+            fixed_account_code=r.get("fixed_account_code", ""),
+            description=r.get("description", ""),
+        )
+        for r in rules
+    )
+    for tx, rules in POSTING_RULES.items()
+}
+
+# Load ACCOUNT_NAMES (dùng chung coa_99 đã parse với COAAgent/COAIndex)
+ACCOUNT_NAMES = {item["code"]: item["name"] for item in load_rag_json(COA_99_JSON)}
 
 ACCOUNT_NAMES.update({
     "1331": "Thuế GTGT được khấu trừ",
@@ -65,6 +97,50 @@ for doc in CONFIG.get("document_types", []):
     name = desc.split(" - ")[0] if " - " in desc else desc
     TRANSACTION_NAMES[tx_key] = name
 
+# Keyword bitmask index: mỗi keyword (lowercase, interned) chiếm 1 bit,
+# mỗi nghiệp vụ có 1 mask = OR các bit keyword của nó.
+# Query chỉ cần scan 1 lần ra query_mask, chấm điểm bằng phép AND.
+KEYWORD_VOCAB = {}
+TX_KEYWORD_MASKS = {}
+for tx_key, doc in DOCUMENT_TYPES.items():
+    mask = 0
+    for kw in doc.get("keywords", []):
+        bit = KEYWORD_VOCAB.setdefault(sys.intern(kw.lower()), len(KEYWORD_VOCAB))
+        mask |= 1 << bit
+    TX_KEYWORD_MASKS[tx_key] = mask
+
+
+# Regex union (keyword dài trước) trong lookahead: tại mỗi vị trí bắt keyword dài nhất.
+# Keyword ngắn hơn bắt đầu cùng vị trí luôn nằm trong keyword dài -> bù bằng closure mask.
+KEYWORD_CLOSURE_MASKS = {
+    kw: sum(1 << bit for other, bit in KEYWORD_VOCAB.items() if other in kw)
+    for kw in KEYWORD_VOCAB
+}
+_KEYWORD_SCAN_RE = re.compile(
+    "(?=(" + "|".join(re.escape(kw) for kw in sorted(KEYWORD_VOCAB, key=len, reverse=True)) + "))"
+) if KEYWORD_VOCAB else None
+
+
+def keyword_query_mask(query_lower: str) -> int:
+    """Scan query 1 lần, trả về mask các keyword xuất hiện"""
+    mask = 0
+    if _KEYWORD_SCAN_RE is not None:
+        for m in _KEYWORD_SCAN_RE.finditer(query_lower):
+            mask |= KEYWORD_CLOSURE_MASKS[m.group(1)]
+    return mask
+
+
+# Keywords cho can_handle - tuple tĩnh, không build lại mỗi query
+POSTING_KEYWORDS = (
+    "hạch toán", "định khoản", "bút toán", "nghiệp vụ",
+    "xuất hóa đơn", "nhập kho", "phiếu thu", "phiếu chi",
+    "bán hàng", "mua hàng", "thu tiền", "chi tiền",
+    "xuất kho", "nhập hàng", "giao hàng", "nhận hàng",
+    "thanh toán", "công nợ", "phải thu", "phải trả",
+    "gtgt", "thuế", "giá vốn"
+)
+ACCOUNT_HINT_KEYWORDS = ("tk ", " tk", "tài khoản")
+
 
 # =============================================================================
 # SLM CLASSIFICATION PROMPTS
@@ -98,44 +174,64 @@ TX_CLASSIFICATION_SCHEMA = {
 # =============================================================================
 
 class MiniRAGGraph:
-    """Knowledge graph cho transaction types"""
+    """
+    Knowledge graph cho transaction types.
+
+    Retriever chỉ đọc keyword -> nghiệp vụ (không traverse graph),
+    nên chỉ build map này - không giữ node/edge không ai đọc.
+    """
     def __init__(self):
-        self.graph = nx.DiGraph()
         self.keyword_to_tx = defaultdict(set)
-        self.account_to_tx = defaultdict(list)
         self._build_graph()
 
     def _build_graph(self):
         for tx, doc in DOCUMENT_TYPES.items():
-            self.graph.add_node(f"TX:{tx}", node_type="TRANSACTION", name=TRANSACTION_NAMES.get(tx, tx))
             for kw in doc.get("keywords", []):
-                self.keyword_to_tx[kw.lower()].add(tx)
-
-        for tx, rules in POSTING_RULES.items():
-            for rule in rules:
-                if rule.get("account_source_type") == "FIXED":
-                    acc = rule.get("fixed_account_code", "")
-                    if acc:
-                        self.account_to_tx[acc].append((tx, rule["side"]))
-
-    def get_neighbors(self, node_id, edge_type=None):
-        if not self.graph.has_node(node_id): return []
-        return [target for _, target, data in self.graph.edges(node_id, data=True)
-                if edge_type is None or data.get("edge_type") == edge_type]
+                # Cùng object với key trong KEYWORD_VOCAB (intern) -> so sánh bằng pointer
+                self.keyword_to_tx[sys.intern(kw.lower())].add(tx)
 
 
 class MiniRAGRetriever:
     """Retrieval system cho transaction classification"""
     def __init__(self, graph: MiniRAGGraph):
         self.graph = graph
-        self.embed_model = get_embed_model()
-        self.tx_embeddings = {}
-        for tx, doc in DOCUMENT_TYPES.items():
-            text = f"{tx} {TRANSACTION_NAMES.get(tx, '')} {doc.get('description', '')}"
-            self.tx_embeddings[tx] = self.embed_model.encode(text, normalize_embeddings=True)
+        # tx_matrix chỉ load (cache disk / encode) khi fallback thực sự cần embedding
+        self._tx_matrix = None
+        self._tx_matrix_lock = threading.Lock()
+
+        # Dense layout: scores/embeddings index theo vị trí trong tx_keys
+        self.tx_keys = list(DOCUMENT_TYPES.keys())
+        self.tx_idx = {tx: i for i, tx in enumerate(self.tx_keys)}
+        self.tx_masks = [TX_KEYWORD_MASKS[tx] for tx in self.tx_keys]
+        self._tx_texts = [
+            f"{tx} {TRANSACTION_NAMES.get(tx, '')} {DOCUMENT_TYPES[tx].get('description', '')}"
+            for tx in self.tx_keys
+        ]
+        # Token overlap: tập hash các từ của mỗi nghiệp vụ (giao tập chạy ở C)
+        self.tx_word_hashes = [frozenset(map(hash, text.lower().split())) for text in self._tx_texts]
+        # Fuzzy fallback (sai chính tả): keyword list + index nghiệp vụ song song
+        self._keyword_list = list(KEYWORD_VOCAB.keys())
+        self._keyword_tx_idx = [
+            [self.tx_idx[tx] for tx in sorted(self.graph.keyword_to_tx[kw]) if tx in self.tx_idx]
+            for kw in self._keyword_list
+        ]
 
-    def retrieve(self, query: str) -> dict:
-        """Retrieve transaction type using SLM + fallback"""
+    @property
+    def tx_matrix(self) -> np.ndarray:
+        """(T, D) embedding matrix của các nghiệp vụ - load cache/build lần đầu dùng"""
+        if self._tx_matrix is None:
+            with self._tx_matrix_lock:
+                if self._tx_matrix is None:
+                    self._tx_matrix = encode_batch_cached(self._tx_texts, "posting_tx_matrix")
+        return self._tx_matrix
+
+    def retrieve(self, query: str, *, debug: bool = False) -> dict:
+        """
+        Retrieve transaction type using SLM + fallback.
+
+        debug=True: trả thêm matched_keywords/fuzzy_keywords (cho tool/giải thích).
+        Mặc định chỉ trả transaction/score/method để hot path không tạo thêm object.
+        """
         slm_result = self._classify_with_slm(query)
         if slm_result:
             return {
@@ -144,14 +240,14 @@ class MiniRAGRetriever:
                 "method": "SLM"
             }
 
-        return self._fallback_retrieve(query)
+        return self._fallback_retrieve(query, debug=debug)
 
     def _classify_with_slm(self, query: str) -> str:
         """Use SLM to classify transaction type"""
         try:
             client = get_ollama_client()
             response = client.chat(
-                model=settings.GENERATION_MODEL,
+                model=settings.ROUTER_MODEL,
                 messages=[
                     {"role": "user", "content": TX_CLASSIFICATION_PROMPT.format(question=query)}
                 ],
@@ -165,63 +261,160 @@ class MiniRAGRetriever:
             if tx in DOCUMENT_TYPES:
                 return tx
         except Exception as e:
-            print(f"[PostingEngineAgent SLM Error] {e}")
+            logger.error("[PostingEngineAgent SLM Error] %s", e)
         return None
 
-    def _fallback_retrieve(self, query: str) -> dict:
+    def _fallback_retrieve(self, query: str, debug: bool = False) -> dict:
         """Fallback: keyword + embedding matching"""
+        if not self.tx_keys:
+            result = {"transaction": "DO_SALE", "score": 0.0, "method": "FALLBACK"}
+            if debug:
+                result.update(matched_keywords=[], fuzzy_keywords=[])
+            return result
+
         query_lower = query.lower()
-        scores = defaultdict(float)
-        matched_keywords = []
+        scores = np.zeros(len(self.tx_keys), dtype=np.float32)
+
+        query_mask = keyword_query_mask(query_lower)
+        if query_mask:
+            for i, tx_mask in enumerate(self.tx_masks):
+                scores[i] += 3.0 * (query_mask & tx_mask).bit_count()
+
+        query_hashes = frozenset(map(hash, query_lower.split()))
+        for i, tx_hashes in enumerate(self.tx_word_hashes):
+            scores[i] += 0.3 * len(query_hashes & tx_hashes)
+
+        # Không khớp chính xác -> thử fuzzy match (vd: "thnah toán", "xuat kho")
+        fuzzy_matches = []
+        if not query_mask:
+            fuzzy_matches = process.extract(
+                query_lower, self._keyword_list, scorer=fuzz.partial_ratio, score_cutoff=80, limit=5
+            )
+            for _, _, pos in fuzzy_matches:
+                for i in self._keyword_tx_idx[pos]:
+                    scores[i] += 1.5
+
+        # Fuzzy chỉ cộng thêm điểm, không thay embedding: chỉ bỏ embedding khi có keyword khớp chính xác
+        if not query_mask:
+            # encode_query đã trả float32 liền mạch -> matvec thẳng, không copy/ép kiểu
+            scores += self.tx_matrix @ encode_query(query)
+
+        best_idx = int(scores.argmax())
+        result = {
+            "transaction": self.tx_keys[best_idx],
+            "score": float(scores[best_idx]),
+            "method": "FALLBACK"
+        }
+        if debug:
+            result["matched_keywords"] = [kw for kw, bit in KEYWORD_VOCAB.items() if query_mask >> bit & 1]
+            result["fuzzy_keywords"] = [kw for kw, _, _ in fuzzy_matches]
+        return result
 
-        for kw, tx_set in self.graph.keyword_to_tx.items():
-            if kw in query_lower:
-                matched_keywords.append(kw)
-                for tx in tx_set:
-                    scores[tx] += 3.0
 
-        if not matched_keywords:
-            query_embedding = self.embed_model.encode(query, normalize_embeddings=True)
-            for tx, tx_emb in self.tx_embeddings.items():
-                scores[tx] += float(np.dot(query_embedding, tx_emb))
+@dataclass(frozen=True, slots=True)
+class ResolvedEntries:
+    """
+    Bút toán đã resolve dạng cột (SoA), đã sort theo priority, kèm text dựng sẵn cho prompt.
 
-        best_tx = max(scores.keys(), key=lambda k: scores[k]) if scores else "DO_SALE"
-        return {
-            "transaction": best_tx,
-            "score": scores[best_tx] if scores else 0.0,
-            "matched_keywords": matched_keywords,
-            "method": "FALLBACK"
-        }
+    Chỉ phụ thuộc config tĩnh + (tx, item_group, partner_group) nên cache được.
+    """
+    accounts: tuple
+    account_names: tuple
+    sides: tuple           # "Nợ" / "Có"
+    is_lookup: tuple
+    prompt_text: str       # "- Nợ TK 632: Giá vốn hàng bán (*)" mỗi dòng
+    has_lookup: bool
 
 
 class PostingEngineResolver:
     """Resolve journal entries based on rules"""
     @staticmethod
     def resolve(tx, item_group, partner_group):
-        rules = POSTING_RULES.get(tx, [])
+        # LOOKUP dùng GL mapping của item_group (nếu là ITEM_GROUP) hoặc partner_group
+        item_group_info = POSTING_GROUPS.get(item_group, {})
+        lookup_group = item_group if item_group_info.get("posting_group_type") == "ITEM_GROUP" else partner_group
+        lookup_mapping = GL_MAPPING.get(lookup_group, {})
+
         entries = []
-        for r in sorted(rules, key=lambda x: x["priority"]):
-            role_key = r["role_key"]
-            acc_type = r.get("account_source_type", "FIXED")
+        for r in COMPILED_POSTING_RULES.get(tx, ()):  # đã sort theo priority
             acc = ""
-            if acc_type == "FIXED":
-                acc = r.get("fixed_account_code", "")
-            elif acc_type == "LOOKUP":
-                item_group_info = POSTING_GROUPS.get(item_group, {})
-                if item_group_info.get("posting_group_type") == "ITEM_GROUP":
-                    acc = GL_MAPPING.get(item_group, {}).get(role_key, "")
-                else:
-                    acc = GL_MAPPING.get(partner_group, {}).get(role_key, "")
+            if r.source_type == "FIXED":
+                acc = r.fixed_account_code
+            elif r.source_type == "LOOKUP":
+                acc = lookup_mapping.get(r.role_key, "")
 
             entries.append({
-                "side": r["side"],
+                "side": r.side,
                 "account": acc,
-                "priority": r["priority"],
-                "description": r.get("description", ""),
-                "is_lookup": acc_type == "LOOKUP"
+                "priority": r.priority,
+                "description": r.description,
+                "is_lookup": r.source_type == "LOOKUP"
             })
         return entries
 
+    @staticmethod
+    def resolve_batch(txs, item_groups, partner_groups) -> list:
+        """
+        Resolve bút toán cho nhiều dòng (vd: posting cuối ngày).
+
+        Mỗi tổ hợp (tx, item_group, partner_group) chỉ resolve 1 lần,
+        các dòng trùng nhận bản copy của kết quả.
+
+        Returns:
+            List entries theo đúng thứ tự input
+        """
+        resolved = {}
+        results = []
+        for key in zip(txs, item_groups, partner_groups):
+            entries = resolved.get(key)
+            if entries is None:
+                entries = resolved[key] = PostingEngineResolver.resolve(*key)
+            results.append([e.copy() for e in entries])
+        return results
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def resolve_columns(tx, item_group, partner_group) -> ResolvedEntries:
+        """Resolve + lookup tên TK + dựng text prompt 1 lần cho mỗi tổ hợp (cached)"""
+        entries = PostingEngineResolver.resolve(tx, item_group, partner_group)
+        accounts = tuple(e["account"] for e in entries)
+        account_names = tuple(ACCOUNT_NAMES.get(acc, acc) for acc in accounts)
+        sides = tuple("Nợ" if e["side"] == "DEBIT" else "Có" for e in entries)
+        is_lookup = tuple(e["is_lookup"] for e in entries)
+        prompt_text = "\n".join(
+            f"- {side} TK {acc}: {name}{' (*)' if lookup else ''}"
+            for acc, name, side, lookup in zip(accounts, account_names, sides, is_lookup)
+        )
+        return ResolvedEntries(accounts, account_names, sides, is_lookup, prompt_text, any(is_lookup))
+
+
+# =============================================================================
+# LAZY SINGLETON
+# =============================================================================
+
+# Không build graph/retriever lúc import - chỉ build khi retrieve lần đầu
+_mini_rag_retriever = None
+_mini_rag_lock = threading.Lock()
+
+
+def get_mini_rag_retriever() -> MiniRAGRetriever:
+    """Get MiniRAGRetriever singleton (lazy, thread-safe: /ask chạy mỗi request trên 1 thread)"""
+    global _mini_rag_retriever
+    if _mini_rag_retriever is None:
+        with _mini_rag_lock:
+            if _mini_rag_retriever is None:
+                _mini_rag_retriever = MiniRAGRetriever(MiniRAGGraph())
+    return _mini_rag_retriever
+
+
+def __getattr__(name):
+    """PEP 562: MINI_RAG_RETRIEVER / MINI_RAG_GRAPH được tạo lazy khi truy cập"""
+    if name == "MINI_RAG_RETRIEVER":
+        return get_mini_rag_retriever()
+    if name == "MINI_RAG_GRAPH":
+        return get_mini_rag_retriever().graph
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # =============================================================================
 # POSTING ENGINE AGENT
@@ -239,10 +432,12 @@ class PostingEngineAgent(BaseAgent):
 
     def __init__(self):
         super().__init__()
-        self._graph = MiniRAGGraph()
-        self._retriever = MiniRAGRetriever(self._graph)
         self._init_tools()
 
+    @property
+    def _retriever(self) -> "MiniRAGRetriever":
+        return get_mini_rag_retriever()
+
     @property
     def name(self) -> str:
         return "POSTING_ENGINE"
@@ -290,23 +485,20 @@ class PostingEngineAgent(BaseAgent):
         """
         question = context.question.lower()
 
-        posting_keywords = [
-            "hạch toán", "định khoản", "bút toán", "nghiệp vụ",
-            "xuất hóa đơn", "nhập kho", "phiếu thu", "phiếu chi",
-            "bán hàng", "mua hàng", "thu tiền", "chi tiền",
-            "xuất kho", "nhập hàng", "giao hàng", "nhận hàng",
-            "thanh toán", "công nợ", "phải thu", "phải trả",
-            "gtgt", "thuế", "giá vốn"
-        ]
-
-        matches = sum(1 for kw in posting_keywords if kw in question)
+        # Chỉ cần biết 0 / 1 / >=2 matches -> dừng scan khi đủ 2
+        matches = 0
+        for kw in POSTING_KEYWORDS:
+            if kw in question:
+                matches += 1
+                if matches >= 2:
+                    break
 
         confidence = 0.0
         if matches >= 2:
             confidence = 0.95
         elif matches == 1:
             confidence = 0.80
-        elif any(kw in question for kw in ["tk ", " tk", "tài khoản"]):
+        elif any(kw in question for kw in ACCOUNT_HINT_KEYWORDS):
             # Might be COA, but could be posting
             confidence = 0.40
 
@@ -323,26 +515,15 @@ class PostingEngineAgent(BaseAgent):
         tx = result["transaction"]
 
         # 2. Resolve
-        entries = PostingEngineResolver.resolve(tx, item_group, partner_group)
+        resolved = PostingEngineResolver.resolve_columns(tx, item_group, partner_group)
 
-        # 3. Build entries text and list LOOKUP accounts
-        entries_list = []
-        lookup_accounts = []
-        for e in sorted(entries, key=lambda x: x["priority"]):
-            acc = e["account"]
-            acc_name = ACCOUNT_NAMES.get(acc, acc)
-            side = "Nợ" if e["side"] == "DEBIT" else "Có"
-            marker = " (*)" if e.get("is_lookup") else ""
-            entries_list.append(f"- {side} TK {acc}: {acc_name}{marker}")
-            if e.get("is_lookup"):
-                lookup_accounts.append(f"TK {acc}")
-
-        entries_text = "\n".join(entries_list)
+        # 3. Entries text (dựng sẵn + cache theo tx/item_group/partner_group)
+        entries_text = resolved.prompt_text
         tx_name = TRANSACTION_NAMES.get(tx, tx)
 
         # Build lookup instructions
         lookup_instruction = ""
-        if lookup_accounts:
+        if resolved.has_lookup:
             lookup_instruction = f"\n\nLưu ý: Các tài khoản có dấu (*) là LOOKUP, phụ thuộc item_group/partner_group."
 
         # Dùng template cụ thể cho từng nghiệp vụ
@@ -385,7 +566,7 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ 4 phần theo format:
             content = response.get("message", {}).get("content", "")
 
             # Add notes
-            content += self._generate_notes(entries)
+            content += self._generate_notes(resolved)
 
             return AgentResult(
                 agent_name=self.name,
@@ -395,10 +576,10 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ 4 phần theo format:
                 sources=[f"Posting Engine - {tx_name}"]
             )
         except Exception as e:
-            print(f"[PostingEngineAgent Error] {e}")
+            logger.error("[PostingEngineAgent Error] %s", e)
             return AgentResult(
                 agent_name=self.name,
-                content=self._generate_fallback(tx_name, entries),
+                content=self._generate_fallback(tx_name, resolved),
                 confidence=0.7,
                 metadata={"transaction": tx}
             )
@@ -414,26 +595,15 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ 4 phần theo format:
         tx = result["transaction"]
 
         # 2. Resolve
-        entries = PostingEngineResolver.resolve(tx, item_group, partner_group)
+        resolved = PostingEngineResolver.resolve_columns(tx, item_group, partner_group)
 
-        # 3. Build entries text and list LOOKUP accounts
-        entries_list = []
-        lookup_accounts = []
-        for e in sorted(entries, key=lambda x: x["priority"]):
-            acc = e["account"]
-            acc_name = ACCOUNT_NAMES.get(acc, acc)
-            side = "Nợ" if e["side"] == "DEBIT" else "Có"
-            marker = " (*)" if e.get("is_lookup") else ""
-            entries_list.append(f"- {side} TK {acc}: {acc_name}{marker}")
-            if e.get("is_lookup"):
-                lookup_accounts.append(f"TK {acc}")
-
-        entries_text = "\n".join(entries_list)
+        # 3. Entries text (dựng sẵn + cache theo tx/item_group/partner_group)
+        entries_text = resolved.prompt_text
         tx_name = TRANSACTION_NAMES.get(tx, tx)
 
         # Build lookup instructions
         lookup_instruction = ""
-        if lookup_accounts:
+        if resolved.has_lookup:
             lookup_instruction = f"\n\nLưu ý: Các tài khoản có dấu (*) là LOOKUP, phụ thuộc item_group/partner_group."
 
         # Dùng template cụ thể cho từng nghiệp vụ
@@ -457,7 +627,6 @@ BÚT TOÁN TỪ HỆ THỐNG:
 YÊU CẦU: Trả lời ĐẦY ĐỦ 4 phần theo format:
 {response_template}"""
 
-        full_response = ""
         try:
             client = get_ollama_client()
             stream = client.chat(
@@ -470,43 +639,43 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ 4 phần theo format:
                 stream=True
             )
 
-            # Debug: collect first few chunks
+            # Debug: đếm chunk/độ dài thay vì giữ full response trong RAM
             chunk_count = 0
+            response_len = 0
             for char in stream_by_char(stream):
                 if chunk_count == 0:
-                    print(f"[PostingEngineAgent Stream DEBUG] First char received: '{char}'")
+                    logger.debug("[PostingEngineAgent Stream DEBUG] First char received: '%s'", char)
                 chunk_count += 1
-                full_response += char
+                response_len += len(char)
                 yield char
 
-            print(f"[PostingEngineAgent Stream DEBUG] Total chunks received: {chunk_count}")
-            print(f"[PostingEngineAgent Stream DEBUG] Full response length: {len(full_response)}")
+            logger.debug("[PostingEngineAgent Stream DEBUG] Total chunks received: %s", chunk_count)
+            logger.debug("[PostingEngineAgent Stream DEBUG] Full response length: %s", response_len)
 
         except Exception as e:
-            print(f"[PostingEngineAgent Stream Error] {e}")
+            logger.error("[PostingEngineAgent Stream Error] %s", e)
 
         # Add notes
-        notes = self._generate_notes(entries)
-        full_response += notes
+        notes = self._generate_notes(resolved)
         yield notes
 
-    def _generate_fallback(self, tx_name, entries):
+    def _generate_fallback(self, tx_name, resolved: ResolvedEntries):
         """Fallback khi SLM không hoạt động"""
         lines = [f"1. TÊN NGHIỆP VỤ:\n{tx_name}", "", "2. BẢNG BÚT TOÁN:"]
-        for e in entries:
-            side = "Nợ" if e["side"] == "DEBIT" else "Có"
-            lines.append(f"- {side} TK {e['account']}: {ACCOUNT_NAMES.get(e['account'], e['account'])}")
+        lines.extend(
+            f"- {side} TK {acc}: {acc_name}"
+            for acc, acc_name, side in zip(resolved.accounts, resolved.account_names, resolved.sides)
+        )
         return "\n".join(lines)
 
-    def _generate_notes(self, entries):
+    def _generate_notes(self, resolved: ResolvedEntries):
         """Generate notes for entries"""
         notes = []
 
-        has_lookup = any(e.get("is_lookup") for e in entries)
-        if has_lookup:
+        if resolved.has_lookup:
             notes.append("\n\nGhi chú: Các dòng có dấu (*) là các dòng được cấu hình `account_source_type` = `LOOKUP`. Hệ thống sẽ dựa vào nhóm sản phẩm `(Item Group)` hoặc nhóm đối tác `(Partner Group)` để xác định tài khoản cụ thể.")
 
-        has_clearing = any(e["account"] in ["13881", "33881"] for e in entries)
+        has_clearing = "13881" in resolved.accounts or "33881" in resolved.accounts
         if has_clearing:
             notes.append("\n\nLưu ý: Tài khoản `13881` và `33881` là các tài khoản trung gian (Clearing Accounts) được định nghĩa trong Posting Engine để xử lý độ trễ giữa thời điểm giao/nhận hàng và thời điểm xuất/nhận hóa đơn.")
 
@@ -518,7 +687,7 @@ YÊU CẦU: Trả lời ĐẦY ĐỦ 4 phần theo format:
 
     def _tool_classify_transaction(self, query: str) -> dict:
         """Tool: Phân loại nghiệp vụ"""
-        return self._retriever.retrieve(query)
+        return self._retriever.retrieve(query, debug=True)
 
     def _tool_resolve_journal_entries(self, tx: str, item_group: str = "GOODS", partner_group: str = "CUSTOMER") -> list:
         """Tool: Giải quyết bút toán"""
@@ -24,20 +24,22 @@ async def ask(
 ):
     from fastapi import HTTPException
     from app.pipeline import get_module_router
+    from app.services.stream_utils import iterate_in_thread
 
     if not x_user_id:
         raise HTTPException(status_code=401, detail="X-User-Id header is required")
 
     router = get_module_router()
 
+    # Pipeline đồng bộ chạy trong 1 thread riêng, event loop chỉ nhận chunk qua queue
     return StreamingResponse(
-        router.route_and_process(
+        iterate_in_thread(router.route_and_process(
             question=request.question,
             user_id=x_user_id,
             session_id=request.session_id,
             chat_type=request.chat_type,
             item_group=request.item_group,
             partner_group=request.partner_group,
-        ),
+        )),
         media_type="text/plain; charset=utf-8"
     )
@@ -1,17 +1,44 @@
+from typing import List
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "BFLOW AI"
+    # Log level: trace từng request (pipeline, router, posting) ở DEBUG -> prod để INFO là bỏ qua hết
+    LOG_LEVEL: str = "INFO"
+    # CORS: danh sách origin được phép (JSON trong env, VD: ["https://bflow.vn"]); ["*"] = mọi origin
+    CORS_ORIGINS: List[str] = ["*"]
+    # Bật khi frontend gửi cookie/credentials (khi đó "*" phải echo origin mỗi request -> nên dùng allowlist)
+    CORS_ALLOW_CREDENTIALS: bool = False
 
     # MongoDB Configuration
     MONGO_URL: str = "mongodb://localhost:27017/bflow_db"
 
     # Ollama Configuration
     OLLAMA_HOST: str = "http://localhost:11434"
+    OLLAMA_TIMEOUT: float = 60.0  # Timeout (s) cho HTTP client dùng chung
+    # Thời gian Ollama giữ model trong RAM/VRAM sau mỗi request (tránh cold load giữa các lượt hỏi)
+    OLLAMA_KEEP_ALIVE: str = "15m"
 
     # Model config
     CLASSIFIER_MODEL: str = "qwen2.5:0.5b"
     GENERATION_MODEL: str = "qwen2.5:1.5b"
+    # Model cho routing/phân loại (structured output vài token) - model nhỏ, tag mặc định của Ollama là Q4_K_M
+    ROUTER_MODEL: str = "qwen2.5:0.5b"
+    # Load sẵn model vào Ollama lúc startup (keep_alive=-1) để request đầu không chờ cold load
+    PRELOAD_MODELS: bool = True
+
+    # Embedding device: "" = tự chọn (cuda > mps > cpu), hoặc "cuda", "mps", "cpu"
+    EMBEDDING_DEVICE: str = ""
+    EMBEDDING_FP16: bool = True  # Chạy model FP16 khi device là CUDA
+    # Embedding backend: "torch" (mặc định) hoặc "onnx" (int8 quantized, nhanh hơn trên CPU)
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_ONNX_PATH: str = ""  # Thư mục model đã export bằng export_int8_onnx(); trống = model gốc
+    EMBEDDING_ONNX_FILE: str = "onnx/model_qint8_avx512_vnni.onnx"
+    # Micro-batch câu hỏi từ các request đồng thời (ms chờ gom batch); 0 = tắt, encode từng câu
+    EMBEDDING_BATCH_WINDOW_MS: float = 5.0
+    # Cache embedding matrix (.npy, mmap) của corpus tĩnh (COA, nghiệp vụ): "" = ~/.cache/bflow
+    RAG_CACHE_DIR: str = ""
 
     # Ollama generation options
     OLLAMA_OPTIONS: dict = {
@@ -41,6 +68,8 @@ class Settings(BaseSettings):
     REDIS_DB: int = 0
     REDIS_PASSWORD: str = ""  # Optional password
     USE_REDIS: bool = True  # Enable/disable Redis (fallback to in-memory/file)
+    # Flush Redis db + streaming cache khi khởi động (chỉ bật cho dev/debug; prod giữ cache warm)
+    CLEAR_CACHE_ON_STARTUP: bool = False
 
     # LLM Cache Configuration
     ENABLE_LLM_CACHE: bool = True
@@ -48,8 +77,14 @@ class Settings(BaseSettings):
     MAX_CACHE_SIZE: int = 100  # Maximum cached responses (in-memory fallback)
 
     # Cache simulate streaming settings
-    CACHE_SIMULATE_DELAY: float = 0.02  # Delay between chunks (seconds)
-    CACHE_CHARS_PER_CHUNK: int = 1      # Characters per chunk (=1 for char-by-char)
+    CACHE_SIMULATE_DELAY: float = 0.02  # Delay tối đa giữa các chunks (seconds)
+    CACHE_CHARS_PER_CHUNK: int = 24     # Số ký tự tối thiểu mỗi chunk (gom theo từ, không cắt giữa từ)
+    CACHE_SIMULATE_MAX_SECONDS: float = 2.0  # Tổng thời gian simulate tối đa; response dài -> delay/chunk giảm
+
+    # /ask streaming: số stream chạy song song (mỗi stream giữ 1 thread suốt câu trả lời)
+    STREAM_WORKERS: int = 64
+    # Số chunk tối đa chờ trong queue mỗi stream (client đọc chậm -> producer chờ)
+    STREAM_QUEUE_SIZE: int = 64
 
     # Semantic History Matching
     ENABLE_SEMANTIC_HISTORY: bool = True
@@ -0,0 +1,128 @@
+"""
+FastCORS - CORS middleware thuần ASGI
+
+Thay cho starlette CORSMiddleware (allow_credentials, allow_methods/headers="*"):
+- Header CORS build sẵn thành tuple bytes 1 lần trong __init__, mỗi response chỉ nối list
+- Origin allowlist là frozenset bytes: check 1 lần membership O(1), "*" = cho phép mọi origin
+- allow_credentials=False (mặc định, app không dùng cookie/auth header): "*" là header hằng,
+  không đọc Origin/Cookie của request để echo
+- Preflight (OPTIONS) trả 204 không body từ header dựng sẵn, chặn trước routing
+  (không tạo Request/Response object, không cần route @app.options)
+- Response thường: chỉ bọc send để chèn header vào http.response.start
+
+Usage:
+    from app.core.cors import FastCORS
+
+    app.add_middleware(
+        FastCORS, allow_origins=settings.CORS_ORIGINS, allow_credentials=settings.CORS_ALLOW_CREDENTIALS
+    )
+"""
+from typing import Iterable, List, Tuple
+
+Header = Tuple[bytes, bytes]
+
+ALL_METHODS = ("DELETE", "GET", "HEAD", "OPTIONS", "PATCH", "POST", "PUT")
+PREFLIGHT_MAX_AGE = 600
+
+
+def _get_header(scope, name: bytes) -> bytes:
+    """Lấy header (lowercase name) từ ASGI scope, b"" nếu không có"""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return b""
+
+
+class FastCORS:
+    """Pure ASGI CORS middleware với header precomputed"""
+
+    def __init__(
+        self,
+        app,
+        allow_origins: Iterable[str] = ("*",),
+        allow_credentials: bool = False,
+        allow_methods: Iterable[str] = ALL_METHODS,
+    ):
+        self.app = app
+        self.allow_credentials = allow_credentials
+        allow_origins = list(allow_origins)
+        self._allow_all_origins = "*" in allow_origins
+        self._origins = frozenset(origin.encode("latin-1") for origin in allow_origins)
+
+        credentials: List[Header] = [(b"access-control-allow-credentials", b"true")] if allow_credentials else []
+        # Response thường (không cookie): origin "*", không cần Vary
+        self._simple_headers: List[Header] = [(b"access-control-allow-origin", b"*")] + credentials
+        self._credential_headers: List[Header] = credentials
+        self._preflight_headers: List[Header] = [
+            (b"access-control-allow-methods", ", ".join(allow_methods).encode("latin-1")),
+            (b"access-control-max-age", str(PREFLIGHT_MAX_AGE).encode("latin-1")),
+            (b"vary", b"Origin"),
+        ] + credentials
+        # "*" không credentials: preflight hằng cho mọi origin (allow-headers "*" hợp lệ khi không credentials)
+        self._constant_preflight = self._allow_all_origins and not allow_credentials
+        self._static_preflight_headers: List[Header] = [
+            (b"access-control-allow-origin", b"*"),
+            (b"access-control-allow-methods", ", ".join(allow_methods).encode("latin-1")),
+            (b"access-control-allow-headers", b"*"),
+            (b"access-control-max-age", str(PREFLIGHT_MAX_AGE).encode("latin-1")),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = _get_header(scope, b"origin")
+        if not origin:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and _get_header(scope, b"access-control-request-method"):
+            await self._preflight(scope, origin, send)
+            return
+
+        if not self._allow_all_origins:
+            if origin not in self._origins:
+                # Origin ngoài allowlist: không gắn header CORS (browser tự chặn)
+                await self.app(scope, receive, send)
+                return
+            cors_headers = [(b"access-control-allow-origin", origin), (b"vary", b"Origin")] + self._credential_headers
+        elif self.allow_credentials and _get_header(scope, b"cookie"):
+            # Request có cookie: browser không chấp nhận "*" -> echo origin + Vary
+            cors_headers = [(b"access-control-allow-origin", origin), (b"vary", b"Origin")] + self._credential_headers
+        else:
+            # Không credentials: "*" dùng chung cho mọi origin -> không cần Vary: Origin
+            cors_headers = self._simple_headers
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + cors_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def _preflight(self, scope, origin: bytes, send):
+        if self._constant_preflight:
+            await send({"type": "http.response.start", "status": 204, "headers": self._static_preflight_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if not self._allow_all_origins and origin not in self._origins:
+            body = b"Disallowed CORS origin"
+            await send({
+                "type": "http.response.start",
+                "status": 400,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode("latin-1"))],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        headers = [(b"access-control-allow-origin", origin)] + self._preflight_headers
+        # allow_headers="*": echo đúng các header browser xin (kèm credentials không dùng được "*")
+        requested_headers = _get_header(scope, b"access-control-request-headers")
+        if requested_headers:
+            headers.append((b"access-control-allow-headers", requested_headers))
+
+        await send({"type": "http.response.start", "status": 204, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
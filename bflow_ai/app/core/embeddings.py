@@ -8,6 +8,10 @@ Features:
 1. Singleton model instance
 2. LRU cache cho embedding computation
 3. Batch encoding support
+4. Pin model lên GPU (CUDA/MPS) nếu có - config EMBEDDING_DEVICE (CUDA chạy FP16 - EMBEDDING_FP16)
+5. ONNX Runtime int8 cho CPU - config EMBEDDING_BACKEND=onnx
+   (export 1 lần: python -c "from app.core.embeddings import export_int8_onnx; export_int8_onnx('models/embed_int8')")
+6. Micro-batch câu hỏi từ các request đồng thời thành 1 lần encode - config EMBEDDING_BATCH_WINDOW_MS
 
 Usage:
     from app.core.embeddings import get_embed_model
@@ -17,13 +21,29 @@ Usage:
     # hoặc dùng cached:
     from app.core.embeddings import encode_cached
     embedding = encode_cached("text")
+    # câu hỏi của user (normalized, share trong request):
+    from app.core.embeddings import encode_query
+    query_emb = encode_query("TK 156 là gì?")
+    # corpus tĩnh (COA, nghiệp vụ) - cache .npy trên disk, lần sau mmap:
+    from app.core.embeddings import encode_batch_cached
+    matrix = encode_batch_cached(texts, "coa_99")
 """
+import hashlib
+import json
+import os
 import threading
+import time
 from functools import lru_cache
 from typing import Optional, List, Union
 import numpy as np
+
+# Set trước khi import tokenizers: bật tokenize song song, tránh warning fork của HF tokenizers
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
 from sentence_transformers import SentenceTransformer
 
+from app.core.config import settings
+
 
 class EmbeddingService:
     """Singleton embedding model service"""
@@ -38,6 +58,19 @@ class EmbeddingService:
     # - "sentence-transformers/all-MiniLM-L6-v2" - Nhẹ nhất (~80MB)
     # - "bkai-foundation-models/vietnamese-bi-encoder" - Model hiện tại (nặng)
 
+    @staticmethod
+    def _resolve_device() -> str:
+        """Chọn device cho model: config > cuda > mps > cpu"""
+        if settings.EMBEDDING_DEVICE:
+            return settings.EMBEDDING_DEVICE
+
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+        return "cpu"
+
     @classmethod
     def get_model(cls) -> SentenceTransformer:
         """Get singleton embedding model instance"""
@@ -45,8 +78,23 @@ class EmbeddingService:
             with cls._lock:
                 # Double-check locking
                 if cls._model is None:
-                    print(f"[EmbeddingService] Loading model: {cls._model_name}")
-                    cls._model = SentenceTransformer(cls._model_name)
+                    if settings.EMBEDDING_BACKEND == "onnx":
+                        # int8 ONNX chạy trên CPUExecutionProvider
+                        model_path = settings.EMBEDDING_ONNX_PATH or cls._model_name
+                        print(f"[EmbeddingService] Loading ONNX model: {model_path} ({settings.EMBEDDING_ONNX_FILE})")
+                        cls._model = SentenceTransformer(
+                            model_path,
+                            device="cpu",
+                            backend="onnx",
+                            model_kwargs={"file_name": settings.EMBEDDING_ONNX_FILE},
+                        )
+                    else:
+                        device = cls._resolve_device()
+                        print(f"[EmbeddingService] Loading model: {cls._model_name} (device: {device})")
+                        cls._model = SentenceTransformer(cls._model_name, device=device)
+                        if device.startswith("cuda") and settings.EMBEDDING_FP16:
+                            # FP16 trên GPU: nửa VRAM/bandwidth, tensor core nhanh hơn fp32
+                            cls._model.half()
                     print(f"[EmbeddingService] Model loaded successfully")
         return cls._model
 
@@ -57,6 +105,29 @@ class EmbeddingService:
             cls._model = None
 
 
+def export_int8_onnx(output_dir: str, quantization_config: str = "avx512_vnni") -> str:
+    """
+    Export model sang ONNX + dynamic int8 quantization (chạy 1 lần, offline).
+
+    Sau khi export, set EMBEDDING_BACKEND=onnx và EMBEDDING_ONNX_PATH=output_dir.
+    File quantized nằm ở {output_dir}/onnx/model_qint8_{quantization_config}.onnx.
+
+    Args:
+        output_dir: Thư mục lưu model
+        quantization_config: "avx512_vnni", "avx512", "avx2" hoặc "arm64"
+
+    Returns:
+        output_dir
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    model = SentenceTransformer(EmbeddingService._model_name, device="cpu", backend="onnx")
+    model.save(output_dir)
+    export_dynamic_quantized_onnx_model(model, quantization_config, output_dir)
+    print(f"[EmbeddingService] Exported int8 ONNX model to {output_dir}")
+    return output_dir
+
+
 # Convenience function
 def get_embed_model() -> SentenceTransformer:
     """Get singleton embedding model"""
@@ -82,6 +153,127 @@ def encode_cached(text: str) -> np.ndarray:
     return model.encode(text)
 
 
+class _QueryBatcher:
+    """
+    Gom câu hỏi từ các thread (request đồng thời) thành 1 lần model.encode.
+
+    Thread đầu tiên làm "leader": nếu đang có encode khác chạy (có tải đồng thời) thì chờ
+    window_ms để các thread khác kịp xếp hàng; không có thì encode ngay (1 user không tốn window).
+    Leader lấy tối đa max_batch câu, phần dư giao cho thread đầu hàng đợi làm leader batch kế.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int = 32):
+        self._window = window_ms / 1000.0
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: list = []
+        self._leader_active = False
+        self._in_flight = 0  # Số batch đang model.encode
+
+    def encode(self, text: str) -> np.ndarray:
+        slot = {"event": threading.Event()}
+        with self._lock:
+            self._pending.append((text, slot))
+            is_leader = not self._leader_active
+            if is_leader:
+                self._leader_active = True
+
+        if is_leader:
+            self._lead()
+
+        while True:
+            slot["event"].wait()
+            if not slot.pop("lead", False):
+                break
+            # Được giao làm leader cho phần dư: slot của thread này nằm đầu batch kế
+            slot["event"].clear()
+            self._lead()
+
+        if "error" in slot:
+            raise slot["error"]
+        return slot["result"]
+
+    def _lead(self):
+        """Gom (chờ window nếu có tải) + encode tối đa max_batch câu đang chờ"""
+        with self._lock:
+            wait = self._in_flight > 0 and len(self._pending) < self._max_batch
+        if wait:
+            time.sleep(self._window)
+
+        with self._lock:
+            batch, self._pending = self._pending[:self._max_batch], self._pending[self._max_batch:]
+            if self._pending:
+                next_slot = self._pending[0][1]
+                next_slot["lead"] = True
+                next_slot["event"].set()
+            else:
+                self._leader_active = False
+            self._in_flight += 1
+        try:
+            self._run(batch)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _run(self, batch: list):
+        try:
+            model = get_embed_model()
+            embeddings = model.encode(
+                [text for text, _ in batch],
+                batch_size=self._max_batch,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+            for (_, slot), embedding in zip(batch, embeddings):
+                slot["result"] = embedding
+        except Exception as e:
+            for _, slot in batch:
+                slot["error"] = e
+        finally:
+            for _, slot in batch:
+                slot["event"].set()
+
+
+_query_batcher = (
+    _QueryBatcher(settings.EMBEDDING_BATCH_WINDOW_MS) if settings.EMBEDDING_BATCH_WINDOW_MS > 0 else None
+)
+
+
+def encode_query(text: str) -> np.ndarray:
+    """
+    Encode câu hỏi (normalized) với LRU cache.
+
+    Trong 1 request, router, retriever, COA search... cùng encode 1 câu hỏi.
+    Dùng chung cache này để model chỉ chạy 1 forward pass cho câu hỏi đó.
+    Cache key gộp khoảng trắng thừa ("TK 156  là gì? " == "TK 156 là gì?");
+    không lowercase vì model phân biệt hoa/thường.
+
+    Args:
+        text: Câu hỏi
+
+    Returns:
+        Normalized embedding vector float32 (read-only, vì được share giữa các caller);
+        dùng trực tiếp trong matmul, không cần np.asarray/astype lại
+    """
+    return _encode_query_cached(" ".join(text.split()))
+
+
+@lru_cache(maxsize=4096)
+def _encode_query_cached(text: str) -> np.ndarray:
+    if _query_batcher is not None:
+        # Request đồng thời -> 1 forward pass cho cả batch
+        embedding = _query_batcher.encode(text)
+    else:
+        model = get_embed_model()
+        embedding = model.encode(text, normalize_embeddings=True, convert_to_numpy=True)
+    # Model fp16 (CUDA) trả float16 -> ép float32 để dot với corpus matrix không upcast mỗi lần.
+    # Đã là float32 (CPU) thì chỉ đổi dtype khi cần, không copy
+    if embedding.dtype != np.float32:
+        embedding = embedding.astype(np.float32)
+    embedding.setflags(write=False)
+    return embedding
+
+
 def encode_batch(texts: List[str], normalize: bool = True) -> np.ndarray:
     """
     Encode batch texts efficiently.
@@ -91,10 +283,68 @@ def encode_batch(texts: List[str], normalize: bool = True) -> np.ndarray:
         normalize: Normalize embeddings (recommended for cosine similarity)
 
     Returns:
-        Embedding matrix (n_texts, embedding_dim)
+        Embedding matrix (n_texts, embedding_dim), float32 C-contiguous
+        (dot product với query không phải copy/upcast)
     """
     model = get_embed_model()
-    return model.encode(texts, normalize_embeddings=normalize)
+    embeddings = model.encode(texts, normalize_embeddings=normalize, convert_to_numpy=True)
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def _matrix_cache_path(texts: List[str], name: str) -> str:
+    """
+    Đường dẫn file cache, key = hash(model + backend + texts).
+
+    Text/model đổi -> hash đổi -> tự encode lại, không cần xóa cache tay.
+    """
+    key_data = {
+        "model": EmbeddingService._model_name,
+        "backend": settings.EMBEDDING_BACKEND,
+        "onnx": [settings.EMBEDDING_ONNX_PATH, settings.EMBEDDING_ONNX_FILE],
+        "texts": texts,
+    }
+    config_hash = hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:16]
+    cache_dir = settings.RAG_CACHE_DIR or os.path.join(os.path.expanduser("~"), ".cache", "bflow")
+    return os.path.join(cache_dir, f"{name}_{config_hash}.npy")
+
+
+def encode_batch_cached(texts: List[str], name: str) -> np.ndarray:
+    """
+    Encode corpus tĩnh (normalized) với cache .npy trên disk.
+
+    Lần đầu: batch encode + lưu file. Các lần sau (restart, worker khác): np.load mmap,
+    không cần load model, các worker share page cache.
+
+    Args:
+        texts: List of input texts
+        name: Tên corpus (prefix file cache)
+
+    Returns:
+        Embedding matrix (n_texts, embedding_dim), float32 (read-only nếu load từ cache)
+    """
+    cache_path = _matrix_cache_path(texts, name)
+    if os.path.exists(cache_path):
+        try:
+            matrix = np.load(cache_path, mmap_mode="r")
+            if matrix.shape[0] == len(texts):
+                print(f"[EmbeddingService] Loaded cache: {cache_path}")
+                return matrix
+        except Exception as e:
+            print(f"[EmbeddingService] Cache load error: {e}")
+
+    matrix = encode_batch(texts, normalize=True)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Ghi file tạm rồi rename để worker khác không đọc file ghi dở
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"[EmbeddingService] Cache save error: {e}")
+    return matrix
 
 
 def encode_single(text: str, normalize: bool = True) -> np.ndarray:
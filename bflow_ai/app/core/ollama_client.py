@@ -2,7 +2,8 @@
 Ollama Client Pool - Singleton connection pooling cho Ollama
 
 Thay vì tạo ollama.Client() mới mỗi request (chậm),
-dùng singleton này để reuse connection.
+dùng singleton này để reuse connection (HTTP keep-alive).
+chat/generate mặc định gửi keep_alive=OLLAMA_KEEP_ALIVE để Ollama không unload model giữa các request.
 
 Usage:
     from app.core.ollama_client import get_ollama_client
@@ -16,6 +17,18 @@ import ollama
 from app.core.config import settings
 
 
+class _KeepAliveClient(ollama.Client):
+    """ollama.Client với keep_alive mặc định cho chat/generate (caller truyền keep_alive thì giữ nguyên)"""
+
+    def chat(self, *args, **kwargs):
+        kwargs.setdefault("keep_alive", settings.OLLAMA_KEEP_ALIVE)
+        return super().chat(*args, **kwargs)
+
+    def generate(self, *args, **kwargs):
+        kwargs.setdefault("keep_alive", settings.OLLAMA_KEEP_ALIVE)
+        return super().generate(*args, **kwargs)
+
+
 class OllamaClientPool:
     """Singleton Ollama client pool"""
 
@@ -30,7 +43,7 @@ class OllamaClientPool:
             with cls._lock:
                 # Double-check locking
                 if cls._instance is None:
-                    cls._instance = ollama.Client(host=cls._host)
+                    cls._instance = _KeepAliveClient(host=cls._host, timeout=settings.OLLAMA_TIMEOUT)
                     print(f"[OllamaPool] Created singleton client for {cls._host}")
         return cls._instance
 
@@ -45,3 +58,18 @@ class OllamaClientPool:
 def get_ollama_client() -> ollama.Client:
     """Get singleton ollama client"""
     return OllamaClientPool.get_client()
+
+
+def preload_models(*models: str):
+    """
+    Load sẵn model vào Ollama (prompt rỗng + keep_alive=-1 -> giữ model trong RAM/VRAM).
+
+    Gọi lúc startup để request đầu tiên không phải chờ cold load vài giây.
+    """
+    client = get_ollama_client()
+    for model in dict.fromkeys(models):  # bỏ trùng, giữ thứ tự
+        try:
+            client.generate(model=model, prompt="", keep_alive=-1)
+            print(f"[OllamaPool] Preloaded model: {model}")
+        except Exception as e:
+            print(f"[OllamaPool] Preload {model} failed: {e}")
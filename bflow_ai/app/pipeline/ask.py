@@ -9,6 +9,28 @@ Flow:
 
 Mỗi bước là 1 class riêng với các methods rõ ràng.
 """
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# PRECOMPILED PATTERNS - compile 1 lần lúc import, không compile lại mỗi request
+# =============================================================================
+
+_ACCOUNT_NUMBER_RE = re.compile(r'\b\d{3,5}\b')
+_ENTRY_LINE_RE = re.compile(r'-?\s*(Nợ|Có)\s+TK\s+(\d+):')
+_EXAMPLE_HEADER_RE = re.compile(r'^4\.\s*VÍ DỤ:')
+_SECTION_RE = re.compile(r'^\d+\.')
+
+_COMPARE_KEYWORDS = ("so sánh", "khác gì", "khác nhau")
+_POSTING_KEYWORDS = (
+    "hạch toán", "định khoản", "bút toán", "ghi nhận",
+    "phiếu thu", "phiếu chi", "xuất hóa đơn"
+)
+_CIRCULAR_KEYWORDS = ("tt99", "tt200", "thông tư")
+
 
 # =============================================================================
 # STEP 1: SESSION MANAGEMENT
@@ -43,9 +65,9 @@ class SessionManagerStep:
         """
         if not session_id:
             session_id = self.sm.create_session()
-            print(f"[SessionStep] Created new session: {session_id}")
+            logger.debug("[SessionStep] Created new session: %s", session_id)
         else:
-            print(f"[SessionStep] Using existing session: {session_id}")
+            logger.debug("[SessionStep] Using existing session: %s", session_id)
 
         return session_id
 
@@ -92,7 +114,7 @@ class SessionManagerStep:
             agent_name: Tên agent đã xử lý
         """
         self.sm.add_message(session_id, question, response, agent_name)
-        print(f"[SessionStep] Saved message to session {session_id}")
+        logger.debug("[SessionStep] Saved message to session %s", session_id)
 
 
 # =============================================================================
@@ -142,8 +164,8 @@ class ContextBuilderStep:
         else:
             mode_desc = "THINKING - Phân loại thông minh"
 
-        print(f"[ContextStep] Building context for: {mode_desc}")
-        print(f"[ContextStep] User ID: {user_id}")
+        logger.debug("[ContextStep] Building context for: %s", mode_desc)
+        logger.debug("[ContextStep] User ID: %s", user_id)
 
         # === BUILD CONTEXT OBJECT ===
         context = AgentContext(
@@ -196,7 +218,7 @@ class AgentRouterStep:
 
         # === CHẾ ĐỘ FREE: BỎ QUA ROUTING ===
         if context.chat_type == "free":
-            print("[RouterStep] Mode: FREE - Using GENERAL_FREE agent")
+            logger.debug("[RouterStep] Mode: FREE - Using GENERAL_FREE agent")
             return self.orchestrator.get_agent("GENERAL_FREE")
 
         # === STEP 3.1: FAST RULE-BASED ROUTING (O(1)) ===
@@ -215,7 +237,7 @@ class AgentRouterStep:
             return agent
 
         # === STEP 3.4: FINAL FALLBACK ===
-        print("[RouterStep] Using fallback: GENERAL_ACCOUNTING")
+        logger.warning("[RouterStep] Using fallback: GENERAL_ACCOUNTING")
         return self.orchestrator.get_agent("GENERAL_ACCOUNTING")
 
     def _fast_rule_based_routing(self, context):
@@ -233,33 +255,27 @@ class AgentRouterStep:
         Returns:
             Agent hoặc None
         """
-        import re
-
         question_lower = context.question.lower()
 
         # === RULE 1: CÓ SỐ TÀI KHOẢN ===
-        code_match = re.search(r'\b\d{3,5}\b', context.question)
+        code_match = _ACCOUNT_NUMBER_RE.search(context.question)
         if code_match:
-            if any(kw in question_lower for kw in ["so sánh", "khác gì", "khác nhau"]):
-                print("[RouterStep] Rule: COA (account + compare keyword)")
+            if any(kw in question_lower for kw in _COMPARE_KEYWORDS):
+                logger.debug("[RouterStep] Rule: COA (account + compare keyword)")
                 return self.orchestrator.get_agent("COA")
             else:
-                print("[RouterStep] Rule: COA (account number)")
+                logger.debug("[RouterStep] Rule: COA (account number)")
                 return self.orchestrator.get_agent("COA")
 
         # === RULE 2: KEYWORDS HẠCH TOÁN ===
-        posting_keywords = [
-            "hạch toán", "định khoản", "bút toán", "ghi nhận",
-            "phiếu thu", "phiếu chi", "xuất hóa đơn"
-        ]
-        if any(kw in question_lower for kw in posting_keywords):
-            print("[RouterStep] Rule: POSTING_ENGINE (posting keyword)")
+        if any(kw in question_lower for kw in _POSTING_KEYWORDS):
+            logger.debug("[RouterStep] Rule: POSTING_ENGINE (posting keyword)")
             return self.orchestrator.get_agent("POSTING_ENGINE")
 
         # === RULE 3: SO SÁNH THÔNG TƯ ===
-        if any(kw in question_lower for kw in ["tt99", "tt200", "thông tư"]):
+        if any(kw in question_lower for kw in _CIRCULAR_KEYWORDS):
             if "so sánh" in question_lower or "khác" in question_lower:
-                print("[RouterStep] Rule: COA (circular compare)")
+                logger.debug("[RouterStep] Rule: COA (circular compare)")
                 return self.orchestrator.get_agent("COA")
 
         return None
@@ -289,7 +305,7 @@ class AgentRouterStep:
 
             # Call LLM
             response = llm_service.chat(
-                model=settings.GENERATION_MODEL,
+                model=settings.ROUTER_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 format=schema,
                 use_cache=True  # Enable cache cho classification
@@ -302,13 +318,13 @@ class AgentRouterStep:
             agent_name = result.get("agent")
             reasoning = result.get("reasoning", "")
 
-            print(f"[RouterStep] SLM classified to: {agent_name}")
-            print(f"[RouterStep] Reasoning: {reasoning[:100]}...")
+            logger.debug("[RouterStep] SLM classified to: %s", agent_name)
+            logger.debug("[RouterStep] Reasoning: %s...", reasoning[:100])
 
             return self.orchestrator.get_agent(agent_name)
 
         except Exception as e:
-            print(f"[RouterStep] SLM Error: {e}")
+            logger.error("[RouterStep] SLM Error: %s", e)
             return None
 
     def _semantic_fallback(self, context):
@@ -324,45 +340,33 @@ class AgentRouterStep:
         import numpy as np
 
         try:
-            from ..core.embeddings import get_embed_model
+            from ..core.embeddings import encode_query
 
-            model = get_embed_model()
-
-            # Agent examples
-            agent_examples = {
-                "COA": ["TK 156 là gì?", "số hiệu 331", "danh mục tài khoản"],
-                "POSTING_ENGINE": ["bán hàng hạch toán", "định khoản thế nào"],
-                "GENERAL_ACCOUNTING": ["nguyên tắc kế toán", "báo cáo tài chính"],
-                "GENERAL_FREE": ["hello", "xin chào", "cảm ơn"]
-            }
-
-            # Get agent embeddings
+            # Centroid matrix (A, D) của các agent - build 1 lần
             if not hasattr(self, '_agent_embeddings'):
-                self._init_agent_embeddings(model)
+                self._init_agent_embeddings()
 
             # Encode query
-            query_emb = model.encode(context.question, normalize_embeddings=True)
-
-            # Find best match
-            scores = {}
-            for agent_name, data in self._agent_embeddings.items():
-                sim = float(np.dot(query_emb, data["centroid"]))
-                scores[agent_name] = sim
+            query_emb = encode_query(context.question)
 
-            best_agent = max(scores.keys(), key=lambda k: scores[k])
-            best_score = scores[best_agent]
+            # Similarity với tất cả centroid: 1 phép (A, D) @ (D,)
+            sims = self._agent_embeddings @ query_emb
+            best_idx = int(np.argmax(sims))
+            best_agent = self._agent_names[best_idx]
+            best_score = float(sims[best_idx])
 
             if best_score > 0.3:
-                print(f"[RouterStep] Semantic: {best_agent} (score: {best_score:.3f})")
+                logger.debug("[RouterStep] Semantic: %s (score: %.3f)", best_agent, best_score)
                 return self.orchestrator.get_agent(best_agent)
 
         except Exception as e:
-            print(f"[RouterStep] Semantic Error: {e}")
+            logger.error("[RouterStep] Semantic Error: %s", e)
 
         return None
 
-    def _init_agent_embeddings(self, model):
-        """Initialize agent embeddings."""
+    def _init_agent_embeddings(self):
+        """Initialize agent embeddings: 1 batch encode tất cả examples, centroid xếp thành matrix (A, D)."""
+        import numpy as np
         from ..core.embeddings import encode_batch
 
         agent_examples = {
@@ -372,13 +376,16 @@ class AgentRouterStep:
             "GENERAL_FREE": ["hello", "xin chào"]
         }
 
-        self._agent_embeddings = {}
-        for agent_name, examples in agent_examples.items():
-            embs = encode_batch(examples, normalize=True)
-            self._agent_embeddings[agent_name] = {
-                "embeddings": embs,
-                "centroid": np.mean(embs, axis=0)
-            }
+        names = list(agent_examples)
+        embeddings = encode_batch([ex for name in names for ex in agent_examples[name]], normalize=True)
+        centroids = []
+        start = 0
+        for name in names:
+            end = start + len(agent_examples[name])
+            centroids.append(embeddings[start:end].mean(axis=0))
+            start = end
+        self._agent_names = names
+        self._agent_embeddings = np.ascontiguousarray(np.stack(centroids), dtype=np.float32)
 
     def _build_classification_prompt(self, question: str) -> str:
         """Build classification prompt cho SLM."""
@@ -465,7 +472,7 @@ class HistorySearchStep:
         if not session_id:
             return None
 
-        print(f"[HistoryStep] Checking history (mode: {self.mode}, threshold: {self.threshold})")
+        logger.debug("[HistoryStep] Checking history (mode: %s, threshold: %s)", self.mode, self.threshold)
 
         # === GET HISTORY ===
         from ..services.session_manager import get_session_manager
@@ -473,7 +480,7 @@ class HistorySearchStep:
         history = sm.get_history(session_id, max_count=50)
 
         if not history:
-            print("[HistoryStep] No history found")
+            logger.debug("[HistoryStep] No history found")
             return None
 
         # === FILTER BY AGENT ===
@@ -483,7 +490,7 @@ class HistorySearchStep:
         ]
 
         if not agent_history:
-            print("[HistoryStep] No history for this agent")
+            logger.debug("[HistoryStep] No history for this agent")
             return None
 
         # === CHECK SIMILARITY ===
@@ -506,12 +513,10 @@ class HistorySearchStep:
         Returns:
             List of keywords
         """
-        import re
-
         keywords = set()
 
         # Số tài khoản
-        account_numbers = re.findall(r'\b\d{3,5}\b', text)
+        account_numbers = _ACCOUNT_NUMBER_RE.findall(text)
         keywords.update(account_numbers)
 
         # Từ khóa kế toán
@@ -583,7 +588,7 @@ class StreamingCacheStep:
         cached_response = self.cache.get(cache_key)
 
         if cached_response is not None:
-            print(f"[CacheStep] ✓ CACHE HIT! Regenerating example with new numbers...")
+            logger.debug("[CacheStep] ✓ CACHE HIT! Regenerating example with new numbers...")
 
             # Cache hit: regenerate example (part 4)
             full_response = self._regenerate_example(cached_response, agent_name)
@@ -591,7 +596,7 @@ class StreamingCacheStep:
             # Return generator simulate streaming
             return self._simulate_streaming_from_cache(full_response)
 
-        print(f"[CacheStep] ✗ Cache miss (key: {cache_key[:12]}...)")
+        logger.debug("[CacheStep] ✗ Cache miss (key: %s...)", cache_key[:12])
         return None
 
     def _regenerate_example(self, cached_response: str, agent_name: str) -> str:
@@ -607,8 +612,6 @@ class StreamingCacheStep:
         Returns:
             Full response với example mới + Ghi chú/Lưu ý (nếu có)
         """
-        import re
-
         # Tách cached response thành: main_content + footer (Ghi chú, Lưu ý)
         main_lines = []
         footer_lines = []
@@ -682,14 +685,14 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
             # Clean result - remove common variations
             for valid_type in ['DO_SALE', 'SALES_INVOICE', 'CASH_IN', 'GRN_PURCHASE', 'PURCHASE_INVOICE', 'CASH_OUT']:
                 if valid_type in result:
-                    print(f"[RegenerateExample] LLM classified as: {valid_type}")
+                    logger.debug("[RegenerateExample] LLM classified as: %s", valid_type)
                     return valid_type
 
-            print(f"[RegenerateExample] LLM returned unknown: {result}, using DO_SALE fallback")
+            logger.warning("[RegenerateExample] LLM returned unknown: %s, using DO_SALE fallback", result)
             return 'DO_SALE'
 
         except Exception as e:
-            print(f"[RegenerateExample] LLM classification failed: {e}, using DO_SALE fallback")
+            logger.warning("[RegenerateExample] LLM classification failed: %s, using DO_SALE fallback", e)
             return 'DO_SALE'
 
     def _generate_example_for_tx_type(self, tx_type: str, cached_response: str) -> str:
@@ -697,7 +700,6 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
         Generate example cho tx_type với số ngẫu nhiên.
         """
         import random
-        import re
 
         # Config: tx_type -> description template
         DESC_TEMPLATES = {
@@ -721,7 +723,7 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
         # Extract entries from cached response (flexible regex)
         entries = []
         for line in cached_response.split('\n'):
-            match = re.match(r'-?\s*(Nợ|Có)\s+TK\s+(\d+):', line.strip())
+            match = _ENTRY_LINE_RE.match(line.strip())
             if match:
                 entries.append({
                     'side': match.group(1),
@@ -781,13 +783,14 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
             context: Context dict
 
         Returns:
-            MD5 hash key
+            xxh3_64 hash key
         """
-        import hashlib
-        import json
+        import orjson
+        import xxhash
+        from ..services.streaming_cache import normalize_question
 
         key_data = {
-            "question": question,
+            "question": normalize_question(question),
             "agent": agent_name,
         }
 
@@ -799,8 +802,7 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
         if relevant_context:
             key_data["context"] = relevant_context
 
-        key_str = json.dumps(key_data, sort_keys=True)
-        return hashlib.md5(key_str.encode()).hexdigest()
+        return xxhash.xxh3_64_hexdigest(orjson.dumps(key_data, option=orjson.OPT_SORT_KEYS))
 
     def _simulate_streaming_from_cache(self, response: str):
         """
@@ -812,15 +814,12 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
         Yields:
             Chunks để simulate typing effect
         """
-        import time
+        from ..services.streaming_cache import _simulate_streaming
 
-        print(f"[CacheStep] Simulating streaming ({len(response)} chars)")
+        logger.debug("[CacheStep] Simulating streaming (%s chars)", len(response))
 
-        for i in range(0, len(response), self.chars_per_chunk):
-            chunk = response[i:i + self.chars_per_chunk]
-            yield chunk
-            # Delay để simulate typing
-            time.sleep(self.simulate_delay)
+        # Chunk theo từ, delay co lại theo độ dài để tổng thời gian <= CACHE_SIMULATE_MAX_SECONDS
+        yield from _simulate_streaming(response, self.chars_per_chunk, self.simulate_delay)
 
     def save_to_cache(self, question: str, agent_name: str, response: str, cache_context: dict):
         """
@@ -835,8 +834,6 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
             response: Full response
             cache_context: Context dict
         """
-        import re
-
         # Strip phần 4 (VÍ DỤ) nhưng GIỮ lại phần "Ghi chú" và "Lưu ý"
         lines = response.split('\n')
         cache_lines = []
@@ -846,7 +843,7 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
             line_stripped = line.strip()
 
             # Bắt đầu phần 4 - skip dòng header
-            if re.match(r'^4\.\s*VÍ DỤ:', line_stripped):
+            if _EXAMPLE_HEADER_RE.match(line_stripped):
                 skip_example = True
                 continue
 
@@ -854,7 +851,7 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
             if skip_example and (
                 line_stripped.startswith('Ghi chú:') or
                 line_stripped.startswith('Lưu ý:') or
-                re.match(r'^\d+\.', line_stripped)  # Section mới như "5."
+                _SECTION_RE.match(line_stripped)  # Section mới như "5."
             ):
                 skip_example = False
 
@@ -865,7 +862,7 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
                 if line_stripped.startswith('-') or (
                     line_stripped and not line_stripped.startswith('Ghi chú') and
                     not line_stripped.startswith('Lưu ý') and
-                    not re.match(r'^\d+\.', line_stripped) and
+                    not _SECTION_RE.match(line_stripped) and
                     ':' not in line_stripped  # Không có dấu ":" -> không phải header
                 ):
                     continue
@@ -876,7 +873,7 @@ CHỈ TRẢ VỀ MỘT TỪ: tên loại giao dịch (ví dụ: DO_SALE, SALES_I
 
         cache_key = self._generate_cache_key(question, agent_name, cache_context)
         self.cache.set(cache_key, cached_response)
-        print(f"[CacheStep] Saved to cache WITHOUT example (key: {cache_key[:12]}...)")
+        logger.debug("[CacheStep] Saved to cache WITHOUT example (key: %s...)", cache_key[:12])
 
 
 # =============================================================================
@@ -919,7 +916,7 @@ class AgentExecutorStep:
         Yields:
             Response chunks from agent (or LLM)
         """
-        print(f"[ExecutorStep] Executing agent: {agent.name}")
+        logger.debug("[ExecutorStep] Executing agent: %s", agent.name)
 
         # === AGENT STREAM EXECUTE ===
         for chunk in agent.stream_execute(context):
@@ -1032,7 +1029,7 @@ class ResponseSaverStep:
         sm = get_session_manager("thinking")
         sm.add_message(session_id, question, full_response, agent_name, user_id=user_id)
 
-        print(f"[SaverStep] Saved response ({len(full_response)} chars)")
+        logger.debug("[SaverStep] Saved response (%s chars)", len(full_response))
 
 
 # =============================================================================
@@ -1056,7 +1053,7 @@ class AccountingPipeline:
 
     def __init__(self):
         """Initialize pipeline với tất cả các steps."""
-        print("[Pipeline] Initializing Accounting Pipeline...")
+        logger.info("[Pipeline] Initializing Accounting Pipeline...")
 
         # Initialize các steps
         self.session_step = SessionManagerStep()
@@ -1068,7 +1065,7 @@ class AccountingPipeline:
         self.stream_processor = StreamProcessorStep()
         self.saver = ResponseSaverStep()
 
-        print("[Pipeline] Pipeline initialized successfully!")
+        logger.info("[Pipeline] Pipeline initialized successfully!")
 
     def process(
         self,
@@ -1093,22 +1090,22 @@ class AccountingPipeline:
         Yields:
             str: Response chunks (từng chữ một)
         """
-        print(f"\n{'='*60}")
-        print(f"[Pipeline] Processing: {question}")
-        print(f"[Pipeline] User ID: {user_id}")
-        print(f"{'='*60}\n")
+        logger.debug("\n%s", '='*60)
+        logger.debug("[Pipeline] Processing: %s", question)
+        logger.debug("[Pipeline] User ID: %s", user_id)
+        logger.debug("%s\n", '='*60)
 
         # =========================================================================
         # STEP 1: SESSION MANAGEMENT
         # =========================================================================
-        print("[Pipeline] STEP 1: Session Management")
+        logger.debug("[Pipeline] STEP 1: Session Management")
         session_id = self.session_step.create_session_if_needed(session_id)
         yield f"__SESSION_ID__:{session_id}\n"
 
         # =========================================================================
         # STEP 2: BUILD CONTEXT
         # =========================================================================
-        print("[Pipeline] STEP 2: Building Context")
+        logger.debug("[Pipeline] STEP 2: Building Context")
         history_messages = self.session_step.format_history_for_llm(
             session_id, max_count=10
         )
@@ -1126,7 +1123,7 @@ class AccountingPipeline:
         # FREE MODE: Skip routing, go directly to agent
         # =========================================================================
         if chat_type == "free":
-            print("[Pipeline] FREE MODE - Skipping routing")
+            logger.debug("[Pipeline] FREE MODE - Skipping routing")
             agent = self.router_step.orchestrator.get_agent("GENERAL_FREE")
 
             response_chunks = []
@@ -1147,14 +1144,14 @@ class AccountingPipeline:
         # =========================================================================
         # STEP 3: ROUTE TO AGENT
         # =========================================================================
-        print("[Pipeline] STEP 3: Routing to Agent")
+        logger.debug("[Pipeline] STEP 3: Routing to Agent")
         agent = self.router_step.route_to_agent(context)
         agent_name = agent.name
 
         # =========================================================================
         # STEP 4: STREAMING CACHE CHECK (History disabled)
         # =========================================================================
-        print("[Pipeline] STEP 4: Streaming Cache Check")
+        logger.debug("[Pipeline] STEP 4: Streaming Cache Check")
         cached_stream_gen = self.cache_checker.check_cache(
             question=question,
             agent_name=agent_name,
@@ -1167,7 +1164,7 @@ class AccountingPipeline:
 
         if cached_stream_gen is not None:
             # Cache hit! Stream từ cache
-            print("[Pipeline] ✓ Cache hit - Streaming from cache...")
+            logger.debug("[Pipeline] ✓ Cache hit - Streaming from cache...")
 
             response_chunks = []
             for chunk in cached_stream_gen:
@@ -1180,7 +1177,7 @@ class AccountingPipeline:
         # =========================================================================
         # STEP 5: AGENT EXECUTION (LLM Call)
         # =========================================================================
-        print("[Pipeline] STEP 5: Agent Execution (Calling LLM...)")
+        logger.debug("[Pipeline] STEP 5: Agent Execution (Calling LLM...)")
         response_chunks = []
 
         # Execute agent và stream response
@@ -1189,7 +1186,7 @@ class AccountingPipeline:
         # =========================================================================
         # STEP 6: STREAM PROCESSING
         # =========================================================================
-        print("[Pipeline] STEP 6: Stream Processing")
+        logger.debug("[Pipeline] STEP 6: Stream Processing")
         # Pass-through: agent đã handle streaming với stream_by_char
         for chunk in self.stream_processor.process_stream(
             llm_stream, buffer_size=5, turn_off_processing=True  # Agent đã xử lý streaming
@@ -1200,7 +1197,7 @@ class AccountingPipeline:
         # =========================================================================
         # STEP 7: SAVE RESPONSE
         # =========================================================================
-        print("[Pipeline] STEP 7: Saving Response")
+        logger.debug("[Pipeline] STEP 7: Saving Response")
         self.saver.save_response(
             question, response_chunks, session_id, agent_name,
             self.cache_checker,
@@ -1210,7 +1207,7 @@ class AccountingPipeline:
             user_id=user_id,
         )
 
-        print(f"[Pipeline] ✓ Completed. Total response: {len(''.join(response_chunks))} chars")
+        logger.debug("[Pipeline] ✓ Completed. Total response: %s chars", sum(map(len, response_chunks)))
 
 
 # =============================================================================
@@ -12,6 +12,7 @@ Accounting    General    Future Modules
 Pipeline      Pipeline    (HR, CRM, ...)
 """
 import json
+import logging
 import re
 from typing import Optional, Generator, Dict, Any
 
@@ -19,6 +20,8 @@ from .ask import AccountingPipeline
 from ..core.config import settings
 from ..services.llm_service import get_llm_service
 
+logger = logging.getLogger(__name__)
+
 
 # =============================================================================
 # MODULE DEFINITIONS
@@ -104,7 +107,7 @@ def classify_module_with_slm(question: str) -> Optional[str]:
         prompt = build_module_classification_prompt(question)
 
         response = llm_service.chat(
-            model=settings.GENERATION_MODEL,
+            model=settings.ROUTER_MODEL,
             messages=[{"role": "user", "content": prompt}],
             format=MODULE_CLASSIFICATION_SCHEMA,
             stream=False,
@@ -117,16 +120,31 @@ def classify_module_with_slm(question: str) -> Optional[str]:
         module_code = result.get("module")
         reasoning = result.get("reasoning", "")
 
-        print(f"[ModuleRouter] SLM classified to: {module_code}")
-        print(f"[ModuleRouter] Reasoning: {reasoning[:100]}...")
+        logger.debug("[ModuleRouter] SLM classified to: %s", module_code)
+        logger.debug("[ModuleRouter] Reasoning: %s...", reasoning[:100])
 
         return module_code
 
     except Exception as e:
-        print(f"[ModuleRouter] SLM Error: {e}")
+        logger.error("[ModuleRouter] SLM Error: %s", e)
         return None
 
 
+def _keyword_union(keywords) -> re.Pattern:
+    """Gộp keyword thành 1 regex alternation (substring match như `kw in text`)"""
+    return re.compile("|".join(re.escape(kw) for kw in keywords))
+
+
+# Compile 1 lần lúc import - classify chạy mỗi request trước khi vào pipeline
+_MODULE_KEYWORD_RES = [
+    (module_code, _keyword_union(module_info["keywords"]))
+    for module_code, module_info in AVAILABLE_MODULES.items()
+    if module_info.get("keywords")
+]
+_GREETING_RE = _keyword_union(["hello", "hi", "xin chào", "chào"])
+_THANKS_RE = _keyword_union(["cảm ơn", "thanks", "thank"])
+
+
 def classify_module_with_keywords(question: str) -> str:
     """
     Phân loại module bằng keyword matching (Fast fallback).
@@ -139,15 +157,14 @@ def classify_module_with_keywords(question: str) -> str:
     """
     question_lower = question.lower()
 
-    # Check each module's keywords
-    for module_code, module_info in AVAILABLE_MODULES.items():
-        keywords = module_info.get("keywords", [])
-        if any(kw in question_lower for kw in keywords):
-            print(f"[ModuleRouter] Keyword matched: {module_code}")
+    # Check each module's keywords (1 regex search / module thay vì vòng any())
+    for module_code, keyword_re in _MODULE_KEYWORD_RES:
+        if keyword_re.search(question_lower):
+            logger.debug("[ModuleRouter] Keyword matched: %s", module_code)
             return module_code
 
     # Default fallback
-    print("[ModuleRouter] No keyword match, using default: GENERAL")
+    logger.debug("[ModuleRouter] No keyword match, using default: GENERAL")
     return "GENERAL"
 
 
@@ -235,21 +252,21 @@ class ModuleRouter:
         Yields:
             Response chunks
         """
-        print(f"\n{'='*60}")
-        print(f"[ModuleRouter] Processing: {question}")
-        print(f"[ModuleRouter] User ID: {user_id}")
-        print(f"{'='*60}\n")
+        logger.debug("\n%s", '='*60)
+        logger.debug("[ModuleRouter] Processing: %s", question)
+        logger.debug("[ModuleRouter] User ID: %s", user_id)
+        logger.debug("%s\n", '='*60)
 
         # Step 1: Phân loại module
         module_code = self.classify_module(question, use_slm=True)
-        print(f"[ModuleRouter] Routed to: {module_code} ({AVAILABLE_MODULES.get(module_code, {}).get('name', 'Unknown')})")
+        logger.debug("[ModuleRouter] Routed to: %s (%s)", module_code, AVAILABLE_MODULES.get(module_code, {}).get('name', 'Unknown'))
 
         # Step 2: Get pipeline
         pipeline = self._get_pipeline(module_code)
 
         if pipeline is None:
             # Module GENERAL - gọi GeneralFreeAgent
-            print("[ModuleRouter] General mode - calling GeneralFreeAgent")
+            logger.debug("[ModuleRouter] General mode - calling GeneralFreeAgent")
             from ..agents.orchestrator import get_orchestrator
 
             orchestrator = get_orchestrator()
@@ -263,10 +280,10 @@ class ModuleRouter:
                 # Auto-generate session_id nếu không có
                 if not session_id:
                     session_id = str(uuid.uuid4())[:8]
-                    print(f"[ModuleRouter] Generated new session_id: {session_id}")
+                    logger.debug("[ModuleRouter] Generated new session_id: %s", session_id)
 
                 # Debug session_id
-                print(f"[ModuleRouter] GENERAL mode - session_id='{session_id}', chat_type='{chat_type}'")
+                logger.debug("[ModuleRouter] GENERAL mode - session_id='%s', chat_type='%s'", session_id, chat_type)
 
                 # Load history từ session - chỉ lấy 10 tin nhắn gần nhất
                 sm = get_session_manager(chat_type or "thinking")
@@ -277,9 +294,9 @@ class ModuleRouter:
                 if history_data and len(history_data) > 3:
                     original_count = len(history_data)
                     history_data = self._summarize_history(history_data)
-                    print(f"[ModuleRouter] Summary: {original_count} messages → {len(history_data)} (saved ~{original_count - len(history_data)} messages)")
+                    logger.debug("[ModuleRouter] Summary: %s messages → %s (saved ~%s messages)", original_count, len(history_data), original_count - len(history_data))
 
-                print(f"[ModuleRouter] GENERAL mode - loaded {len(history_data)} messages from history")
+                logger.debug("[ModuleRouter] GENERAL mode - loaded %s messages from history", len(history_data))
 
                 # Convert history sang format cho AgentContext
                 history = []
@@ -308,7 +325,7 @@ class ModuleRouter:
                 # Lưu response vào session/history sau khi stream xong
                 if session_id:
                     sm.add_message(session_id, question, full_response, "GENERAL_FREE", user_id=user_id)
-                    print(f"[ModuleRouter] Saved to session {session_id[:8]}...")
+                    logger.debug("[ModuleRouter] Saved to session %s...", session_id[:8])
 
                 return
             else:
@@ -334,12 +351,10 @@ class ModuleRouter:
         # Có thể gọi LLM đơn giản hoặc trả về câu chào mặc định
         question_lower = question.lower()
 
-        greetings = ["hello", "hi", "xin chào", "chào"]
-        if any(g in question_lower for g in greetings):
+        if _GREETING_RE.search(question_lower):
             return "Xin chào! Tôi là BFLOW AI, trợ lý thông minh của bạn. Tôi có thể giúp gì cho bạn?"
 
-        thanks = ["cảm ơn", "thanks", "thank"]
-        if any(t in question_lower for t in thanks):
+        if _THANKS_RE.search(question_lower):
             return "Rất vui được giúp đỡ bạn! Cần hỗ trợ thêm gì không?"
 
         return f"Hiểu câu hỏi: {question}. Tôi có thể giúp bạn tìm thông tin về kế toán, tài khoản, hạch toán..."
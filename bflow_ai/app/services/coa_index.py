@@ -17,10 +17,19 @@ Usage:
     acc = idx.get_by_code("156")
     results = idx.search_by_keyword("hàng hóa")
 """
-import json
-import os
+import re
+from array import array
 from typing import Optional, List, Dict
 from collections import defaultdict
+from functools import partial
+from types import MappingProxyType
+
+from app.services.rag_data import load_rag_json, COA_99_JSON, COA_200_JSON, COA_COMPARE_JSON
+
+# Posting list keyword index: array uint32 vị trí account (4 byte/phần tử thay vì 1 ref dict)
+_new_postings = partial(array, "I")
+# Keyword: chuỗi ký tự chữ/số >= 3 - tách + lọc độ dài trong 1 lần findall, bỏ dấu câu dính vào từ
+_TOKEN_RE = re.compile(r"\w{3,}")
 
 
 class COAIndex:
@@ -39,40 +48,25 @@ class COAIndex:
         self._by_type_200 = defaultdict(list)
         self._compare_by_type = defaultdict(list)
 
-        # Keyword index - map keyword -> list of accounts
-        self._keyword_index_99 = defaultdict(list)
-        self._keyword_index_200 = defaultdict(list)
+        # Keyword index - map keyword -> vị trí account trong _data_99/_data_200
+        self._keyword_index_99 = defaultdict(_new_postings)
+        self._keyword_index_200 = defaultdict(_new_postings)
+
+        # Tên lowercase tính sẵn, song song với _data_99/_data_200 (cho _substring_search)
+        self._names_lower_99 = []
+        self._names_en_lower_99 = []
+        self._names_lower_200 = []
+        self._names_en_lower_200 = []
 
     def _load_data(self):
         """Lazy load data từ JSON files"""
         if self._loaded:
             return
 
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        COA_99_FILE = os.path.join(BASE_DIR, "services", "rag_json", "coa_99.json")
-        COA_200_FILE = os.path.join(BASE_DIR, "services", "rag_json", "coa_200.json")
-        COA_COMPARE_FILE = os.path.join(BASE_DIR, "services", "rag_json", "coa_compare_99_vs_200.json")
-
-        # Load TT99
-        if os.path.exists(COA_99_FILE):
-            with open(COA_99_FILE, "r", encoding="utf-8") as f:
-                self._data_99 = json.load(f)
-        else:
-            print(f"[WARN] {COA_99_FILE} not found")
-
-        # Load TT200
-        if os.path.exists(COA_200_FILE):
-            with open(COA_200_FILE, "r", encoding="utf-8") as f:
-                self._data_200 = json.load(f)
-        else:
-            print(f"[WARN] {COA_200_FILE} not found")
-
-        # Load Compare
-        if os.path.exists(COA_COMPARE_FILE):
-            with open(COA_COMPARE_FILE, "r", encoding="utf-8") as f:
-                self._compare_data = json.load(f)
-        else:
-            print(f"[WARN] {COA_COMPARE_FILE} not found")
+        # Parse JSON dùng chung với COAAgent / PostingEngineAgent (rag_data)
+        self._data_99 = load_rag_json(COA_99_JSON)
+        self._data_200 = load_rag_json(COA_200_JSON)
+        self._compare_data = load_rag_json(COA_COMPARE_JSON)
 
         # Build indexes
         self._build_indexes()
@@ -82,39 +76,53 @@ class COAIndex:
     def _build_indexes(self):
         """Build all indexes"""
         # Index by code cho TT99
-        for acc in self._data_99:
+        for row, acc in enumerate(self._data_99):
             code = acc["code"]
             self._by_code_99[code] = acc
             self._by_type_99[acc["type_name"]].append(acc)
 
             # Keyword index - extract keywords from name
-            self._index_keywords(acc, self._keyword_index_99)
+            self._index_keywords(row, acc, self._keyword_index_99)
 
         # Index by code cho TT200
-        for acc in self._data_200:
+        for row, acc in enumerate(self._data_200):
             code = acc["code"]
             self._by_code_200[code] = acc
             self._by_type_200[acc["type_name"]].append(acc)
-            self._index_keywords(acc, self._keyword_index_200)
+            self._index_keywords(row, acc, self._keyword_index_200)
+
+        # Lowercase name/name_en 1 lần lúc build: substring search không tạo chuỗi mới mỗi query
+        self._names_lower_99 = [acc["name"].lower() for acc in self._data_99]
+        self._names_en_lower_99 = [(acc.get("name_en") or "").lower() for acc in self._data_99]
+        self._names_lower_200 = [acc["name"].lower() for acc in self._data_200]
+        self._names_en_lower_200 = [(acc.get("name_en") or "").lower() for acc in self._data_200]
 
         # Compare data index
         for item in self._compare_data:
             self._compare_by_type[item["change_type"]].append(item)
 
-    def _index_keywords(self, acc: dict, index: dict):
-        """Index keywords từ account name"""
+        # Build xong: defaultdict -> dict thường read-only (lookup không qua __missing__,
+        # index[key_không_có] không lặng lẽ thêm list rỗng lúc query)
+        self._by_code_99 = MappingProxyType(self._by_code_99)
+        self._by_code_200 = MappingProxyType(self._by_code_200)
+        self._by_type_99 = MappingProxyType(dict(self._by_type_99))
+        self._by_type_200 = MappingProxyType(dict(self._by_type_200))
+        self._compare_by_type = MappingProxyType(dict(self._compare_by_type))
+        self._keyword_index_99 = MappingProxyType(dict(self._keyword_index_99))
+        self._keyword_index_200 = MappingProxyType(dict(self._keyword_index_200))
+
+    def _index_keywords(self, row: int, acc: dict, index: dict):
+        """Index keywords từ account name (posting = row của account)"""
         name_lower = acc["name"].lower()
         name_en_lower = acc.get("name_en", "").lower()
 
-        # Extract keywords (split by space)
-        for word in name_lower.split():
-            if len(word) > 2:  # Skip quá ngắn
-                index[word].append(acc)
+        # Extract keywords (bỏ từ quá ngắn)
+        for word in _TOKEN_RE.findall(name_lower):
+            index[word].append(row)
 
         # English keywords
-        for word in name_en_lower.split():
-            if len(word) > 2:
-                index[word].append(acc)
+        for word in _TOKEN_RE.findall(name_en_lower):
+            index[word].append(row)
 
     # ========================================================================
     # PUBLIC API
@@ -168,26 +176,31 @@ class COAIndex:
 
         # Direct keyword match from index
         if keyword_lower in index:
-            results = index[keyword_lower]
-            # Deduplicate by code
+            data = self._data_200 if use_tt200 else self._data_99
+            # Deduplicate by row (set int), chỉ lấy dict account cho các kết quả trả về
             seen = set()
-            unique = []
-            for acc in results:
-                if acc["code"] not in seen:
-                    seen.add(acc["code"])
-                    unique.append(acc)
-            return unique[:limit]
+            rows = []
+            for row in index[keyword_lower]:
+                if row not in seen:
+                    seen.add(row)
+                    rows.append(row)
+                    if len(rows) >= limit:
+                        break
+            return [data[row] for row in rows]
 
         # Fallback: substring search (slower but still indexed)
         return self._substring_search(keyword_lower, use_tt200, limit)
 
     def _substring_search(self, keyword_lower: str, use_tt200: bool, limit: int) -> List[dict]:
         """Fallback substring search với optimization"""
-        data = self._data_200 if use_tt200 else self._data_99
+        if use_tt200:
+            data, names_lower, names_en_lower = self._data_200, self._names_lower_200, self._names_en_lower_200
+        else:
+            data, names_lower, names_en_lower = self._data_99, self._names_lower_99, self._names_en_lower_99
 
         results = []
-        for acc in data:
-            if keyword_lower in acc["name"].lower() or keyword_lower in acc.get("name_en", "").lower():
+        for acc, name_lower, name_en_lower in zip(data, names_lower, names_en_lower):
+            if keyword_lower in name_lower or keyword_lower in name_en_lower:
                 results.append(acc)
                 if len(results) >= limit:
                     break
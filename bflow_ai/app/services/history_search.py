@@ -9,19 +9,25 @@ Hỗ trợ 3 modes:
 Formula cho hybrid:
   final_score = α * sentence_score + (1-α) * keyword_score
 """
+import logging
 import time
 from typing import Optional, List
 import numpy as np
 
 from app.core.config import settings
-from app.core.embeddings import get_embed_model, encode_batch
+from app.core.embeddings import get_embed_model, encode_query
 from app.services.session_manager import get_session_manager
 from app.services.similarity import (
     extract_keywords,
+    keyword_text,
+    embed_history_texts,
+    embed_keyword_text,
     compute_hybrid_similarity,
     HybridSemanticCache
 )
 
+logger = logging.getLogger(__name__)
+
 
 class SemanticHistoryCache:
     """
@@ -89,7 +95,9 @@ class SemanticHistoryCache:
 
         if matched_idx is not None:
             response = past_responses[matched_question]
-            print(f"[SemanticHistory] ✓ Found ({mode}): \"{matched_question[:50]}...\" (score: {score:.3f})")
+            logger.debug(
+                "[SemanticHistory] ✓ Found (%s): \"%s...\" (score: %.3f)", mode, matched_question[:50], score
+            )
             return response
 
         return None
@@ -144,7 +152,10 @@ class SemanticHistoryCache:
 
         if matched_idx is not None:
             response = past_responses[matched_question]
-            print(f"[SemanticHistory] ✓ Found in {agent_name} ({mode}): \"{matched_question[:50]}...\" (score: {score:.3f})")
+            logger.debug(
+                "[SemanticHistory] ✓ Found in %s (%s): \"%s...\" (score: %.3f)",
+                agent_name, mode, matched_question[:50], score,
+            )
             return response
 
         return None
@@ -185,17 +196,16 @@ class SemanticHistoryCache:
         model
     ) -> tuple:
         """Tìm bằng sentence similarity"""
-        all_embeddings = encode_batch(history_questions + [query], normalize=True)
-
-        past_embs = all_embeddings[:-1]
-        query_emb = all_embeddings[-1]
+        # History từ cache embedding, chỉ encode câu mới + query
+        past_embs = embed_history_texts(history_questions)
+        query_emb = encode_query(query)
 
-        similarities = np.dot(past_embs, query_emb)
+        similarities = past_embs @ query_emb
 
         max_idx = int(np.argmax(similarities))
         max_sim = float(similarities[max_idx])
 
-        print(f"[SemanticHistory-Sentence] Max similarity: {max_sim:.3f} (threshold: {threshold})")
+        logger.debug("[SemanticHistory-Sentence] Max similarity: %.3f (threshold: %s)", max_sim, threshold)
 
         if max_sim >= threshold:
             return max_idx, history_questions[max_idx], max_sim
@@ -212,26 +222,23 @@ class SemanticHistoryCache:
         """Tìm bằng keyword similarity"""
         # Extract keywords
         query_keywords = extract_keywords(query)
-        keyword_texts = [" ".join(extract_keywords(q)) for q in history_questions]
+        keyword_texts = [keyword_text(q) for q in history_questions]
 
         if not query_keywords:
             # Fallback sang sentence
-            print("[SemanticHistory-Keyword] No keywords found, using sentence")
+            logger.debug("[SemanticHistory-Keyword] No keywords found, using sentence")
             return self._find_by_sentence(query, history_questions, threshold, model)
 
-        # Encode keywords
-        all_kw_texts = keyword_texts + [" ".join(query_keywords)]
-        kw_embs = encode_batch(all_kw_texts, normalize=True)
+        # Encode keywords (history từ cache)
+        history_kw_embs = embed_history_texts(keyword_texts)
+        query_kw_emb = embed_keyword_text(keyword_text(query))
 
-        query_kw_emb = kw_embs[-1]
-        history_kw_embs = kw_embs[:-1]
-
-        similarities = np.dot(history_kw_embs, query_kw_emb)
+        similarities = history_kw_embs @ query_kw_emb
 
         max_idx = int(np.argmax(similarities))
         max_sim = float(similarities[max_idx])
 
-        print(f"[SemanticHistory-Keyword] Max similarity: {max_sim:.3f} (threshold: {threshold})")
+        logger.debug("[SemanticHistory-Keyword] Max similarity: %.3f (threshold: %s)", max_sim, threshold)
 
         if max_sim >= threshold:
             return max_idx, history_questions[max_idx], max_sim
@@ -250,7 +257,8 @@ class SemanticHistoryCache:
             query,
             history_questions,
             alpha=self._alpha,
-            model=model
+            model=model,
+            top_k=1
         )
 
         if not results:
@@ -258,7 +266,10 @@ class SemanticHistoryCache:
 
         best_idx, sent_sim, kw_sim, final_sim = results[0]
 
-        print(f"[SemanticHistory-Hybrid] Sentence: {sent_sim:.3f}, Keyword: {kw_sim:.3f}, Final: {final_sim:.3f} (threshold: {threshold})")
+        logger.debug(
+            "[SemanticHistory-Hybrid] Sentence: %.3f, Keyword: %.3f, Final: %.3f (threshold: %s)",
+            sent_sim, kw_sim, final_sim, threshold,
+        )
 
         if final_sim >= threshold:
             return best_idx, history_questions[best_idx], final_sim
@@ -11,14 +11,18 @@ Features:
 
 import hashlib
 import json
+import logging
 import time
 import threading
 from typing import Optional, Dict, Any, List
 from dataclasses import dataclass
 
 from app.core.config import settings
+from app.core.ollama_client import get_ollama_client
 import ollama
 
+logger = logging.getLogger(__name__)
+
 
 class CachedLLMService:
     """
@@ -51,7 +55,11 @@ class CachedLLMService:
         self.cache_ttl = cache_ttl or settings.CACHE_TTL
         self.max_cache_size = max_cache_size or settings.MAX_CACHE_SIZE
 
-        self.client = ollama.Client(host=self.host)
+        # Dùng chung client pool (connection + keep_alive); chỉ tạo client riêng khi host khác
+        if self.host == settings.OLLAMA_HOST:
+            self.client = get_ollama_client()
+        else:
+            self.client = ollama.Client(host=self.host, timeout=settings.OLLAMA_TIMEOUT)
 
         # In-memory fallback cache
         self._memory_cache: Dict[str, Any] = {}
@@ -176,6 +184,19 @@ class CachedLLMService:
                 "metadata": metadata or {}
             }
 
+    @staticmethod
+    def _log_throughput(model: str, response: Any):
+        """Log tokens/sec từ metrics Ollama trả về (eval_count, eval_duration ns)"""
+        try:
+            eval_count = response.get("eval_count") or 0
+            eval_duration = response.get("eval_duration") or 0
+        except AttributeError:
+            return
+        if eval_count and eval_duration:
+            logger.debug(
+                "[LLMService] %s: %d tokens, %.1f tokens/s", model, eval_count, eval_count / (eval_duration / 1e9)
+            )
+
     def _update_miss_stats(self):
         """Update cache miss statistics"""
         with self._lock:
@@ -295,6 +316,7 @@ class CachedLLMService:
             format=format,
             **kwargs
         )
+        self._log_throughput(model, response)
 
         # Store in cache
         if use_cache:
@@ -0,0 +1,50 @@
+"""
+RAG Data - Nguồn duy nhất cho các file JSON trong services/rag_json
+
+Trước đây coa_agent, posting_engine_agent và COAIndex mỗi nơi tự đọc
+coa_99.json / coa_200.json -> parse 2-3 lần, giữ 2-3 bản copy trong RAM.
+Giờ tất cả đi qua load_rag_json(): parse 1 lần (orjson trên mmap), share cùng 1 object.
+
+Lưu ý: data trả về được share giữa các module -> chỉ đọc, KHÔNG sửa in-place.
+
+Usage:
+    from app.services.rag_data import load_rag_json, COA_99_JSON
+
+    coa_99 = load_rag_json(COA_99_JSON)
+"""
+import mmap
+import os
+from functools import lru_cache
+
+import orjson
+
+
+RAG_JSON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag_json")
+
+COA_99_JSON = "coa_99.json"
+COA_200_JSON = "coa_200.json"
+COA_COMPARE_JSON = "coa_compare_99_vs_200.json"
+POSTING_ENGINE_JSON = "posting_engine.json"
+
+
+def rag_json_path(filename: str) -> str:
+    return os.path.join(RAG_JSON_DIR, filename)
+
+
+@lru_cache(maxsize=None)
+def load_rag_json(filename: str):
+    """
+    Load 1 file trong rag_json (cache theo tên file); thiếu file -> [].
+
+    orjson parse thẳng trên mmap của file: không copy toàn bộ file sang bytes trước khi parse.
+    """
+    path = rag_json_path(filename)
+    if not os.path.exists(path):
+        print(f"[WARN] {path} not found.")
+        return []
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return orjson.loads(b"")  # mmap không map được file rỗng -> để orjson báo lỗi JSON như thường
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
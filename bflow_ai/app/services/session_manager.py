@@ -1,102 +1,133 @@
-import json
 import os
+import threading
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-SESSIONS_DIR = os.path.join(BASE_DIR, "services", "rag_json", "sessions")
+import orjson
+
+from app.services.session_store import get_session_store, SESSIONS_DIR
 
 
 class SessionManager:
-    """Quản lý chat sessions - mỗi session là 1 file riêng."""
+    """Quản lý chat sessions - lưu trong SQLite (session_store), mỗi chat_type 1 manager."""
+
+    HISTORY_CACHE_SIZE = 256
 
     def __init__(self, chat_type: str = "thinking"):
         self.chat_type = chat_type
         self.sessions_dir = os.path.join(SESSIONS_DIR, chat_type)
+        self._store = get_session_store()
+        # session_id -> (version stamp, số message đã fetch, messages); LRU theo thứ tự truy cập
+        self._history_cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
         self._ensure_dir()
+        self._import_legacy_sessions()
 
     def _ensure_dir(self):
         """Tạo thư mục nếu chưa tồn tại."""
         os.makedirs(self.sessions_dir, exist_ok=True)
 
-    def _get_session_path(self, session_id: str) -> str:
-        """Lấy đường dẫn file của session."""
-        return os.path.join(self.sessions_dir, f"{session_id}.json")
-
-    def _load_session(self, session_id: str) -> dict:
-        """Load session từ file."""
-        path = self._get_session_path(session_id)
-        try:
-            if os.path.exists(path):
-                with open(path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"[SessionManager] Error loading session {session_id}: {e}")
-        return None
-
-    def _save_session(self, session_id: str, data: dict):
-        """Lưu session ra file."""
-        path = self._get_session_path(session_id)
-        try:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[SessionManager] Error saving session {session_id}: {e}")
+    def _import_legacy_sessions(self):
+        """Import 1 lần các session JSON cũ (mỗi session 1 file) vào SQLite, rename file -> .migrated."""
+        # scandir: DirEntry đã có tên + loại file từ readdir, không stat/open file không liên quan
+        with os.scandir(self.sessions_dir) as entries:
+            legacy_files = [e for e in entries if e.name.endswith(".json") and e.is_file()]
+        for entry in legacy_files:
+            filename, path = entry.name, entry.path
+            try:
+                with open(path, "rb") as f:
+                    data = orjson.loads(f.read())
+                session_id = data.get("id", filename[:-5])
+                created_at = data.get("created_at", self._now())
+                # Session + history trong 1 transaction, commit xong mới rename file (os.replace atomic):
+                # crash ở bất kỳ bước nào -> hoặc chưa import (file .json còn, lần sau import lại)
+                # hoặc đã import đủ - không bao giờ mất history
+                self._store.import_session(
+                    session_id, data.get("user_id"), self.chat_type, created_at,
+                    data.get("updated_at", created_at), data.get("title", ""), data.get("history", []),
+                )
+                os.replace(path, path + ".migrated")
+                print(f"[SessionManager] Imported legacy session: {session_id}")
+            except Exception as e:
+                print(f"[SessionManager] Error importing {filename}: {e}")
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    @staticmethod
+    def _new_session_id() -> str:
+        return f"sess_{uuid.uuid4().hex[:12]}"
 
     def create_session(self, user_id: str = None) -> str:
         """Tạo session mới, trả về session_id."""
-        session_id = f"sess_{uuid.uuid4().hex[:12]}"
-        data = {
-            "id": session_id,
-            "user_id": user_id,
-            "chat_type": self.chat_type,
-            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "title": "",
-            "history": []
-        }
-        self._save_session(session_id, data)
+        session_id = self._new_session_id()
+        self._store.insert_session(session_id, user_id, self.chat_type, self._now())
         print(f"[SessionManager] Created session: {session_id} (user: {user_id})")
         return session_id
 
     def get_session(self, session_id: str) -> Optional[dict]:
-        """Lấy thông tin session."""
-        return self._load_session(session_id)
+        """Lấy thông tin session (kèm toàn bộ history)."""
+        data = self._store.get_session(session_id, self.chat_type)
+        if not data:
+            return None
+        data.pop("message_count")
+        data["history"] = self._store.get_messages(session_id, self.chat_type)
+        return data
 
     def add_message(self, session_id: str, question: str, response: str, category: str = "GENERAL", user_id: str = None):
-        """Thêm cặp Q&A vào session."""
-        data = self._load_session(session_id)
-        if not data:
-            # Tự tạo session nếu chưa có
-            session_id = self.create_session(user_id=user_id)
-            data = self._load_session(session_id)
-
-        data["history"].append({
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "question": question,
-            "response": response,
-            "category": category
-        })
-        data["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # Cập nhật user_id nếu có
-        if user_id:
-            data["user_id"] = user_id
+        """
+        Thêm cặp Q&A vào session.
 
+        Append-only: mỗi lượt chỉ INSERT 1 dòng message + UPDATE dòng session (title, updated_at,
+        message_count) - chi phí không tăng theo độ dài history, không serialize lại history cũ.
+        """
         # Cập nhật title theo câu hỏi gần nhất
-        data["title"] = question[:50] + "..." if len(question) > 50 else question
-
-        self._save_session(session_id, data)
+        title = question[:50] + "..." if len(question) > 50 else question
+        now = self._now()
+
+        added = self._store.insert_message(
+            session_id, self.chat_type, now, question, response, category, title, user_id=user_id
+        )
+        if not added:
+            # Tự tạo session nếu chưa có - tạo + ghi message trong 1 transaction
+            session_id = self._new_session_id()
+            self._store.insert_session_with_message(
+                session_id, user_id, self.chat_type, now, question, response, category, title
+            )
+            print(f"[SessionManager] Created session: {session_id} (user: {user_id})")
         return session_id
 
     def get_history(self, session_id: str, max_count: int = 10) -> list:
-        """Lấy history của session (N câu gần nhất)."""
-        data = self._load_session(session_id)
-        if not data:
+        """
+        Lấy history của session (N câu gần nhất).
+
+        1 request gọi get_history nhiều lần (history step, semantic search, messages format):
+        chỉ kiểm tra version stamp (rẻ), query lại messages khi session đã đổi.
+        """
+        version = self._store.get_version(session_id, self.chat_type)
+        if version[0] is None:
             return []
-        history = data.get("history", [])
-        return history[-max_count:] if len(history) > max_count else history
+
+        with self._cache_lock:
+            cached = self._history_cache.get(session_id)
+            if cached is not None:
+                self._history_cache.move_to_end(session_id)
+        if cached is not None:
+            cached_version, fetched, messages = cached
+            # Đủ số lượng: đã fetch >= max_count, hoặc đã lấy hết history
+            if cached_version == version and (fetched >= max_count or len(messages) < fetched):
+                return messages[-max_count:]
+
+        messages = self._store.get_messages(session_id, self.chat_type, limit=max_count)
+        with self._cache_lock:
+            self._history_cache[session_id] = (version, max_count, messages)
+            self._history_cache.move_to_end(session_id)
+            if len(self._history_cache) > self.HISTORY_CACHE_SIZE:
+                self._history_cache.popitem(last=False)
+        return list(messages)
 
     def get_messages_format(self, session_id: str, max_count: int = 10) -> list:
         """Chuyển history thành format messages cho Ollama."""
@@ -109,10 +140,8 @@ class SessionManager:
 
     def delete_session(self, session_id: str) -> bool:
         """Xóa session."""
-        path = self._get_session_path(session_id)
         try:
-            if os.path.exists(path):
-                os.remove(path)
+            if self._store.delete_session(session_id, self.chat_type):
                 print(f"[SessionManager] Deleted session: {session_id}")
                 return True
         except Exception as e:
@@ -120,45 +149,26 @@ class SessionManager:
         return False
 
     def list_sessions(self, user_id: str = None) -> list:
-        """Liệt kê tất cả sessions, sắp xếp theo updated_at mới nhất.
+        """Liệt kê tất cả sessions, sắp xếp theo updated_at mới nhất (1 query trên index).
+
+        Chỉ đọc bảng sessions (title/timestamps/message_count là cột, message_count là counter
+        tăng trong add_message) - không đọc messages, không mở file nào.
 
         Args:
             user_id: Nếu có, chỉ trả về sessions của user đó
         """
-        sessions = []
         try:
-            for filename in os.listdir(self.sessions_dir):
-                if filename.endswith(".json"):
-                    session_id = filename[:-5]  # Bỏ .json
-                    data = self._load_session(session_id)
-                    if data:
-                        # Lọc theo user_id nếu có
-                        if user_id and data.get("user_id") != user_id:
-                            continue
-
-                        sessions.append({
-                            "id": data.get("id", session_id),
-                            "user_id": data.get("user_id", ""),
-                            "title": data.get("title", "Untitled"),
-                            "chat_type": data.get("chat_type", self.chat_type),
-                            "created_at": data.get("created_at", ""),
-                            "updated_at": data.get("updated_at", ""),
-                            "message_count": len(data.get("history", []))
-                        })
+            sessions = self._store.list_sessions(self.chat_type, user_id)
         except Exception as e:
             print(f"[SessionManager] Error listing sessions: {e}")
-
-        # Sắp xếp theo updated_at mới nhất
-        sessions.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
+            return []
+        for s in sessions:
+            s["user_id"] = s["user_id"] or ""
         return sessions
 
     def clear_session(self, session_id: str):
         """Xóa history của session nhưng giữ session."""
-        data = self._load_session(session_id)
-        if data:
-            data["history"] = []
-            data["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self._save_session(session_id, data)
+        self._store.clear_messages(session_id, self.chat_type, self._now())
 
 
 # Singleton instances
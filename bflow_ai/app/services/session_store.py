@@ -0,0 +1,280 @@
+"""
+Session Store - SQLite (WAL) backend cho SessionManager
+
+Thay vì mỗi session là 1 file JSON (đọc + ghi lại toàn bộ file mỗi add_message,
+list_sessions mở N file), dùng 1 file SQLite:
+- add_message = 1 INSERT + 1 UPDATE trong 1 transaction (không rewrite history)
+- get_history = SELECT ... LIMIT N trên index (session_id, id)
+- list_sessions = 1 query trên index (chat_type, user_id, updated_at)
+
+WAL: reader không block writer, synchronous=NORMAL đủ an toàn cho chat history.
+Mỗi thread 1 connection (sqlite3 connection không share giữa thread).
+
+Usage:
+    from app.services.session_store import get_session_store
+
+    store = get_session_store()
+    store.insert_message(session_id, time, question, response, category, title)
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSIONS_DIR = os.path.join(BASE_DIR, "services", "rag_json", "sessions")
+SESSION_DB_FILE = os.path.join(SESSIONS_DIR, "sessions.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    chat_type TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_list
+    ON sessions (chat_type, user_id, updated_at DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    time TEXT NOT NULL,
+    question TEXT NOT NULL,
+    response TEXT NOT NULL,
+    category TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+"""
+
+_SESSION_COLUMNS = "id, user_id, chat_type, created_at, updated_at, title, message_count"
+# Messages của session (id, chat_type): manager chat_type khác không đọc được history
+# (như khi mỗi chat_type 1 thư mục riêng). EXISTS trên PK sessions - 1 lookup, không join.
+_OWNED_MESSAGES = (
+    "session_id = ? AND EXISTS (SELECT 1 FROM sessions WHERE id = ? AND chat_type = ?)"
+)
+
+
+class SessionStore:
+    """SQLite store cho sessions + messages (thread-safe: connection riêng mỗi thread)"""
+
+    def __init__(self, db_path: str = SESSION_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: autocommit, transaction tự quản bằng BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE: lấy write lock ngay, tránh deadlock khi nâng cấp read -> write"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ========================================================================
+    # SESSIONS
+    # ========================================================================
+
+    def insert_session(self, session_id: str, user_id: Optional[str], chat_type: str, now: str):
+        self._conn().execute(
+            "INSERT INTO sessions (id, user_id, chat_type, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, user_id, chat_type, now, now),
+        )
+
+    def get_session(self, session_id: str, chat_type: str) -> Optional[dict]:
+        row = self._conn().execute(
+            f"SELECT {_SESSION_COLUMNS} FROM sessions WHERE id = ? AND chat_type = ?",
+            (session_id, chat_type),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def list_sessions(self, chat_type: str, user_id: Optional[str] = None) -> list:
+        if user_id:
+            rows = self._conn().execute(
+                f"SELECT {_SESSION_COLUMNS} FROM sessions WHERE chat_type = ? AND user_id = ? "
+                "ORDER BY updated_at DESC",
+                (chat_type, user_id),
+            )
+        else:
+            rows = self._conn().execute(
+                f"SELECT {_SESSION_COLUMNS} FROM sessions WHERE chat_type = ? ORDER BY updated_at DESC",
+                (chat_type,),
+            )
+        return [dict(row) for row in rows]
+
+    def delete_session(self, session_id: str, chat_type: str) -> bool:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            cursor = conn.execute(
+                "DELETE FROM sessions WHERE id = ? AND chat_type = ?", (session_id, chat_type)
+            )
+        return cursor.rowcount > 0
+
+    def clear_messages(self, session_id: str, chat_type: str, now: str) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE sessions SET message_count = 0, updated_at = ? WHERE id = ? AND chat_type = ?",
+                (now, session_id, chat_type),
+            )
+            if cursor.rowcount:
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    # ========================================================================
+    # MESSAGES
+    # ========================================================================
+
+    def insert_message(
+        self,
+        session_id: str,
+        chat_type: str,
+        time: str,
+        question: str,
+        response: str,
+        category: str,
+        title: str,
+        user_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Thêm 1 cặp Q&A + cập nhật title/updated_at/message_count trong 1 transaction.
+
+        Returns:
+            False nếu session không tồn tại (không ghi gì)
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE sessions SET updated_at = ?, title = ?, message_count = message_count + 1, "
+                "user_id = COALESCE(?, user_id) WHERE id = ? AND chat_type = ?",
+                (time, title, user_id, session_id, chat_type),
+            )
+            if not cursor.rowcount:
+                return False
+            self._append_message(conn, session_id, time, question, response, category)
+        return True
+
+    def insert_session_with_message(
+        self,
+        session_id: str,
+        user_id: Optional[str],
+        chat_type: str,
+        time: str,
+        question: str,
+        response: str,
+        category: str,
+        title: str,
+    ):
+        """Tạo session + message đầu tiên trong cùng 1 transaction (1 lần commit/fsync WAL)."""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, user_id, chat_type, created_at, updated_at, title, message_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1)",
+                (session_id, user_id, chat_type, time, time, title),
+            )
+            self._append_message(conn, session_id, time, question, response, category)
+
+    def import_session(
+        self,
+        session_id: str,
+        user_id: Optional[str],
+        chat_type: str,
+        created_at: str,
+        updated_at: str,
+        title: str,
+        history: list,
+    ) -> bool:
+        """
+        Import nguyên 1 session (kèm toàn bộ history) trong 1 transaction.
+
+        Crash giữa chừng -> rollback, không để lại session thiếu message (lần chạy sau import lại).
+
+        Returns:
+            False nếu session đã tồn tại (không ghi gì)
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, user_id, chat_type, created_at, updated_at, title, message_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, user_id, chat_type, created_at, updated_at, title, len(history)),
+            )
+            if not cursor.rowcount:
+                return False
+            conn.executemany(
+                "INSERT INTO messages (session_id, time, question, response, category) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (session_id, item.get("time", ""), item.get("question", ""),
+                     item.get("response", ""), item.get("category", "GENERAL"))
+                    for item in history
+                ],
+            )
+        return True
+
+    @staticmethod
+    def _append_message(conn, session_id: str, time: str, question: str, response: str, category: str):
+        """Append-only: message chỉ được INSERT, không bao giờ ghi lại message cũ"""
+        conn.execute(
+            "INSERT INTO messages (session_id, time, question, response, category) VALUES (?, ?, ?, ?, ?)",
+            (session_id, time, question, response, category),
+        )
+
+    def get_version(self, session_id: str, chat_type: str) -> tuple:
+        """
+        Stamp rẻ (PK + index lookup) để biết messages của session có đổi không.
+
+        (message_count, id message cuối): add tăng id (AUTOINCREMENT không dùng lại id),
+        clear về (0, None) -> mọi lần ghi đều đổi stamp. Session khác chat_type -> (None, None).
+        """
+        row = self._conn().execute(
+            "SELECT message_count, (SELECT MAX(id) FROM messages WHERE session_id = ?) "
+            "FROM sessions WHERE id = ? AND chat_type = ?",
+            (session_id, session_id, chat_type),
+        ).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def get_messages(self, session_id: str, chat_type: str, limit: Optional[int] = None) -> list:
+        """N cặp Q&A gần nhất (thứ tự cũ -> mới); limit=None -> toàn bộ. Session khác chat_type -> []"""
+        if limit is None:
+            rows = self._conn().execute(
+                f"SELECT time, question, response, category FROM messages WHERE {_OWNED_MESSAGES} ORDER BY id",
+                (session_id, session_id, chat_type),
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                f"SELECT time, question, response, category FROM messages WHERE {_OWNED_MESSAGES} "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, session_id, chat_type, limit),
+            ).fetchall()
+            rows.reverse()
+        return [dict(row) for row in rows]
+
+
+_session_store: Optional[SessionStore] = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Get singleton SessionStore"""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = SessionStore()
+    return _session_store
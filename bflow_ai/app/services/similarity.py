@@ -10,12 +10,38 @@ Formula:
 
   Với α = 0.7 (ưu tiên sentence meaning, nhưng vẫn xem xét keywords)
 """
+import logging
 import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
 import numpy as np
 from typing import List, Tuple, Optional, Dict
 
 from app.core.config import settings
-from app.core.embeddings import get_embed_model, encode_batch
+from app.core.embeddings import get_embed_model, encode_batch, encode_query
+
+logger = logging.getLogger(__name__)
+
+
+# Từ khóa quan trọng trong kế toán
+IMPORTANT_TERMS = [
+    'hàng hóa', 'tiền mặt', 'phải thu', 'phải trả',
+    'hạch toán', 'định khoản', 'bút toán', 'ghi nhận',
+    'doanh thu', 'chi phí', 'lợi nhuận', 'nguyên vật liệu',
+    'tài sản', 'nợ phải trả', 'vốn chủ sở hữu',
+    'thuế', 'gtgt', 'tncn', 'tdcn', 'khấu hao',
+    'nhập kho', 'xuất kho', 'bán hàng', 'mua hàng'
+]
+
+# Compile 1 lần lúc import. Lookahead + alternation dài trước: 1 lần quét text,
+# vẫn bắt được term chồng lấn (vd: "phải trả" nằm trong "nợ phải trả") như `term in text`
+_ACCOUNT_NUMBER_RE = re.compile(r'\b\d{3,5}\b')
+_ABBREVIATION_RE = re.compile(r'\b[A-Z]{2,5}\b')
+_IMPORTANT_TERMS_RE = re.compile(
+    "(?=(" + "|".join(re.escape(t) for t in sorted(IMPORTANT_TERMS, key=len, reverse=True)) + "))"
+)
 
 
 def extract_keywords(text: str) -> List[str]:
@@ -30,41 +56,102 @@ def extract_keywords(text: str) -> List[str]:
         text: Câu hỏi
 
     Returns:
-        List of keywords
+        List of keywords (đã sort)
     """
-    keywords = set()
+    return list(_extract_keywords_cached(text))
 
+
+def keyword_text(text: str) -> str:
+    """Keywords nối thành 1 chuỗi (thứ tự cố định) - dùng làm input embedding keyword"""
+    return " ".join(_extract_keywords_cached(text))
+
+
+@lru_cache(maxsize=4096)
+def _extract_keywords_cached(text: str) -> Tuple[str, ...]:
+    """
+    Cache theo câu hỏi: history gần như không đổi giữa các lượt hỏi,
+    không cần trích xuất lại keyword của từng câu history mỗi query.
+    Sort để chuỗi keyword ổn định (set không giữ thứ tự) -> cùng câu hỏi, cùng embedding.
+    """
     # 1. Số tài khoản (3-5 chữ số)
-    account_numbers = re.findall(r'\b\d{3,5}\b', text)
-    keywords.update(account_numbers)
+    keywords = set(_ACCOUNT_NUMBER_RE.findall(text))
 
     # 2. Từ khóa quan trọng trong kế toán
-    important_terms = [
-        'hàng hóa', 'tiền mặt', 'phải thu', 'phải trả',
-        'hạch toán', 'định khoản', 'bút toán', 'ghi nhận',
-        'doanh thu', 'chi phí', 'lợi nhuận', 'nguyên vật liệu',
-        'tài sản', 'nợ phải trả', 'vốn chủ sở hữu',
-        'thuế', 'gtgt', 'tncn', 'tdcn', 'khấu hao',
-        'nhập kho', 'xuất kho', 'bán hàng', 'mua hàng'
-    ]
-
-    text_lower = text.lower()
-    for term in important_terms:
-        if term in text_lower:
-            keywords.add(term)
+    keywords.update(_IMPORTANT_TERMS_RE.findall(text.lower()))
 
     # 3. Các từ viết tắt
-    abbreviations = re.findall(r'\b[A-Z]{2,5}\b', text)
-    keywords.update(abbreviations)
+    keywords.update(_ABBREVIATION_RE.findall(text))
+
+    return tuple(sorted(keywords))
+
+
+# Embedding câu hỏi history (và chuỗi keyword của chúng): text -> vector, LRU.
+# History gần như không đổi giữa các lượt -> mỗi lượt chỉ encode câu mới + query.
+# Key theo nội dung nên không cần invalidate khi session có message mới.
+# Lưu float16 (nửa RAM): sai số cosine ~1e-3, rất nhỏ so với SEMANTIC_SIMILARITY_THRESHOLD (0.85).
+_HIST_EMB_CACHE: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_HIST_EMB_CACHE_SIZE = 4096
+_HIST_EMB_LOCK = threading.Lock()
+
+
+def embed_history_texts(texts: List[str]) -> np.ndarray:
+    """
+    Embedding matrix (N, D) normalized cho các câu history, chỉ encode (1 batch) những câu chưa có trong cache.
 
-    return list(keywords)
+    Args:
+        texts: List câu hỏi / chuỗi keyword trong history
+
+    Returns:
+        Matrix (len(texts), D) float32 C-contiguous, thứ tự theo texts
+        (upcast từ float16 khi copy vào matrix -> dot với query vẫn chạy BLAS sgemv)
+    """
+    vectors = {}
+    missing = []
+    with _HIST_EMB_LOCK:
+        for text in dict.fromkeys(texts):
+            vector = _HIST_EMB_CACHE.get(text)
+            if vector is None:
+                missing.append(text)
+            else:
+                _HIST_EMB_CACHE.move_to_end(text)
+                vectors[text] = vector
+
+    if missing:
+        embeddings = encode_batch(missing, normalize=True)
+        with _HIST_EMB_LOCK:
+            for text, embedding in zip(missing, embeddings):
+                # astype tạo bản copy: không giữ cả batch matrix sống chỉ vì 1 dòng còn trong cache
+                vector = embedding.astype(np.float16)
+                _HIST_EMB_CACHE[text] = vector
+                vectors[text] = vector
+            while len(_HIST_EMB_CACHE) > _HIST_EMB_CACHE_SIZE:
+                _HIST_EMB_CACHE.popitem(last=False)
+
+    # NumPy không có BLAS cho float16 -> upcast ngay khi stack vào matrix float32 (không tạo mảng trung gian)
+    return np.stack([vectors[text] for text in texts], dtype=np.float32)
+
+
+@lru_cache(maxsize=1024)
+def embed_keyword_text(text: str) -> np.ndarray:
+    """
+    Embedding (normalized) của chuỗi keyword phía query, cache theo nội dung.
+
+    User hỏi lại / diễn đạt khác nhưng cùng keyword -> cùng chuỗi -> không chạy model lại.
+    Cache riêng, encode trực tiếp (không qua micro-batcher của encode_query): chuỗi keyword
+    không chiếm chỗ câu hỏi trong cache encode_query và không chờ batch window.
+    """
+    # (D,) float32 C-contiguous -> matrix @ vector chạy thẳng BLAS sgemv
+    embedding = np.ascontiguousarray(encode_batch([text], normalize=True)[0], dtype=np.float32)
+    embedding.setflags(write=False)
+    return embedding
 
 
 def compute_hybrid_similarity(
     query: str,
     history_questions: List[str],
     alpha: float = 0.7,
-    model=None
+    model=None,
+    top_k: Optional[int] = None
 ) -> List[Tuple[int, float, float, float]]:
     """
     Tính hybrid similarity kết hợp sentence và keywords.
@@ -74,49 +161,55 @@ def compute_hybrid_similarity(
         history_questions: List các câu hỏi trong history
         alpha: Trọng số cho sentence similarity (0.7 = 70% sentence, 30% keywords)
         model: Embedding model
+        top_k: Chỉ lấy top_k kết quả (1 = best match, argmax); None = xếp hạng toàn bộ
 
     Returns:
-        List of (index, sentence_sim, keyword_sim, final_score) tuples
+        List of (index, sentence_sim, keyword_sim, final_score) tuples, final_score giảm dần
     """
     if model is None:
         model = get_embed_model()
 
-    # 1. Sentence similarity (full text)
-    all_texts = history_questions + [query]
-    sentence_embs = encode_batch(all_texts, normalize=True)
-
-    query_sent_emb = sentence_embs[-1]
-    history_sent_embs = sentence_embs[:-1]
+    # 1. Sentence similarity (full text): history từ cache, chỉ query cần encode
+    history_sent_embs = embed_history_texts(history_questions)
+    query_sent_emb = encode_query(query)
 
-    sentence_sims = np.dot(history_sent_embs, query_sent_emb)
+    # (N, D) float32 C-contiguous @ (D,) float32 -> BLAS sgemv
+    sentence_sims = history_sent_embs @ query_sent_emb
 
     # 2. Keyword similarity
-    query_keywords = extract_keywords(query)
-    keyword_texts = [" ".join(extract_keywords(q)) for q in history_questions]
-
-    if query_keywords and any(keyword_texts):
-        # Encode keywords
-        all_kw_texts = keyword_texts + [" ".join(query_keywords)]
-        kw_embs = encode_batch(all_kw_texts, normalize=True)
-
-        query_kw_emb = kw_embs[-1]
-        history_kw_embs = kw_embs[:-1]
-
-        keyword_sims = np.dot(history_kw_embs, query_kw_emb)
+    query_kw_text = keyword_text(query)
+    keyword_texts = [keyword_text(q) for q in history_questions]
+
+    if query_kw_text and any(keyword_texts):
+        # Chuỗi keyword unique (cache chung với câu history: chuỗi keyword trùng nguyên câu
+        # dùng lại embedding đã có)
+        unique_kw_texts = list(dict.fromkeys(keyword_texts))
+        unique_kw_embs = embed_history_texts(unique_kw_texts)
+        unique_sims = unique_kw_embs @ embed_keyword_text(query_kw_text)
+
+        # Scatter kết quả về từng câu history
+        unique_pos = {text: i for i, text in enumerate(unique_kw_texts)}
+        keyword_sims = unique_sims[[unique_pos[text] for text in keyword_texts]]
     else:
-        # Không có keywords → dùng sentence similarity
-        keyword_sims = sentence_sims.copy()
-
-    # 3. Combine scores
-    results = []
-    for i, (sent_sim, kw_sim) in enumerate(zip(sentence_sims, keyword_sims)):
-        final_sim = alpha * sent_sim + (1 - alpha) * kw_sim
-        results.append((i, float(sent_sim), float(kw_sim), float(final_sim)))
-
-    # Sort by final score
-    results.sort(key=lambda x: -x[3])
+        # Không có keywords → dùng sentence similarity (không encode thêm, alias - chỉ đọc)
+        keyword_sims = sentence_sims
+
+    # 3. Combine scores (vectorized) + chọn top
+    final_sims = alpha * sentence_sims + (1 - alpha) * keyword_sims
+    n = len(final_sims)
+    if top_k == 1:
+        order = [int(np.argmax(final_sims))]
+    elif top_k is not None and top_k < n:
+        order = np.argpartition(-final_sims, top_k - 1)[:top_k]
+        order = order[np.argsort(-final_sims[order], kind="stable")]
+    else:
+        # stable: điểm bằng nhau giữ thứ tự history như sort cũ
+        order = np.argsort(-final_sims, kind="stable")
 
-    return results
+    return [
+        (int(i), float(sentence_sims[i]), float(keyword_sims[i]), float(final_sims[i]))
+        for i in order
+    ]
 
 
 class HybridSemanticCache:
@@ -169,7 +262,8 @@ class HybridSemanticCache:
             query,
             history_questions,
             alpha=self.alpha,
-            model=self._get_model()
+            model=self._get_model(),
+            top_k=1
         )
 
         if not results:
@@ -223,11 +317,12 @@ def find_with_hybrid_similarity(
     idx, matched, details = cache.find_hybrid(query, history_questions, threshold)
 
     if matched is not None:
-        print(f"[HybridSimilarity] Sentence: {details['sentence_similarity']:.3f}, "
-              f"Keyword: {details['keyword_similarity']:.3f}, "
-              f"Final: {details['final_score']:.3f}")
-        print(f"[HybridSimilarity] ✓ Matched: \"{matched[:50]}...\"")
+        logger.debug(
+            "[HybridSimilarity] Sentence: %.3f, Keyword: %.3f, Final: %.3f",
+            details['sentence_similarity'], details['keyword_similarity'], details['final_score'],
+        )
+        logger.debug("[HybridSimilarity] ✓ Matched: \"%s...\"", matched[:50])
         return history_responses[matched]
 
-    print(f"[HybridSimilarity] No match (best: {details.get('final_score', 0):.3f} < {threshold})")
+    logger.debug("[HybridSimilarity] No match (best: %.3f < %s)", details.get('final_score', 0), threshold)
     return None
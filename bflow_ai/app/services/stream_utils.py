@@ -6,14 +6,83 @@ Optimizations:
 2. Reduced yield frequency
 3. Better chunking for Vietnamese text
 4. Handle both dict (Ollama format) and string formats
+5. Bridge sync generator -> async (1 thread/request thay vì 1 threadpool hop/chunk)
 
 Đã optimize từ phiên bản trước để giảm overhead.
 """
+import asyncio
 import re
-from typing import Iterator, Union
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, Union
 
+from app.core.config import settings
 
-def stream_by_sentence(ollama_stream, buffer_size_words: int = 5):
+# Compile 1 lần ở module scope (hot loop chạy theo từng token của model)
+# Sentence ending: . ? ! followed by space/newline
+_SENT_END_RE = re.compile(r'([.!?]+\s+|\n\n+)')
+# Phrase boundary
+_PHRASE_RE = re.compile(r'[,.;!?]+\s+|\n')
+_WORD_RE = re.compile(r'\S+')
+
+
+def _extract_content(chunk) -> str:
+    """
+    Lấy text từ 1 chunk stream - dùng chung cho mọi stream_by_* (thêm format mới chỉ sửa ở đây).
+
+    Hỗ trợ:
+    - ChatResponse object từ ollama library (chunk.message.content)
+    - Dict format (backward compatibility): chunk["message"]["content"]
+    - String
+
+    Returns:
+        str: Nội dung chunk, "" nếu không nhận dạng được format
+    """
+    message = getattr(chunk, "message", None)
+    if message is not None:
+        return getattr(message, "content", None) or ""
+    if isinstance(chunk, dict):
+        return chunk.get("message", {}).get("content", "")
+    if isinstance(chunk, str):
+        return chunk
+    return ""
+
+
+def _message_content(chunk) -> str:
+    return chunk.message.content or ""
+
+
+def _dict_content(chunk) -> str:
+    return chunk.get("message", {}).get("content", "")
+
+
+def _str_content(chunk) -> str:
+    return chunk
+
+
+def _choose_extractor(chunk):
+    """Chọn extractor theo chunk đầu tiên (1 stream chỉ có 1 kiểu chunk) - bỏ probe hasattr/isinstance mỗi token"""
+    if isinstance(chunk, str):
+        return _str_content
+    if isinstance(chunk, dict):
+        return _dict_content
+    if hasattr(getattr(chunk, "message", None), "content"):
+        return _message_content
+    # Không nhận dạng được -> giữ ladder tổng quát
+    return _extract_content
+
+
+def _iter_contents(ollama_stream) -> Iterator[str]:
+    """Yield text của từng chunk; extractor được chọn 1 lần từ chunk đầu tiên"""
+    chunks = iter(ollama_stream)
+    for first in chunks:
+        extractor = _choose_extractor(first)
+        yield extractor(first)
+        for chunk in chunks:
+            yield extractor(chunk)
+
+
+def stream_by_sentence(ollama_stream, buffer_size_words: int = 5, mode: str = "phrase"):
     """
     Optimized streaming: yield theo cụm từ thay vì từng từ.
 
@@ -24,51 +93,48 @@ def stream_by_sentence(ollama_stream, buffer_size_words: int = 5):
         ollama_stream: Iterator từ ollama.chat(stream=True)
                       Hoặc generator yielding strings
         buffer_size_words: Số từ tối đa trong mỗi buffer (default: 5)
+        mode: "phrase" (default) - gom theo cụm từ/cuối câu;
+              "word" - yield từng từ (xem stream_by_word)
 
     Yields:
         str: Cụm từ hoàn chỉnh
     """
+    if mode == "word":
+        yield from stream_by_word(ollama_stream)
+        return
+    if mode != "phrase":
+        raise ValueError(f"Unknown stream mode: {mode}")
+
     buffer = ""
     word_count = 0
+    sentence_ended = False
 
-    # Pattern detect sentence ending: . ? ! followed by space/newline
-    sentence_end_pattern = re.compile(r'([.!?]+\s+|\n\n+)')
-
-    for chunk in ollama_stream:
-        # Handle ChatResponse objects from ollama library
-        if hasattr(chunk, 'message') and hasattr(chunk.message, 'content'):
-            content = chunk.message.content
-        # Handle dict format (backward compatibility)
-        elif isinstance(chunk, dict):
-            content = chunk.get("message", {}).get("content", "")
-        # Handle string format
-        elif isinstance(chunk, str):
-            content = chunk
-        else:
-            continue
-
+    for content in _iter_contents(ollama_stream):
         if not content:
             continue
 
-        buffer += content
+        # Đếm từ tăng dần: chỉ quét content mới, trừ 1 nếu từ đầu content nối tiếp từ cuối buffer
+        word_count += len(_WORD_RE.findall(content))
+        if buffer and not buffer[-1].isspace() and not content[0].isspace():
+            word_count -= 1
 
-        # Đếm số từ trong buffer
-        words_in_buffer = len([w for w in buffer.split() if w])
+        # Buffer cũ chưa có cuối câu -> match mới phải chứa ký tự của content
+        # (match ngắn nhất 2 ký tự) -> chỉ cần search content + 1 ký tự trước đó
+        tail_start = len(buffer) - 1 if buffer else 0
+        buffer += content
 
         # Yield khi:
-        # 1. Đến cuối câu
+        # 1. Đến cuối câu (giữ cờ nếu buffer chỉ có khoảng trắng nên chưa yield)
         # 2. Hoặc buffer đã đủ lớn
-        should_yield = False
+        if not sentence_ended:
+            sentence_ended = _SENT_END_RE.search(buffer, tail_start) is not None
 
-        if sentence_end_pattern.search(buffer):
-            should_yield = True
-        elif words_in_buffer >= buffer_size_words:
-            should_yield = True
-
-        if should_yield and buffer.strip():
+        # word_count > 0 <=> buffer.strip() khác rỗng (không cần strip lại cả buffer)
+        if (sentence_ended or word_count >= buffer_size_words) and word_count:
             yield buffer
             buffer = ""
             word_count = 0
+            sentence_ended = False
 
     # Yield phần còn lại
     if buffer.strip():
@@ -89,25 +155,14 @@ def stream_by_phrase(ollama_stream, phrases_per_yield: int = 2):
     buffer = ""
     phrase_count = 0
 
-    # Pattern detect phrase boundary
-    phrase_boundary = re.compile(r'[,.;!?]+\s+|\n')
-
-    for chunk in ollama_stream:
-        # Handle both dict format (Ollama) and string format
-        if isinstance(chunk, dict):
-            content = chunk.get("message", {}).get("content", "")
-        elif isinstance(chunk, str):
-            content = chunk
-        else:
-            continue
-
+    for content in _iter_contents(ollama_stream):
         if not content:
             continue
 
         buffer += content
 
         # Đếm số phrase delimiter trong buffer
-        found_phrases = len(phrase_boundary.findall(buffer))
+        found_phrases = len(_PHRASE_RE.findall(buffer))
 
         if found_phrases >= phrases_per_yield:
             yield buffer
@@ -128,19 +183,7 @@ def stream_by_char(ollama_stream):
     Yields:
         str: Từng chữ
     """
-    for chunk in ollama_stream:
-        # Handle ChatResponse objects from ollama library
-        if hasattr(chunk, 'message') and hasattr(chunk.message, 'content'):
-            content = chunk.message.content
-        # Handle dict format (backward compatibility)
-        elif isinstance(chunk, dict):
-            content = chunk.get("message", {}).get("content", "")
-        # Handle string format
-        elif isinstance(chunk, str):
-            content = chunk
-        else:
-            continue
-
+    for content in _iter_contents(ollama_stream):
         if content:
             # Yield each character individually
             for char in content:
@@ -157,19 +200,7 @@ def stream_by_word(ollama_stream):
     Yields:
         str: Từng từ
     """
-    for chunk in ollama_stream:
-        # Handle ChatResponse objects from ollama library
-        if hasattr(chunk, 'message') and hasattr(chunk.message, 'content'):
-            content = chunk.message.content
-        # Handle dict format (backward compatibility)
-        elif isinstance(chunk, dict):
-            content = chunk.get("message", {}).get("content", "")
-        # Handle string format
-        elif isinstance(chunk, str):
-            content = chunk
-        else:
-            continue
-
+    for content in _iter_contents(ollama_stream):
         if content:
             # Split by whitespace and yield each word
             words = content.split()
@@ -177,6 +208,48 @@ def stream_by_word(ollama_stream):
                 yield word + " "  # Add space after each word
 
 
+class StreamMarkerWatcher:
+    """
+    Theo dõi stream với bộ nhớ O(1): đã thấy marker chưa + tổng số ký tự.
+
+    Dùng cho fallback detection thay vì cộng dồn full output (output += chunk)
+    chỉ để check `marker in output` / `len(output)` ở cuối stream.
+
+    Usage:
+        watcher = StreamMarkerWatcher("1.")
+        for char in stream_by_char(stream):
+            watcher.feed(char)
+            yield char
+        if not watcher.length or not watcher.found: ...
+    """
+
+    __slots__ = ("_marker", "_upper", "_tail", "found", "length")
+
+    def __init__(self, marker: str, upper: bool = False):
+        """
+        Args:
+            marker: Chuỗi cần phát hiện
+            upper: So khớp không phân biệt hoa/thường (marker phải viết hoa)
+        """
+        self._marker = marker
+        self._upper = upper
+        self._tail = ""
+        self.found = False
+        self.length = 0
+
+    def feed(self, chunk: str):
+        """Cập nhật state với chunk mới (marker có thể bị cắt ngang giữa 2 chunk)"""
+        self.length += len(chunk)
+        if self.found:
+            return
+        window = self._tail + (chunk.upper() if self._upper else chunk)
+        if self._marker in window:
+            self.found = True
+        else:
+            # Chỉ giữ len(marker) - 1 ký tự cuối để bắt marker nằm vắt qua chunk sau
+            self._tail = window[-(len(self._marker) - 1):] if len(self._marker) > 1 else ""
+
+
 def create_sentence_streamer(client, model, messages, system_prompt=None):
     """
     Wrapper để tạo sentence streamer từ ollama client.
@@ -205,3 +278,85 @@ def create_sentence_streamer(client, model, messages, system_prompt=None):
     )
 
     yield from stream_by_sentence(stream)
+
+
+_STREAM_END = object()
+# Giây chờ slot trống trước khi check lại stop flag (client ngắt / loop đóng)
+_PUT_POLL_TIMEOUT = 1.0
+
+# Executor riêng cho stream: mỗi stream giữ 1 worker suốt câu trả lời LLM -> không dùng chung
+# default executor của asyncio (min(32, cpu+4) worker, cũng phục vụ to_thread/run_in_executor khác)
+_STREAM_EXECUTOR = ThreadPoolExecutor(max_workers=settings.STREAM_WORKERS, thread_name_prefix="stream")
+
+
+async def iterate_in_thread(sync_gen: Iterator[str]) -> AsyncIterator[str]:
+    """
+    Chạy sync generator (pipeline/agent + ollama sync client) trên 1 worker của
+    _STREAM_EXECUTOR, đẩy chunk về event loop qua asyncio.Queue.
+
+    StreamingResponse với sync generator gọi anyio.to_thread cho MỖI chunk
+    (stream từng chữ -> hàng nghìn lần hop threadpool/response). Bridge này chỉ
+    tốn 1 worker/request (tối đa STREAM_WORKERS stream chạy song song, request dư chờ worker).
+
+    Đẩy chunk bằng call_soon_threadsafe (không chờ event loop xác nhận từng chunk - agent stream
+    từng ký tự). Backpressure bằng threading.Semaphore STREAM_QUEUE_SIZE slot: producer lấy slot
+    trước khi đẩy, consumer trả slot khi đã nhận -> client đọc chậm thì producer chờ,
+    không dồn cả câu trả lời vào RAM.
+
+    Client ngắt kết nối -> stop flag -> thread đóng generator ở chunk kế tiếp.
+
+    Args:
+        sync_gen: Generator đồng bộ yield str
+
+    Yields:
+        str: Chunks theo đúng thứ tự
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = threading.Semaphore(settings.STREAM_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def emit(item):
+        """Đẩy item sang event loop (không chờ); dừng producer nếu loop đã đóng"""
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop đã đóng (shutdown) -> dừng producer
+            stop.set()
+
+    def acquire_slot() -> bool:
+        """Chờ slot trống (consumer đã nhận bớt chunk); False nếu consumer dừng / loop đóng"""
+        while not slots.acquire(timeout=_PUT_POLL_TIMEOUT):
+            if stop.is_set() or loop.is_closed():
+                stop.set()
+                return False
+        return not stop.is_set()
+
+    def produce():
+        try:
+            for chunk in sync_gen:
+                if not acquire_slot():
+                    break
+                emit(chunk)
+        except Exception as e:
+            if not stop.is_set():
+                emit(e)
+        finally:
+            close = getattr(sync_gen, "close", None)
+            if close is not None:
+                close()
+            if not stop.is_set():
+                emit(_STREAM_END)
+
+    loop.run_in_executor(_STREAM_EXECUTOR, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            slots.release()
+            yield item
+    finally:
+        stop.set()
@@ -6,13 +6,98 @@ Giải pháp: Cache full response, lần sau yield từ cache với simulated sp
 
 Storage:
 - Redis (nếu available) - Persistent, shareable
-- In-memory fallback (nếu Redis không có)
+- In-memory fallback (nếu Redis không có) - text nằm trong 1 blob mmap (_MmapBlobStore),
+  dict chỉ giữ (offset, length, timestamp)
 """
-import hashlib
-import json
+import logging
+import mmap
+import re
+import tempfile
+import threading
 import time
+from collections import OrderedDict
 from typing import Generator, Callable, Optional
-from functools import lru_cache
+
+import orjson
+import xxhash
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Chuẩn hóa câu hỏi cho cache key: bỏ khoảng trắng thừa + lowercase.
+
+    "TK 156 là gì?" và "  tk 156  LÀ GÌ?" dùng chung 1 cached answer.
+    """
+    return " ".join(question.split()).lower()
+
+
+class _MmapBlobStore:
+    """
+    Vùng nhớ append-only trên mmap của 1 file tạm (unlink ngay khi tạo) cho text đã cache.
+
+    Response nhiều KB không nằm trên heap Python dưới dạng str sống suốt TTL: kernel quản lý
+    các page (có thể đẩy ra page cache khi ít dùng). Entry bị evict/hết hạn chỉ để lại vùng rác,
+    được dọn khi compact (ghi dồn các entry còn sống về đầu file).
+
+    Không thread-safe: caller giữ lock.
+    """
+
+    INITIAL_SIZE = 1 << 20  # 1 MiB
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix="streaming_cache_", suffix=".bin")
+        self._size = self.INITIAL_SIZE
+        self._file.truncate(self._size)
+        self._mm = mmap.mmap(self._file.fileno(), self._size)
+        self._end = 0
+
+    def read(self, offset: int, length: int) -> str:
+        """Decode thẳng từ memoryview của mmap (không tạo bytes trung gian)"""
+        with memoryview(self._mm) as view:
+            return str(view[offset:offset + length], "utf-8")
+
+    def append(self, data: bytes, live: dict) -> int:
+        """
+        Ghi data vào cuối vùng đã dùng, trả về offset.
+
+        Hết chỗ: nếu entry còn sống chiếm <= 1/2 file thì compact (cập nhật offset trong live
+        tại chỗ), không thì nhân đôi file.
+
+        Args:
+            data: Bytes cần ghi
+            live: key -> (offset, length, timestamp) của các entry còn sống
+        """
+        if self._end + len(data) > self._size:
+            live_bytes = sum(entry[1] for entry in live.values())
+            if live_bytes + len(data) <= self._size // 2:
+                self._compact(live)
+            if self._end + len(data) > self._size:
+                new_size = max(self._size * 2, self._end + len(data))
+                self._file.truncate(new_size)
+                self._mm.resize(new_size)
+                self._size = new_size
+
+        offset = self._end
+        self._mm[offset:offset + len(data)] = data
+        self._end += len(data)
+        return offset
+
+    def _compact(self, live: dict):
+        # Entry sắp theo offset tăng dần -> move() về đầu không bao giờ ghi đè entry chưa move
+        end = 0
+        for key, (offset, length, timestamp) in sorted(live.items(), key=lambda item: item[1][0]):
+            if offset != end:
+                self._mm.move(end, offset, length)
+                live[key] = (end, length, timestamp)
+            end += length
+        self._end = end
+
+    def clear(self):
+        self._end = 0
 
 
 class StreamingCache:
@@ -33,7 +118,11 @@ class StreamingCache:
         """
         self._ttl = ttl
         self._max_size = max_size
-        self._in_memory_cache = {}  # Fallback khi Redis không available
+        # Fallback khi Redis không available - FIFO theo thứ tự insert (entry cũ nhất ở đầu)
+        # key -> (offset, length, timestamp) trong blob mmap (tạo lazy khi set lần đầu)
+        self._in_memory_cache: OrderedDict = OrderedDict()
+        self._blob: Optional[_MmapBlobStore] = None
+        self._memory_lock = threading.Lock()
         self._use_redis = False
 
         # Try to use Redis
@@ -41,16 +130,16 @@ class StreamingCache:
             from app.core.redis_client import redis_available
             self._use_redis = redis_available()
             if self._use_redis:
-                print("[StreamingCache] ✓ Using Redis for streaming cache")
+                logger.info("[StreamingCache] ✓ Using Redis for streaming cache")
             else:
-                print("[StreamingCache] ✗ Redis unavailable, using in-memory fallback")
+                logger.warning("[StreamingCache] ✗ Redis unavailable, using in-memory fallback")
         except Exception as e:
-            print(f"[StreamingCache] Redis check failed: {e}. Using in-memory fallback.")
+            logger.warning("[StreamingCache] Redis check failed: %s. Using in-memory fallback.", e)
 
     def _generate_key(self, question: str, agent_name: str, context: dict = None) -> str:
         """Generate cache key từ input parameters"""
         key_data = {
-            "question": question,
+            "question": normalize_question(question),
             "agent": agent_name,
         }
         if context:
@@ -61,11 +150,13 @@ class StreamingCache:
             }
             key_data["context"] = relevant_context
 
-        key_str = json.dumps(key_data, sort_keys=True)
-        md5_hash = hashlib.md5(key_str.encode()).hexdigest()
+        # orjson trả thẳng UTF-8 bytes (sort keys cho key ổn định) - không cần dumps + encode
+        key_bytes = orjson.dumps(key_data, option=orjson.OPT_SORT_KEYS)
+        # xxh3_64: hash không mã hóa, nhanh hơn md5 nhiều lần - key chỉ dùng để memoize
+        key_hash = xxhash.xxh3_64_hexdigest(key_bytes)
 
         # Redis key prefix
-        return f"streaming:cache:{md5_hash}"
+        return f"streaming:cache:{key_hash}"
 
     def get(self, key: str) -> Optional[str]:
         """Get cached response nếu có và chưa expired"""
@@ -74,20 +165,23 @@ class StreamingCache:
             from app.core.redis_client import RedisClient
             value = RedisClient.get(key)
             if value is not None:
-                print(f"[StreamingCache] Redis cache hit: {key[:40]}...")
+                logger.debug("[StreamingCache] Redis cache hit: %s...", key[:40])
                 return value
 
         # Fallback to in-memory
-        if key in self._in_memory_cache:
-            entry = self._in_memory_cache[key]
-            if time.time() - entry["timestamp"] < self._ttl:
-                print(f"[StreamingCache] Memory cache hit: {key[:40]}...")
-                return entry["response"]
-            else:
-                # Expired, remove
+        with self._memory_lock:
+            entry = self._in_memory_cache.get(key)
+            if entry is None:
+                return None
+            offset, length, timestamp = entry
+            if time.time() - timestamp >= self._ttl:
+                # Expired, remove (vùng trong blob được dọn khi compact)
                 del self._in_memory_cache[key]
+                return None
+            response = self._blob.read(offset, length)
 
-        return None
+        logger.debug("[StreamingCache] Memory cache hit: %s...", key[:40])
+        return response
 
     def set(self, key: str, response: str):
         """Cache response"""
@@ -96,29 +190,34 @@ class StreamingCache:
             from app.core.redis_client import RedisClient
             success = RedisClient.set(key, response, ttl=self._ttl)
             if success:
-                print(f"[StreamingCache] ✓ Saved to Redis: {key[:40]}...")
+                logger.debug("[StreamingCache] ✓ Saved to Redis: %s...", key[:40])
                 return
 
         # Fallback to in-memory
-        # Evict oldest nếu cache full
-        if len(self._in_memory_cache) >= self._max_size:
-            oldest_key = min(self._in_memory_cache.keys(), key=lambda k: self._in_memory_cache[k]["timestamp"])
-            del self._in_memory_cache[oldest_key]
-
-        self._in_memory_cache[key] = {
-            "response": response,
-            "timestamp": time.time()
-        }
+        data = response.encode("utf-8")
+        with self._memory_lock:
+            if self._blob is None:
+                self._blob = _MmapBlobStore()
+            # Ghi đè key cũ -> bỏ entry cũ (compact không giữ vùng sắp bị thay), insert lại ở cuối
+            # (mới nhất); evict entry cũ nhất ở đầu - O(1)
+            if self._in_memory_cache.pop(key, None) is None and len(self._in_memory_cache) >= self._max_size:
+                self._in_memory_cache.popitem(last=False)
+
+            offset = self._blob.append(data, self._in_memory_cache)
+            self._in_memory_cache[key] = (offset, len(data), time.time())
 
     def clear(self):
         """Clear all cache"""
         if self._use_redis:
             from app.core.redis_client import RedisClient
             count = RedisClient.clear_pattern("streaming:cache:*")
-            print(f"[StreamingCache] Cleared {count} Redis entries")
+            logger.info("[StreamingCache] Cleared %s Redis entries", count)
         else:
-            self._in_memory_cache.clear()
-            print("[StreamingCache] Cleared in-memory cache")
+            with self._memory_lock:
+                self._in_memory_cache.clear()
+                if self._blob is not None:
+                    self._blob.clear()
+            logger.info("[StreamingCache] Cleared in-memory cache")
 
     def stats(self) -> dict:
         """Get cache statistics"""
@@ -143,24 +242,52 @@ class StreamingCache:
 _streaming_cache = StreamingCache()
 
 
-def _simulate_streaming(text: str, chars_per_chunk: int = 1, delay: float = 0.02) -> Generator[str, None, None]:
+# 1 từ + khoảng trắng theo sau (khoảng trắng đầu text dính vào từ đầu tiên)
+_WORD_RE = re.compile(r'\s*\S+\s*|\s+')
+
+
+def _simulate_streaming(
+    text: str,
+    chars_per_chunk: int = 24,
+    delay: float = 0.02,
+    max_duration: Optional[float] = None,
+) -> Generator[str, None, None]:
     """
     Simulate streaming từ cached text.
 
-    Chia text thành small chunks và yield với delay để tạo cảm giác "đang typing".
+    Gom từ thành chunk >= chars_per_chunk ký tự (không cắt giữa từ) và yield với delay
+    để tạo cảm giác "đang typing". Tổng thời gian bị chặn bởi max_duration:
+    response dài thì delay mỗi chunk giảm, không bắt user chờ lâu hơn model thật.
 
     Args:
         text: Full cached response
-        chars_per_chunk: Số characters mỗi chunk (default: 1 = từng chữ)
-        delay: Delay giữa các chunks (default: 0.02s = ~20ms)
+        chars_per_chunk: Số ký tự tối thiểu mỗi chunk (default: 24 ~ vài từ)
+        delay: Delay tối đa giữa các chunks (default: 0.02s = ~20ms)
+        max_duration: Tổng thời gian sleep tối đa (None -> CACHE_SIMULATE_MAX_SECONDS)
 
     Yields:
-        str: Small chunks để simulate streaming
+        str: Chunks để simulate streaming
     """
-    for i in range(0, len(text), chars_per_chunk):
-        chunk = text[i:i + chars_per_chunk]
+    chunks = []
+    current = ""
+    for match in _WORD_RE.finditer(text):
+        current += match.group()
+        if len(current) >= chars_per_chunk:
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+
+    if max_duration is None:
+        max_duration = settings.CACHE_SIMULATE_MAX_SECONDS
+    if chunks:
+        delay = min(delay, max_duration / len(chunks))
+
+    last = len(chunks) - 1
+    for i, chunk in enumerate(chunks):
         yield chunk
-        time.sleep(delay)
+        if i < last:
+            time.sleep(delay)
 
 
 def cached_stream(
@@ -189,13 +316,13 @@ def cached_stream(
     cached_response = _streaming_cache.get(cache_key)
     if cached_response is not None:
         # === CACHE HIT ===
-        print(f"[StreamingCache] ✓ Simulating streaming from cache...")
+        logger.debug("[StreamingCache] ✓ Simulating streaming from cache...")
         for chunk in _simulate_streaming(cached_response, delay=simulate_delay):
             yield chunk
         return
 
     # === CACHE MISS ===
-    print(f"[StreamingCache] Cache miss, calling LLM...")
+    logger.debug("[StreamingCache] Cache miss, calling LLM...")
 
     full_response = ""
 
@@ -219,13 +346,15 @@ def clear_streaming_cache():
 
 
 # =============================================================================
-# Quick LRU cache cho exact matches (in-memory, very fast)
+# Exact-match helpers (StreamingCache là nguồn dữ liệu duy nhất)
 # =============================================================================
 
-@lru_cache(maxsize=100)
 def get_cached_response(question: str, agent_name: str) -> Optional[str]:
     """
-    Simple LRU cache cho exact question matches.
+    Lấy cached response cho exact question match.
+
+    Không bọc thêm lru_cache: nội dung StreamingCache đổi theo thời gian (set, TTL, Redis)
+    -> cache lớp ngoài sẽ giữ None/response cũ mãi. StreamingCache.get đã là 1 lookup rẻ.
 
     Args:
         question: Câu hỏi (exact string)
@@ -1,14 +1,24 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from typing import Sequence
+
+import orjson
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import Response
 from contextlib import asynccontextmanager
+from redis.asyncio import Redis as AioRedis
+from app.core.config import settings
+from app.core.cors import FastCORS
 from app.api.endpoints.ask import router as ask_router
 from app.api.endpoints.sessions import router as sessions_router
-from fastapi.middleware.cors import CORSMiddleware
 from app.db.mongodb import close_mongo_connection
 
+# Trace trên hot path dùng logger.debug (format lazy) - LOG_LEVEL=INFO thì không format/ghi stdout
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(message)s")
+
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    print("=" * 60)
+async def _clear_caches():
+    """Xóa streaming cache + Redis db (async client: không block event loop lúc boot)"""
     print("[Startup] Clearing all caches...")
     try:
         from app.services.streaming_cache import get_streaming_cache
@@ -19,69 +29,109 @@ async def lifespan(app: FastAPI):
         print(f"[Startup] ✗ In-memory cache error: {e}")
 
     try:
-        import redis
-        r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-        r.flushdb()
+        r = AioRedis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            password=settings.REDIS_PASSWORD or None,
+        )
+        try:
+            await r.flushdb()
+        finally:
+            await r.aclose()
         print("[Startup] ✓ Redis cache cleared")
     except Exception as e:
         print(f"[Startup] ✗ Redis not available or error: {e}")
 
     print("[Startup] Cache clearing complete")
-    print("=" * 60)
 
-    yield
 
-    await close_mongo_connection()
+def create_app(
+    *,
+    clear_cache: bool = settings.CLEAR_CACHE_ON_STARTUP,
+    preload_models: bool = settings.PRELOAD_MODELS,
+    routers: Sequence[APIRouter] = (ask_router, sessions_router),
+    cors_origins: Sequence[str] = tuple(settings.CORS_ORIGINS),
+    cors_allow_credentials: bool = settings.CORS_ALLOW_CREDENTIALS,
+) -> FastAPI:
+    """
+    Tạo FastAPI app - 1 factory cho mọi biến thể entrypoint (dev/prod/test) thay vì copy main.py.
 
+    Args:
+        clear_cache: Xóa streaming cache + Redis lúc startup (mặc định giữ cache qua restart -
+            cold cache mỗi lần deploy rất tốn)
+        preload_models: Load sẵn model Ollama lúc startup
+        routers: Router mount dưới /api/ai-bflow
+        cors_origins: Origin allowlist cho FastCORS
+        cors_allow_credentials: Cho phép cookie/credentials cross-origin (tắt -> header CORS hằng)
+    """
 
-app = FastAPI(
-    title="BFLOW AI",
-    description="Unified Multi-Module AI Assistant - RESTful API",
-    version="2.0",
-    lifespan=lifespan
-)
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        print("=" * 60)
+        if clear_cache:
+            await _clear_caches()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+        if preload_models:
+            from app.core.ollama_client import preload_models as _preload_models
+            await asyncio.to_thread(_preload_models, settings.ROUTER_MODEL, settings.GENERATION_MODEL)
 
-app.include_router(ask_router, prefix="/api/ai-bflow")
-app.include_router(sessions_router, prefix="/api/ai-bflow")
+        print("=" * 60)
 
+        yield
 
-@app.get("/")
-async def root():
-    return {
-        "message": "BFLOW AI - RESTful API",
-        "version": "2.0",
-        "authentication": {
-            "method": "X-User-Id header",
-            "description": "User ID passed via header for all requests"
-        },
-        "endpoints": {
-            "ask": {
-                "method": "POST",
-                "path": "/api/ai-bflow/ask",
-                "header": "X-User-Id (required)",
-                "body": {
-                    "question": "string (required)",
-                    "session_id": "string (optional)",
-                    "chat_type": "thinking|free (default: thinking)",
-                    "item_group": "GOODS (default)",
-                    "partner_group": "CUSTOMER (default)"
-                }
-            },
-            "sessions": {
-                "list": {"method": "GET", "path": "/api/ai-bflow/users/{user_id}/sessions"},
-                "create": {"method": "POST", "path": "/api/ai-bflow/users/{user_id}/sessions"},
-                "detail": {"method": "GET", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}"},
-                "delete": {"method": "DELETE", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}"},
-                "clear": {"method": "POST", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}/clear"},
-                "reload": {"method": "POST", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}/reload"}
+        await close_mongo_connection()
+
+    app = FastAPI(
+        title="BFLOW AI",
+        description="Unified Multi-Module AI Assistant - RESTful API",
+        version="2.0",
+        lifespan=lifespan
+    )
+
+    app.add_middleware(FastCORS, allow_origins=cors_origins, allow_credentials=cors_allow_credentials)
+
+    for router in routers:
+        app.include_router(router, prefix="/api/ai-bflow")
+
+    @app.get("/")
+    async def root():
+        return Response(content=_ROOT_BYTES, media_type="application/json")
+
+    return app
+
+
+# Payload tĩnh: serialize 1 lần lúc import (orjson), mỗi request chỉ trả bytes
+_ROOT_BYTES = orjson.dumps({
+    "message": "BFLOW AI - RESTful API",
+    "version": "2.0",
+    "authentication": {
+        "method": "X-User-Id header",
+        "description": "User ID passed via header for all requests"
+    },
+    "endpoints": {
+        "ask": {
+            "method": "POST",
+            "path": "/api/ai-bflow/ask",
+            "header": "X-User-Id (required)",
+            "body": {
+                "question": "string (required)",
+                "session_id": "string (optional)",
+                "chat_type": "thinking|free (default: thinking)",
+                "item_group": "GOODS (default)",
+                "partner_group": "CUSTOMER (default)"
             }
+        },
+        "sessions": {
+            "list": {"method": "GET", "path": "/api/ai-bflow/users/{user_id}/sessions"},
+            "create": {"method": "POST", "path": "/api/ai-bflow/users/{user_id}/sessions"},
+            "detail": {"method": "GET", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}"},
+            "delete": {"method": "DELETE", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}"},
+            "clear": {"method": "POST", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}/clear"},
+            "reload": {"method": "POST", "path": "/api/ai-bflow/users/{user_id}/sessions/{session_id}/reload"}
         }
     }
+})
+
+
+app = create_app()
@@ -7,19 +7,25 @@ Theo structure của idea.md:
 3. StateGraph with conditional routing
 4. Loop max 2 lần rewrite
 """
+import asyncio
 import re
 import logging
-from typing import Literal, Dict, List
+import threading
+from collections import OrderedDict
+
+import orjson
+from functools import lru_cache
+from typing import Literal, Dict, List, Optional, Tuple
 from typing_extensions import TypedDict
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 
 from ..services.coa_index import get_coa_index
-from ..core.ollama_client import get_ollama_client
+from ..core.ollama_client import get_ollama_client, get_async_ollama_client
 from ..core.config import settings
+from ..core.logging_config import setup_logging
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -40,6 +46,8 @@ class CorrectiveRAGState(TypedDict):
     - confidence: float - Confidence score (0-1)
     - retry_count: int - Số lần đã retry/rewrite
     - needs_rewrite: bool - Có cần rewrite query không
+    - self_confidence: Optional[float] - LLM tự đánh giá khi draft (None nếu output không phải JSON)
+    - suggested_query: str - Query LLM đề xuất khi self_confidence thấp (dùng thay cho rewrite_query)
     """
     messages: List[dict]
     query: str
@@ -49,177 +57,318 @@ class CorrectiveRAGState(TypedDict):
     confidence: float
     retry_count: int
     needs_rewrite: bool
+    self_confidence: Optional[float]
+    suggested_query: str
 
 
 # =============================================================================
-# BƯỚC 2: 4 NODES (retrieve, generate_draft, grade_answer, rewrite)
+# RELEVANCE PATTERNS (compile 1 lần ở module scope)
 # =============================================================================
 
-def node_retrieve(state: CorrectiveRAGState) -> CorrectiveRAGState:
+# Từ khóa liên quan đến kế toán/tài khoản (so khớp nguyên từ / nguyên cụm)
+ACCOUNTING_KEYWORDS = (
+    'tài khoản', 'tk', 'thông tư', 'tt', 'hạch toán', 'kế toán',
+    'có', 'nợ', 'số dư', 'đối tượng', 'phân loại',
+    'so sánh', 'khác', 'giữa',
+    # Thuật ngữ kế toán thường gặp (trước đây chỉ lọt nhờ substring tình cờ, VD "khác" trong "khách")
+    'phải thu', 'phải trả', 'công nợ', 'doanh thu', 'chi phí', 'giá vốn', 'tài sản',
+    'nguồn vốn', 'vốn chủ sở hữu', 'tồn kho', 'khấu hao', 'thuế', 'định khoản', 'bút toán',
+    'tiền mặt', 'tiền gửi',
+)
+# Từ gốc tiếng Anh: so khớp theo tiền tố đầu từ ("account" -> accounts/accounting, "chart" -> charts)
+ACCOUNTING_EN_STEMS = (
+    'account', 'chart', 'ledger', 'debit', 'credit', 'payable', 'receivable',
+    'asset', 'liabilit', 'equity', 'revenue', 'expense', 'inventor', 'depreciat',
+)
+# So khớp theo từ, không theo substring ("tt" không còn match trong "settings", "có" trong "cóc"...):
+# - từ đơn: set membership trên token của query
+# - cụm nhiều từ + từ gốc tiếng Anh: 1 regex alternation có word boundary
+_ACCOUNTING_SINGLES = frozenset(kw for kw in ACCOUNTING_KEYWORDS if ' ' not in kw)
+_ACCOUNTING_PHRASES_RE = re.compile(
+    r'\b(?:' + '|'.join(re.escape(kw) for kw in ACCOUNTING_KEYWORDS if ' ' in kw) + r')\b'
+    r'|\b(?:' + '|'.join(map(re.escape, ACCOUNTING_EN_STEMS)) + r')'
+)
+# Token = chuỗi chữ cái hoặc chuỗi số liền nhau ("tk111" -> "tk", "111"; "tk?" -> "tk")
+_TOKEN_RE = re.compile(r'[^\W\d_]+|\d+')
+# Mã tài khoản: 3-5 chữ số
+_ACCOUNT_CODE_RE = re.compile(r'\b(\d{3,5})\b')
+
+# Bind singleton 1 lần lúc import (constructor rẻ - JSON lazy load ở lookup đầu tiên / warmup)
+_COA_INDEX = get_coa_index()
+
+NOT_ACCOUNTING_ANSWER = (
+    "Xin lỗi, câu hỏi này không liên quan đến lĩnh vực kế toán/tài khoản. Tôi có thể giúp bạn tìm thông tin về:\n"
+    "- Tài khoản kế toán (VD: TK 111, TK 156)\n"
+    "- So sánh tài khoản giữa TT99 và TT200\n"
+    "- Chức năng và cách hạch toán các tài khoản"
+)
+
+
+def is_accounting_query(query: str) -> bool:
     """
-    NODE RETRIEVE: Lấy tài khoản từ COA index
+    Câu hỏi có liên quan đến kế toán/tài khoản không: có từ khóa kế toán HOẶC có số tài khoản (3-5 chữ số).
 
-    Chức năng:
-    1. Kiểm tra relevance - câu hỏi có liên quan đến KO không?
-    2. Lấy tài khoản theo code (ưu tiên theo question)
-    3. Fallback: Tìm theo keyword nếu không có mã
+    Endpoint gọi trước khi chạy graph -> câu hỏi ngoài lề không tốn graph + LLM.
 
     Args:
-        state: State hiện tại
-
-    Returns:
-        State cập nhật với documents (hoặc answer nếu không liên quan)
+        query: Câu hỏi (bất kỳ hoa/thường)
     """
-    logger.info("\n" + "="*60)
-    logger.info("🔍 NODE RETRIEVE: Lấy tài khoản")
-    logger.info("="*60)
-    logger.info(f"📥 Query: {state['query']}")
+    query_lower = query.lower()
+    return (
+        not _ACCOUNTING_SINGLES.isdisjoint(_TOKEN_RE.findall(query_lower))
+        or bool(_ACCOUNTING_PHRASES_RE.search(query_lower))
+        or bool(_ACCOUNT_CODE_RE.search(query_lower))
+    )
 
-    # Relevance check - phát hiện câu hỏi không liên quan
-    query_lower = state['query'].lower()
 
-    # Từ khóa liên quan đến kế toán/tài khoản
-    accounting_keywords = [
-        'tài khoản', 'tk', 'thông tư', 'tt', 'hạch toán', 'kế toán',
-        'có', 'nợ', 'số dư', 'đối tượng', 'phân loại', 'chart', 'account',
-        'so sánh', 'khác', 'giữa'
-    ]
+# =============================================================================
+# PROMPT TEMPLATES (build 1 lần ở module scope, node chỉ .format())
+# =============================================================================
 
-    # Kiểm tra có từ khóa kế toán không HOẶC có số tài khoản (3-5 chữ số)
-    has_accounting_keyword = any(kw in query_lower for kw in accounting_keywords)
-    has_account_code = bool(re.search(r'\b\d{3,5}\b', query_lower))
+DRAFT_PROMPT_TEMPLATE = """Bạn là chuyên gia kế toán Việt Nam. LUÔN trả lời bằng TIẾNG VIỆT.
 
-    if not has_accounting_keyword and not has_account_code:
-        logger.info(f"⚠️  Query không liên quan đến kế toán/tài khoản")
-        # Trả về trực tiếp để kết thúc workflow
-        return {
-            **state,
-            "answer": "Xin lỗi, câu hỏi này không liên quan đến lĩnh vực kế toán/tài khoản. Tôi có thể giúp bạn tìm thông tin về:\n- Tài khoản kế toán (VD: TK 111, TK 156)\n- So sánh tài khoản giữa TT99 và TT200\n- Chức năng và cách hạch toán các tài khoản",
-            "confidence": 1.0,
-            "needs_rewrite": False,
-        }
+CÂU HỎI: {query}
 
-    # Query hiện tại = rewritten_query nếu có, ngược lại query gốc
-    query = state.get("rewritten_query") or state["query"]
-    logger.info(f"🔍 Query đang sử dụng: {query}")
+THÔNG TIN TÀI KHOẢN:
+{context}
+
+Hãy trả lời theo format:
+1. THÔNG TIN CƠ BẢN
+- Số hiệu
+- Tên tài khoản
+- Phân loại
+
+2. NỘI DUNG PHẢN ÁNH
+[Mô tả chức năng của tài khoản]
+
+3. KẾT CẤU
+- Bên Nợ: Ghi nhận gì
+- Bên Có: Ghi nhận gì
+- Số dư: Thường nằm bên nào
+
+4. LƯU Ý
+[Các lưu ý khi hạch toán]
+
+Kết thúc: (Căn cứ: Phụ lục II - Thông tư 99/2025/TT-BTC)
+
+CHỈ trả về 1 JSON object (không markdown, không giải thích thêm):
+{{"answer": "<câu trả lời theo format trên>", "self_confidence": <0.0-1.0: THÔNG TIN TÀI KHOẢN có đủ để trả lời CÂU HỎI không>, "better_query_if_low": "<nếu self_confidence < 0.6: viết lại CÂU HỎI rõ hơn (sửa typo, thêm TK/số hiệu), ngược lại để rỗng>"}}
+"""
+
+# LLM tự đánh giá dưới ngưỡng này -> retry với better_query_if_low (không cần gọi LLM rewrite)
+SELF_CONFIDENCE_THRESHOLD = 0.6
 
+REWRITE_PROMPT_TEMPLATE = """Bạn là trợ lý tìm kiếm thông tin tài khoản kế toán.
+
+QUERY GỐC: {query}
+
+Không tìm thấy kết quả phù hợp. Hãy viết lại câu hỏi theo một cách khác:
+1. Sửa typo (VD: TK111 → TK 111, tt99 → TT99)
+2. Dùng từ đồng nghĩa
+3. Thêm context rõ hơn (VD: "tài khoản", "TK")
+4. Tách query thành các query cụ thể hơn
+
+Trả về 2-3 câu hỏi được viết lại, mỗi câu trên một dòng. Không giải thích gì thêm."""
+
+
+# =============================================================================
+# BƯỚC 2: 4 NODES (retrieve, generate_draft, grade_answer, rewrite)
+# Node chỉ trả các key thay đổi - LangGraph tự merge vào state (không copy cả state mỗi node)
+# =============================================================================
+
+@lru_cache(maxsize=2048)
+def _retrieve_docs(query: str) -> Tuple[str, ...]:
+    """
+    Phần retrieve thuần (regex + COA index lookup) - cache theo query đã normalize.
+
+    Dữ liệu COA tĩnh -> cùng query luôn ra cùng documents; query lặp lại (VD: "TK 111")
+    chỉ tốn 1 dict hit thay vì regex + get_by_code + search_by_keyword.
+
+    Args:
+        query: Query đã lowercase + gộp khoảng trắng
+
+    Returns:
+        Tuple documents (immutable để share an toàn giữa các request)
+    """
     # Bước 1: Extract mã tài khoản từ query
-    code_match = re.search(r'\b(\d{3,5})\b', query)
+    code_match = _ACCOUNT_CODE_RE.search(query)
     code = code_match.group(1) if code_match else ""
-    logger.info(f"🔍 Mã TK extract được: {code}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🔍 Mã TK extract được: %s", code)
 
-    # Bước 2: Tìm trong COA index
-    idx = get_coa_index()
-
-    # Ưu tiên theo code
-    use_tt200 = "tt200" in query.lower()
-    acc = idx.get_by_code(code, use_tt200=use_tt200) if code else None
+    # Bước 2: Tìm trong COA index (ưu tiên theo code; query đã lowercase)
+    use_tt200 = "tt200" in query
+    acc = _COA_INDEX.get_by_code(code, use_tt200=use_tt200) if code else None
 
     documents = []
 
     if acc:
-        logger.info(f"✅ Tìm thấy: TK {acc['code']} - {acc['name']}")
+        logger.info("✅ Tìm thấy: TK %s - %s", acc['code'], acc['name'])
         documents.append(f"TK {acc['code']}: {acc['name']}")
         documents.append(f"Loại: {acc.get('type_name', 'N/A')}")
         documents.append(f"Chuẩn mực: {'TT200' if use_tt200 else 'TT99'}")
     else:
         # Fallback: Tìm theo keyword
-        logger.warning(f"⚠️  Không tìm thấy theo mã, tìm theo keyword...")
-        results = idx.search_by_keyword(query, limit=5)
+        logger.warning("⚠️  Không tìm thấy theo mã, tìm theo keyword...")
+        results = _COA_INDEX.search_by_keyword(query, limit=5)
         if results:
-            logger.info(f"✅ Tìm thấy {len(results)} TK theo keyword")
+            logger.info("✅ Tìm thấy %d TK theo keyword", len(results))
             for acc in results[:3]:
                 documents.append(f"TK {acc['code']}: {acc['name']}")
         else:
-            logger.error(f"❌ Không tìm thấy tài khoản nào")
+            logger.error("❌ Không tìm thấy tài khoản nào")
             documents.append("Không tìm thấy tài khoản phù hợp.")
 
+    return tuple(documents)
+
+
+def node_retrieve(state: CorrectiveRAGState) -> dict:
+    """
+    NODE RETRIEVE: Lấy tài khoản từ COA index
+
+    Chức năng:
+    1. Kiểm tra relevance - câu hỏi có liên quan đến KO không?
+    2. Lấy tài khoản theo code (ưu tiên theo question)
+    3. Fallback: Tìm theo keyword nếu không có mã
+
+    Args:
+        state: State hiện tại
+
+    Returns:
+        Partial update: documents (hoặc answer nếu không liên quan)
+    """
+    # Log chi tiết chỉ ở DEBUG: ở INFO không tốn format f-string bị bỏ đi
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🔍 NODE RETRIEVE: Lấy tài khoản")
+        logger.debug("📥 Query: %s", state['query'])
+
+    # Relevance check - phát hiện câu hỏi không liên quan
+    query_lower = state['query'].lower()
+
+    if not is_accounting_query(query_lower):
+        logger.info("⚠️  Query không liên quan đến kế toán/tài khoản")
+        # Trả về trực tiếp để kết thúc workflow
+        return {
+            "answer": NOT_ACCOUNTING_ANSWER,
+            "confidence": 1.0,
+            "needs_rewrite": False,
+        }
+
+    # Query hiện tại = rewritten_query nếu có, ngược lại query gốc
+    query = state.get("rewritten_query") or state["query"]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🔍 Query đang sử dụng: %s", query)
+
+    # Key cache: lowercase + gộp khoảng trắng (tra cứu COA không phân biệt hoa/thường)
+    documents = list(_retrieve_docs(" ".join(query.lower().split())))
+
     return {
-        **state,
         "documents": documents,
     }
 
 
-def node_generate_draft(state: CorrectiveRAGState) -> CorrectiveRAGState:
+def _parse_draft(content: str) -> Tuple[str, Optional[float], str]:
+    """
+    Parse output JSON của generate_draft -> (answer, self_confidence, better_query).
+
+    Model không trả JSON hợp lệ -> coi cả content là answer, không có self-grade.
+    """
+    try:
+        data = orjson.loads(content)
+        answer = str(data["answer"])
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        return content, None, ""
+
+    try:
+        self_confidence = max(0.0, min(1.0, float(data.get("self_confidence"))))
+    except (TypeError, ValueError):
+        self_confidence = None
+    better_query = str(data.get("better_query_if_low") or "").strip()
+    return answer, self_confidence, better_query
+
+
+# Draft cache: (query, documents) -> (answer, self_confidence, suggested_query)
+# Prompt là template cố định -> cùng query + documents thì draft như nhau, hit bỏ qua cả lần gọi LLM.
+# LRU trong process (node chạy trên 1 event loop, không cần lock); lỗi LLM không được cache.
+DRAFT_CACHE_SIZE = 512
+_draft_cache: "OrderedDict[Tuple[str, Tuple[str, ...]], Tuple[str, Optional[float], str]]" = OrderedDict()
+
+
+async def node_generate_draft(state: CorrectiveRAGState) -> dict:
     """
     NODE GENERATE DRAFT: Sinh câu trả lời từ documents
 
     Chức năng:
     1. Build prompt với context từ documents
-    2. Gọi LLM generate answer
+    2. Gọi LLM generate answer (JSON: answer + tự đánh giá + query đề xuất - 1 lần gọi thay vì
+       draft rồi gọi thêm LLM rewrite khi answer kém)
     3. Trả về answer draft
 
     Args:
         state: State với documents đã retrieve
 
     Returns:
-        State cập nhật với answer
+        Partial update: answer, self_confidence, suggested_query
     """
-    logger.info("\n" + "="*60)
-    logger.info("🤖 NODE GENERATE_DRAFT: Sinh câu trả lời")
-    logger.info("="*60)
-
     query = state.get("rewritten_query") or state["query"]
     documents = state.get("documents", [])
 
+    cache_key = (query, tuple(documents))
+    cached = _draft_cache.get(cache_key)
+    if cached is not None:
+        _draft_cache.move_to_end(cache_key)
+        logger.info("⚡ Draft cache hit, bỏ qua gọi LLM")
+        answer, self_confidence, suggested_query = cached
+        return {
+            "answer": answer,
+            "self_confidence": self_confidence,
+            "suggested_query": suggested_query,
+        }
+
     context = "\n".join(documents) if documents else "Không có thông tin."
-    logger.info(f"📝 Context:\n{context}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🤖 NODE GENERATE_DRAFT: Sinh câu trả lời")
+        logger.debug("📝 Context:\n%s", context)
 
     # Tạo prompt
-    prompt = f"""Bạn là chuyên gia kế toán Việt Nam. LUÔN trả lời bằng TIẾNG VIỆT.
-
-CÂU HỎI: {query}
-
-THÔNG TIN TÀI KHOẢN:
-{context}
-
-Hãy trả lời theo format:
-1. THÔNG TIN CƠ BẢN
-- Số hiệu
-- Tên tài khoản
-- Phân loại
-
-2. NỘI DUNG PHẢN ÁNH
-[Mô tả chức năng của tài khoản]
-
-3. KẾT CẤU
-- Bên Nợ: Ghi nhận gì
-- Bên Có: Ghi nhận gì
-- Số dư: Thường nằm bên nào
-
-4. LƯU Ý
-[Các lưu ý khi hạch toán]
-
-Kết thúc: (Căn cứ: Phụ lục II - Thông tư 99/2025/TT-BTC)
-"""
+    prompt = DRAFT_PROMPT_TEMPLATE.format(query=query, context=context)
 
     # Gọi LLM
-    logger.info(f"🔄 Đang gọi Ollama...")
+    logger.debug("🔄 Đang gọi Ollama...")
     try:
-        llm = get_ollama_client()
-        response = llm.chat(
+        # AsyncClient singleton: await thẳng trên event loop, dùng chung connection pool keep-alive
+        llm = get_async_ollama_client()
+        response = await llm.chat(
             model=settings.GENERATION_MODEL,
             messages=[{
                 "role": "user",
                 "content": prompt
             }],
             options=settings.OLLAMA_OPTIONS,
+            format="json",
             stream=False
         )
-        answer = response.get("message", {}).get("content", "")
-        logger.info(f"✅ Nhận phản hồi LLM: {len(answer)} ký tự")
+        answer, self_confidence, suggested_query = _parse_draft(
+            response.get("message", {}).get("content", "")
+        )
+        logger.info("✅ Nhận phản hồi LLM: %d ký tự, self_confidence=%s", len(answer), self_confidence)
+
+        _draft_cache[cache_key] = (answer, self_confidence, suggested_query)
+        if len(_draft_cache) > DRAFT_CACHE_SIZE:
+            _draft_cache.popitem(last=False)
 
     except Exception as e:
-        logger.error(f"❌ Lỗi LLM: {e}")
-        answer = f"Đã xảy ra lỗi: {str(e)}"
+        logger.error("❌ Lỗi LLM: %s", e)
+        answer, self_confidence, suggested_query = f"Đã xảy ra lỗi: {str(e)}", None, ""
 
     return {
-        **state,
         "answer": answer,
+        "self_confidence": self_confidence,
+        "suggested_query": suggested_query,
     }
 
 
-def node_grade_answer(state: CorrectiveRAGState) -> CorrectiveRAGState:
+def node_grade_answer(state: CorrectiveRAGState) -> dict:
     """
     NODE GRADE ANSWER: Đánh giá chất lượng câu trả lời
 
@@ -232,12 +381,8 @@ def node_grade_answer(state: CorrectiveRAGState) -> CorrectiveRAGState:
         state: State với answer đã generate
 
     Returns:
-        State cập nhật với confidence, needs_rewrite
+        Partial update: confidence, needs_rewrite
     """
-    logger.info("\n" + "="*60)
-    logger.info("📊 NODE GRADE_ANSWER: Đánh giá chất lượng")
-    logger.info("="*60)
-
     answer = state.get("answer", "")
     documents = state.get("documents", [])
 
@@ -261,27 +406,47 @@ def node_grade_answer(state: CorrectiveRAGState) -> CorrectiveRAGState:
         needs_rewrite = True
         logger.warning("⚠️  Không có documents phù hợp")
 
-    # Check 3: Retry count limit
+    # Check 3: LLM tự đánh giá thấp (self-grade trong output của generate_draft)
+    self_confidence = state.get("self_confidence")
+    if self_confidence is not None and self_confidence < SELF_CONFIDENCE_THRESHOLD:
+        confidence = min(confidence, self_confidence)
+        needs_rewrite = True
+        logger.warning("⚠️  LLM tự đánh giá thấp: %.2f", self_confidence)
+
+    # Check 4: Retry count limit
     retry_count = state.get("retry_count", 0)
     if retry_count >= 2:
         confidence = max(confidence, 0.6)  # Force accept
         needs_rewrite = False
-        logger.info(f"✅ Đạt giới hạn retry ({retry_count}), chấp nhận answer")
+        logger.info("✅ Đạt giới hạn retry (%s), chấp nhận answer", retry_count)
 
     # Cap confidence
     confidence = max(0.0, min(1.0, confidence))
 
-    logger.info(f"📊 Confidence: {confidence:.2f}")
-    logger.info(f"📊 Needs rewrite: {needs_rewrite}")
+    logger.info("📊 Confidence: %.2f, needs rewrite: %s", confidence, needs_rewrite)
 
     return {
-        **state,
         "confidence": confidence,
         "needs_rewrite": needs_rewrite,
     }
 
 
-def node_rewrite_query(state: CorrectiveRAGState) -> CorrectiveRAGState:
+def node_apply_suggested_query(state: CorrectiveRAGState) -> dict:
+    """
+    NODE APPLY SUGGESTED QUERY: Dùng query LLM đã đề xuất lúc draft (không gọi LLM)
+
+    Returns:
+        Partial update: rewritten_query, retry_count++
+    """
+    logger.info("✍️  Dùng query đề xuất từ draft: %s", state['suggested_query'])
+    return {
+        "rewritten_query": state["suggested_query"],
+        "suggested_query": "",
+        "retry_count": state.get("retry_count", 0) + 1,
+    }
+
+
+async def node_rewrite_query(state: CorrectiveRAGState) -> dict:
     """
     NODE REWRITE QUERY: Viết lại query
 
@@ -294,34 +459,22 @@ def node_rewrite_query(state: CorrectiveRAGState) -> CorrectiveRAGState:
         state: State hiện tại
 
     Returns:
-        State cập nhật với rewritten_query, retry_count++
+        Partial update: rewritten_query, retry_count++
     """
-    logger.info("\n" + "="*60)
-    logger.info("✍️  NODE REWRITE_QUERY: Viết lại query")
-    logger.info("="*60)
-
     query = state["query"]
     retry_count = state.get("retry_count", 0)
 
-    logger.info(f"📥 Query gốc: {query}")
-    logger.info(f"🔄 Số lần rewrite: {retry_count}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("✍️  NODE REWRITE_QUERY: Viết lại query")
+        logger.debug("📥 Query gốc: %s, số lần rewrite: %s", query, retry_count)
 
     # Prompt rewrite
-    rewrite_prompt = f"""Bạn là trợ lý tìm kiếm thông tin tài khoản kế toán.
-
-QUERY GỐC: {query}
-
-Không tìm thấy kết quả phù hợp. Hãy viết lại câu hỏi theo một cách khác:
-1. Sửa typo (VD: TK111 → TK 111, tt99 → TT99)
-2. Dùng từ đồng nghĩa
-3. Thêm context rõ hơn (VD: "tài khoản", "TK")
-4. Tách query thành các query cụ thể hơn
-
-Trả về 2-3 câu hỏi được viết lại, mỗi câu trên một dòng. Không giải thích gì thêm."""
+    rewrite_prompt = REWRITE_PROMPT_TEMPLATE.format(query=query)
 
     try:
-        llm = get_ollama_client()
-        response = llm.chat(
+        # AsyncClient singleton: await thẳng trên event loop, dùng chung connection pool keep-alive
+        llm = get_async_ollama_client()
+        response = await llm.chat(
             model=settings.GENERATION_MODEL,
             messages=[{
                 "role": "user",
@@ -331,23 +484,60 @@ Trả về 2-3 câu hỏi được viết lại, mỗi câu trên một dòng. K
             stream=False
         )
         rewritten = response.get("message", {}).get("content", "").strip()
-        logger.info(f"✅ Query đã viết lại:\n{rewritten}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("✅ Query đã viết lại:\n%s", rewritten)
 
         # Lấy query đầu tiên
         new_query = rewritten.split('\n')[0].strip()
-        logger.info(f"🎯 Chọn query: {new_query}")
+        logger.info("🎯 Chọn query: %s", new_query)
 
     except Exception as e:
-        logger.warning(f"⚠️  Lỗi rewrite, giữ nguyên query: {e}")
+        logger.warning("⚠️  Lỗi rewrite, giữ nguyên query: %s", e)
         new_query = query
 
     return {
-        **state,
         "rewritten_query": new_query,
         "retry_count": retry_count + 1,
     }
 
 
+# =============================================================================
+# WARM-UP
+# =============================================================================
+
+# Query hay gặp: tra cứu tài khoản phổ biến (TT99 + TT200)
+WARMUP_QUERIES = (
+    "111", "112", "131", "152", "156", "211", "331", "333", "511", "632", "642",
+    "tt200 111", "tt200 156", "tt200 511", "tt200 642",
+)
+
+
+def warmup():
+    """
+    Warm-up trước khi nhận request (sync - gọi qua asyncio.to_thread trong lifespan).
+
+    1. Compile graph singleton + load COA index (JSON + build indexes)
+    2. Điền cache _retrieve_docs cho WARMUP_QUERIES
+    3. Gọi Ollama 1 token: load model + mở sẵn connection của client singleton
+    """
+    get_coa_app()
+    _COA_INDEX.load()
+    for query in WARMUP_QUERIES:
+        _retrieve_docs(query)
+    logger.info("🔥 Warm-up: COA index + %d query retrieve", len(WARMUP_QUERIES))
+
+    try:
+        get_ollama_client().chat(
+            model=settings.GENERATION_MODEL,
+            messages=[{"role": "user", "content": "ok"}],
+            options={"num_predict": 1},
+            stream=False
+        )
+        logger.info("🔥 Warm-up: Ollama %s sẵn sàng", settings.GENERATION_MODEL)
+    except Exception as e:
+        logger.warning("⚠️  Warm-up Ollama lỗi: %s", e)
+
+
 # =============================================================================
 # BƯỚC 3-6: BUILD GRAPH
 # =============================================================================
@@ -361,9 +551,10 @@ def create_coa_graph():
         START → retrieve → generate_draft → grade_answer ──► END
                                       ↑                │
                                       │                ▼
-                                      └───────── rewrite_query
+                                      └── apply_suggested_query / rewrite_query
 
-    Loop: grade_answer → rewrite_query → retrieve (max 2 lần)
+    Loop: grade_answer → apply_suggested_query | rewrite_query → retrieve (max 2 lần)
+    (apply_suggested_query dùng query draft đã đề xuất - không tốn thêm 1 lần gọi LLM)
     """
     logger.info("\n🏗️  Đang xây dựng Corrective RAG Workflow Graph...")
 
@@ -375,6 +566,7 @@ def create_coa_graph():
     graph.add_node("generate_draft", node_generate_draft)
     graph.add_node("grade_answer", node_grade_answer)
     graph.add_node("rewrite_query", node_rewrite_query)
+    graph.add_node("apply_suggested_query", node_apply_suggested_query)
 
     # BƯỚC 5: set_entry_point()
     graph.set_entry_point("retrieve")
@@ -387,19 +579,24 @@ def create_coa_graph():
     # generate_draft → grade_answer
     graph.add_edge("generate_draft", "grade_answer")
 
-    # grade_answer → [conditional] → END hoặc rewrite_query
-    def route_after_grade(state: CorrectiveRAGState) -> Literal["end", "rewrite"]:
+    # grade_answer → [conditional] → END, apply_suggested_query hoặc rewrite_query
+    def route_after_grade(state: CorrectiveRAGState) -> Literal["end", "suggested", "rewrite"]:
         """
         Conditional edge sau grade_answer
 
         Quyết định:
-        - Nếu needs_rewrite=True và retry_count<2 → rewrite_query
+        - Nếu needs_rewrite=True và retry_count<2:
+            - draft đã đề xuất query → apply_suggested_query (không gọi LLM rewrite)
+            - ngược lại → rewrite_query
         - Ngược lại → END
         """
         if state.get("needs_rewrite", False) and state.get("retry_count", 0) < 2:
-            logger.info("🔀 Route: → rewrite_query")
+            if state.get("suggested_query"):
+                logger.debug("🔀 Route: → apply_suggested_query")
+                return "suggested"
+            logger.debug("🔀 Route: → rewrite_query")
             return "rewrite"
-        logger.info("🔀 Route: → END")
+        logger.debug("🔀 Route: → END")
         return "end"
 
     graph.add_conditional_edges(
@@ -407,16 +604,19 @@ def create_coa_graph():
         route_after_grade,
         {
             "end": END,
+            "suggested": "apply_suggested_query",
             "rewrite": "rewrite_query",
         }
     )
 
-    # rewrite_query → retrieve (loop back)
+    # rewrite_query / apply_suggested_query → retrieve (loop back)
     graph.add_edge("rewrite_query", "retrieve")
+    graph.add_edge("apply_suggested_query", "retrieve")
 
-    # BƯỚC 7: COMPILE với MemorySaver
-    checkpointer = MemorySaver()
-    app = graph.compile(checkpointer=checkpointer)
+    # BƯỚC 7: COMPILE (không checkpointer)
+    # Mỗi request truyền đủ initial state và không resume thread cũ -> checkpoint sau mỗi node
+    # chỉ tốn thêm serialize state. Cần nhớ hội thoại thì dùng saver có giới hạn (SQLite/LRU).
+    app = graph.compile()
     logger.info("✅ Graph đã compile thành công\n")
 
     return app
@@ -439,6 +639,24 @@ def create_coa_app():
     return create_coa_graph()
 
 
+_COA_APP = None
+_COA_APP_LOCK = threading.Lock()
+
+
+def get_coa_app():
+    """
+    Get singleton compiled COA graph (compile 1 lần, dùng lại cho mọi request)
+
+    Graph không có checkpointer/state dùng chung -> share 1 graph giữa các request an toàn.
+    """
+    global _COA_APP
+    if _COA_APP is None:
+        with _COA_APP_LOCK:
+            if _COA_APP is None:
+                _COA_APP = create_coa_graph()
+    return _COA_APP
+
+
 # =============================================================================
 # TEST
 # =============================================================================
@@ -457,11 +675,13 @@ if __name__ == "__main__":
         "confidence": 0.0,
         "retry_count": 0,
         "needs_rewrite": False,
+        "self_confidence": None,
+        "suggested_query": "",
     }
 
-    # BƯỚC 8: INVOKE với thread_id
-    config = {"configurable": {"thread_id": "test_session"}}
-    result = app.invoke(initial_state, config)
+    # BƯỚC 8: INVOKE
+    # Node generate_draft / rewrite_query là async -> chạy bằng ainvoke
+    result = asyncio.run(app.ainvoke(initial_state))
 
     print("\n" + "█"*60)
     print("✅ HOÀN THÀNH WORKFLOW")
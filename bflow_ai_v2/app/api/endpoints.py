@@ -8,16 +8,49 @@ Implement Corrective RAG workflow:
    ↑                                      │
    └──────────────── rewrite_query ←───────┘
 """
-import asyncio
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+import orjson
+from fastapi import APIRouter, Request
+from fastapi.responses import Response, StreamingResponse
 from typing import Optional
 from pydantic import BaseModel
 
-from ..agents.coa_langgraph import create_coa_app, CorrectiveRAGState
+from ..agents.coa_langgraph import (
+    get_coa_app, is_accounting_query, CorrectiveRAGState, NOT_ACCOUNTING_ANSWER,
+)
+from ..core.config import settings
+from ..services.coa_index import get_coa_index
 
 router = APIRouter(tags=["COA"])
 
+# Số bytes (UTF-8) tối đa mỗi chunk khi stream answer cuối
+ANSWER_CHUNK_BYTES = 512
+
+_NOT_FOUND_BYTES = "Không tìm thấy tài khoản phù hợp.".encode("utf-8")
+_NOT_ACCOUNTING_BYTES = NOT_ACCOUNTING_ANSWER.encode("utf-8")
+
+
+def iter_utf8_chunks(payload: bytes, chunk_size: int = ANSWER_CHUNK_BYTES):
+    """
+    Cắt bytes UTF-8 thành chunk <= chunk_size, không cắt giữa 1 ký tự nhiều byte.
+
+    Encode cả answer 1 lần (C-level) rồi yield slice bytes - StreamingResponse gửi thẳng,
+    không encode lại từng chunk str.
+    """
+    start = 0
+    length = len(payload)
+    while start < length:
+        end = min(start + chunk_size, length)
+        # Lùi về đầu ký tự: byte tiếp nối có dạng 10xxxxxx
+        while end < length and end > start and (payload[end] & 0xC0) == 0x80:
+            end -= 1
+        if end == start:
+            # chunk_size < độ dài 1 ký tự -> lấy trọn ký tự
+            end = start + 1
+            while end < length and (payload[end] & 0xC0) == 0x80:
+                end += 1
+        yield payload[start:end]
+        start = end
+
 
 class AskRequest(BaseModel):
     question: str
@@ -38,7 +71,14 @@ async def ai_bflow_ask(request: AskRequest):
     3. 📊 grade_answer: Đánh giá chất lượng
     4. ✍️ rewrite_query (nếu cần): Viết lại query và loop
     """
-    graph = create_coa_app()
+    # Câu hỏi ngoài lề: trả lời ngay, không chạy graph (retrieve -> generate_draft vẫn gọi LLM)
+    if not is_accounting_query(request.question):
+        return StreamingResponse(
+            iter_utf8_chunks(_NOT_ACCOUNTING_BYTES),
+            media_type="text/plain; charset=utf-8"
+        )
+
+    graph = get_coa_app()
 
     # Initial state theo CorrectiveRAGState
     initial_state: CorrectiveRAGState = {
@@ -50,34 +90,30 @@ async def ai_bflow_ask(request: AskRequest):
         "confidence": 0.0,
         "retry_count": 0,
         "needs_rewrite": False,
+        "self_confidence": None,
+        "suggested_query": "",
     }
 
     async def generate():
-        """Generator để stream token-by-token"""
+        """Generator để stream answer theo chunk"""
         try:
-            # Run graph với streaming
-            config = {"configurable": {"thread_id": request.session_id or "default"}}
-
-            # Run graph và get final state
-            final_state = None
-            async for chunk in graph.astream(initial_state, config):
-                for node_name, node_state in chunk.items():
-                    final_state = node_state
+            # Run graph và get final state: node chỉ trả partial update -> merge dần
+            final_state = dict(initial_state)
+            async for chunk in graph.astream(initial_state):
+                for node_name, node_update in chunk.items():
+                    final_state.update(node_update)
 
-            # Stream final answer token-by-token
+            # Stream final answer theo chunk
             if final_state and final_state.get("answer"):
-                answer = final_state["answer"]
-
-                # Simple tokenization by character (Việt Unicode)
-                for i, char in enumerate(answer):
-                    yield char
-                    if i % 3 == 0:  # Small delay every few chars
-                        await asyncio.sleep(0.005)
+                # Encode 1 lần, chunk theo ranh giới ký tự UTF-8 (không vỡ ký tự tiếng Việt),
+                # không sleep: answer đã có đủ, delay giả chỉ tăng latency
+                for part in iter_utf8_chunks(final_state["answer"].encode("utf-8")):
+                    yield part
             else:
-                yield "Không tìm thấy tài khoản phù hợp."
+                yield _NOT_FOUND_BYTES
 
         except Exception as e:
-            yield f"\n\n❌ **Lỗi:** {str(e)}"
+            yield f"\n\n❌ **Lỗi:** {str(e)}".encode("utf-8")
 
     return StreamingResponse(
         generate(),
@@ -85,7 +121,51 @@ async def ai_bflow_ask(request: AskRequest):
     )
 
 
+# Payload tĩnh: serialize 1 lần lúc import
+_HEALTH_BYTES = orjson.dumps(
+    {"status": "ok", "service": "bflow_ai_v2", "version": "2.0.0", "architecture": "Corrective RAG"}
+)
+
+
 @router.get("/ai-bflow/health")
 async def ai_bflow_health():
     """Health check endpoint"""
-    return {"status": "ok", "service": "bflow_ai_v2", "version": "2.0.0", "architecture": "Corrective RAG"}
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
+
+
+_ACCOUNT_NOT_FOUND_BYTES = orjson.dumps({"detail": "Account not found"})
+_ACCOUNT_CACHE_CONTROL = f"public, max-age={settings.COA_CACHE_MAX_AGE}"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match (RFC 9110 weak comparison): danh sách tag cách dấu phẩy, bỏ prefix W/, "*" khớp mọi tag"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+@router.get("/ai-bflow/accounts/{code}")
+async def ai_bflow_account(code: str, request: Request, tt200: bool = False):
+    """
+    Tra cứu 1 tài khoản theo số hiệu (TT99 mặc định, ?tt200=true cho TT200).
+
+    Body JSON + ETag serialize sẵn trong COAIndex (không json encode mỗi request);
+    client gửi lại If-None-Match khớp ETag -> 304 không body.
+    """
+    cached = get_coa_index().get_by_code_bytes(code, use_tt200=tt200)
+    if cached is None:
+        return Response(content=_ACCOUNT_NOT_FOUND_BYTES, status_code=404, media_type="application/json")
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": _ACCOUNT_CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,30 @@
+"""
+SelectiveGZip - GZipMiddleware bỏ qua route streaming
+
+GZipMiddleware của starlette gom output đã nén trong buffer zlib: response stream
+(/ai-bflow/ask chia chunk 512 byte UTF-8) sẽ tới client dồn 1 cục ở cuối.
+Route streaming đi thẳng vào app, chỉ route JSON (account lookup, health...) được gzip.
+
+Usage:
+    from app.core.compression import SelectiveGZip
+
+    app.add_middleware(SelectiveGZip, minimum_size=512, exclude_paths=("/api/ai-bflow/ask",))
+"""
+from typing import Iterable
+
+from starlette.middleware.gzip import GZipMiddleware
+
+
+class SelectiveGZip:
+    """GZip cho mọi HTTP response trừ các path trong exclude_paths (so khớp chính xác)"""
+
+    def __init__(self, app, minimum_size: int = 500, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self._gzip = GZipMiddleware(app, minimum_size=minimum_size)
+        self._exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self._exclude_paths:
+            await self._gzip(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
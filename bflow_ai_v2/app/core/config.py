@@ -2,7 +2,7 @@
 Configuration for bflow_ai_v2
 """
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -12,15 +12,23 @@ class Settings(BaseSettings):
     APP_NAME: str = "bflow_ai_v2 - COA Agent"
     APP_VERSION: str = "2.0.0"
     API_PREFIX: str = "/api"
+    # CORS: danh sách origin được phép (JSON trong env, VD: ["https://bflow.vn"]); ["*"] = mọi origin
+    CORS_ORIGINS: List[str] = ["*"]
+    # Bật khi frontend gửi cookie/credentials (khi đó "*" phải echo origin mỗi request -> nên dùng allowlist)
+    CORS_ALLOW_CREDENTIALS: bool = False
 
     # Server
     HOST: str = "0.0.0.0"
     PORT: int = 8010
+    LOG_LEVEL: str = "INFO"  # DEBUG: log chi tiết từng node (banner, context, route)
 
     # Ollama/LLM
     OLLAMA_BASE_URL: str = "http://localhost:11434"
+    OLLAMA_TIMEOUT: float = 60.0  # Timeout (s) cho HTTP client dùng chung
     GENERATION_MODEL: str = "qwen2.5:1.5b"
     EMBEDDING_MODEL: str = "nomic-embed-text"
+    # Warm-up lúc startup: load COA index, điền cache retrieve cho query hay gặp, gọi Ollama 1 token
+    WARMUP_ON_STARTUP: bool = True
 
     # Ollama options
     OLLAMA_OPTIONS: dict = {
@@ -35,9 +43,13 @@ class Settings(BaseSettings):
     COA_99_FILE: str = "coa_99.json"
     COA_200_FILE: str = "coa_200.json"
     COA_COMPARE_FILE: str = "coa_compare_99_vs_200.json"
+    # Snapshot pickle của data + indexes đã build (tự build lại khi JSON nguồn đổi mtime)
+    COA_SNAPSHOT_FILE: str = ".coa_index.pkl"
 
     # COA Search config
     COA_SEARCH_LIMIT: int = 5
+    # Cache-Control max-age (s) cho response tra cứu tài khoản (data chỉ đổi khi deploy, có ETag)
+    COA_CACHE_MAX_AGE: int = 86400
     COA_SIMILARITY_THRESHOLD: float = 0.3
 
     class Config:
@@ -0,0 +1,61 @@
+"""
+Logging setup - QueueHandler + QueueListener
+
+Handler trên root chỉ put record vào queue (không format, không I/O trên event loop);
+QueueListener chạy thread riêng, format + ghi stderr.
+
+Usage:
+    from app.core.logging_config import setup_logging, shutdown_logging
+
+    setup_logging()      # idempotent, gọi lúc import/startup
+    ...
+    shutdown_logging()   # flush queue khi shutdown
+"""
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from .config import settings
+
+LOG_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+_lock = threading.Lock()
+
+
+def setup_logging(level: str = settings.LOG_LEVEL) -> None:
+    """Gắn QueueHandler vào root logger + start listener thread (chỉ lần gọi đầu)"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        _queue_handler = QueueHandler(log_queue)
+        root.addHandler(_queue_handler)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    Dừng listener (ghi nốt record còn trong queue) + gỡ QueueHandler khỏi root logger.
+
+    Không gỡ thì record sau shutdown dồn mãi trong queue (không ai ghi); setup_logging() gọi lại được.
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _listener.stop()
+            _listener = None
+            _queue_handler = None
@@ -1,37 +1,26 @@
 """
 Ollama Client - Singleton for bflow_ai_v2
+
+- get_ollama_client(): sync client (warm-up, script)
+- get_async_ollama_client(): AsyncClient cho LangGraph node - 1 httpx connection pool (keep-alive)
+  dùng suốt vòng đời app, await trực tiếp trên event loop (không tốn thread)
+
+Client tạo 1 lần lúc import module (import lock của Python đảm bảo chỉ 1 instance):
+get_*() chỉ trả biến module - không lock, không check None trên mỗi lần gọi.
+Tạo client không mở connection (httpx connect lazy ở request đầu tiên).
 """
-import threading
-from typing import Optional
 import ollama
 from .config import settings
 
-
-class OllamaClientPool:
-    """Singleton Ollama client pool"""
-
-    _instance: Optional[ollama.Client] = None
-    _lock = threading.Lock()
-    _host: str = settings.OLLAMA_BASE_URL
-
-    @classmethod
-    def get_client(cls) -> ollama.Client:
-        """Get singleton ollama client instance"""
-        if cls._instance is None:
-            with cls._lock:
-                # Double-check locking
-                if cls._instance is None:
-                    cls._instance = ollama.Client(host=cls._host)
-                    print(f"[OllamaPool] Created singleton client for {cls._host}")
-        return cls._instance
-
-    @classmethod
-    def reset(cls):
-        """Reset client instance"""
-        with cls._lock:
-            cls._instance = None
+_OLLAMA_CLIENT = ollama.Client(host=settings.OLLAMA_BASE_URL, timeout=settings.OLLAMA_TIMEOUT)
+_ASYNC_OLLAMA_CLIENT = ollama.AsyncClient(host=settings.OLLAMA_BASE_URL, timeout=settings.OLLAMA_TIMEOUT)
 
 
 def get_ollama_client() -> ollama.Client:
     """Get singleton ollama client"""
-    return OllamaClientPool.get_client()
+    return _OLLAMA_CLIENT
+
+
+def get_async_ollama_client() -> ollama.AsyncClient:
+    """Get singleton ollama AsyncClient"""
+    return _ASYNC_OLLAMA_CLIENT
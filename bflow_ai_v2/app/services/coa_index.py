@@ -3,7 +3,8 @@ COA Index Service - Indexed data lookup cho Chart of Accounts
 
 Features:
 1. O(1) lookup by code
-2. Fast keyword search
+2. Fast keyword search (marisa-trie: prefix lookup O(độ dài keyword))
+   + phrase search (Aho-Corasick: mọi tên TK xuất hiện trong câu, 1 lần quét)
 3. Pre-built indexes
 4. Lazy loading
 
@@ -14,107 +15,416 @@ Usage:
     acc = idx.get_by_code("156")
     results = idx.search_by_keyword("hàng hóa")
 """
-import json
+import asyncio
+import hashlib
+import logging
 import os
+import pickle
+import re
+import sys
+import threading
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterator, NamedTuple, Tuple
+from array import array
 from collections import defaultdict
+from functools import lru_cache, partial
+from types import MappingProxyType
+
+import ahocorasick
+import marisa_trie
+import orjson
 
 from ..core.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+# Payload của keyword trie: 1 uint32 = index account trong list data
+KEYWORD_TRIE_FMT = "<I"
+# Từ ngắn hơn (<= 2 ký tự) không index, không dùng để search
+MIN_KEYWORD_LEN = 3
+# Token keyword: chuỗi ký tự chữ/số >= MIN_KEYWORD_LEN - tách + lọc độ dài trong 1 lần findall (C),
+# bỏ luôn dấu câu dính vào từ ("hàng," -> "hàng")
+_TOKEN_RE = re.compile(rf"\w{{{MIN_KEYWORD_LEN},}}")
+# Tăng khi đổi cấu trúc snapshot (thêm/bớt index) -> snapshot cũ tự bị bỏ qua
+SNAPSHOT_VERSION = 6
+# File account JSON ship dạng compact: key 1 ký tự, không indent (build: python -m app.services.coa_index).
+# standard + search_text suy ra được -> không lưu trong file
+COMPACT_ACCOUNT_KEYS = (("c", "code"), ("n", "name"), ("e", "name_en"), ("i", "type_id"), ("t", "type_name"))
+# Số kết quả search_by_keyword / get_by_type được nhớ (agent hỏi lặp cùng keyword/loại TK)
+QUERY_CACHE_SIZE = 512
+# Posting list của index theo type: array uint32 vị trí account (4 byte/phần tử thay vì 1 ref PyObject)
+_new_rows = partial(array, "I")
+
+
+def _parse_json_file(path: Path) -> list:
+    """orjson: parse bytes đọc 1 lần (read_bytes), nhanh hơn json.load qua text stream; [] nếu thiếu file"""
+    if not path.exists():
+        logger.warning("[COAIndex] %s not found", path)
+        return []
+    return orjson.loads(path.read_bytes())
+
+
+class Account(NamedTuple):
+    """
+    1 tài khoản trong bộ nhớ - tuple thay vì dict (không hash table/key riêng mỗi account).
+
+    Public API vẫn trả dict (to_dict) - shape như JSON gốc.
+    """
+    standard: str
+    code: str
+    name: str
+    name_en: str
+    type_id: int
+    type_name: str
+
+    def to_dict(self) -> dict:
+        account = self._asdict()
+        account["search_text"] = f"{self.code} - {self.name} ({self.name_en})"
+        return account
+
+
+def load_accounts(rows: List[dict], standard: str) -> List[Account]:
+    """Row JSON (compact hoặc đầy đủ) -> Account"""
+    accounts = []
+    for row in rows:
+        if "c" in row:
+            accounts.append(Account(standard, row["c"], row["n"], row.get("e", ""), row["i"], row["t"]))
+        else:
+            accounts.append(Account(
+                standard, row["code"], row["name"], row.get("name_en") or "", row["type_id"], row["type_name"]
+            ))
+    return accounts
+
+
+def compact_accounts(rows: List[dict]) -> List[dict]:
+    """Row JSON -> row compact (bỏ standard + search_text)"""
+    return [
+        {short: getattr(acc, key) for short, key in COMPACT_ACCOUNT_KEYS}
+        for acc in load_accounts(rows, "")
+    ]
+
+
+def compact_data_files():
+    """
+    Build step (offline): ghi lại file COA JSON dạng compact.
+
+    - coa_99/coa_200: key ngắn + không indent
+    - compare: chỉ bỏ indent (giữ key - có nội dung lồng nhau)
+    """
+    data_dir = Path(settings.COA_DATA_DIR)
+    for filename, compact in (
+        (settings.COA_99_FILE, compact_accounts),
+        (settings.COA_200_FILE, compact_accounts),
+        (settings.COA_COMPARE_FILE, None),
+    ):
+        path = data_dir / filename
+        raw = path.read_bytes()
+        data = orjson.loads(raw)
+        out = orjson.dumps(compact(data) if compact else data)
+        path.write_bytes(out)
+        print(f"[COAIndex] {path}: {len(raw)} -> {len(out)} bytes")
+
 
 class COAIndex:
     """Indexed COA data service"""
 
     def __init__(self):
         self._loaded = False
-        self._data_99 = []
-        self._data_200 = []
+        # Chỉ 1 thread load/build; thread khác chờ rồi thấy _loaded (double-check trong lock)
+        self._load_lock = threading.Lock()
+        self._data_99: List[Account] = []
+        self._data_200: List[Account] = []
         self._compare_data = []
 
-        # Indexes
+        # Indexes - chỉ lưu vị trí account (int) trong _data_99/_data_200, dict account
+        # chỉ lấy ra ở public API cho các kết quả trả về
         self._by_code_99 = {}
         self._by_code_200 = {}
-        self._by_type_99 = defaultdict(list)
-        self._by_type_200 = defaultdict(list)
+        self._by_type_99 = defaultdict(_new_rows)
+        self._by_type_200 = defaultdict(_new_rows)
         self._compare_by_type = defaultdict(list)
+        self._compare_by_code = {}
+
+        # Keyword index - trie word -> vị trí account trong _data_99/_data_200
+        # (trie chỉ lưu id, prefix chung của các từ lưu 1 lần)
+        self._keyword_trie_99 = marisa_trie.RecordTrie(KEYWORD_TRIE_FMT)
+        self._keyword_trie_200 = marisa_trie.RecordTrie(KEYWORD_TRIE_FMT)
+
+        # Tên lowercase (name, name_en) song song với _data_99/_data_200 - cho substring fallback
+        self._names_lower_99: List[Tuple[str, str]] = []
+        self._names_lower_200: List[Tuple[str, str]] = []
+
+        # Phrase automaton - tên TK lowercase -> (độ dài tên, vị trí các account trùng tên)
+        self._phrase_ac_99 = ahocorasick.Automaton()
+        self._phrase_ac_200 = ahocorasick.Automaton()
+
+        # LRU theo instance: key chỉ gồm tham số (keyword/type_name, use_tt200, limit), trả tuple Account
+        # (immutable - caller không sửa được kết quả đã cache)
+        self._search_cached = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._search_by_keyword_impl)
+        self._type_cached = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._get_by_type_impl)
+        self._code_bytes_cached = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._get_by_code_bytes_impl)
+
+    def load(self):
+        """Load eager (startup) thay vì đợi public method đầu tiên"""
+        self._load_data()
 
-        # Keyword index - map keyword -> list of accounts
-        self._keyword_index_99 = defaultdict(list)
-        self._keyword_index_200 = defaultdict(list)
+    def reset(self):
+        """Bỏ data + indexes + cache query -> lần gọi sau load lại (VD: sau khi sửa file trong data/coa)"""
+        self.__init__()
+
+    @staticmethod
+    def _source_files() -> Tuple[Path, Path, Path, Path]:
+        """(coa_99, coa_200, compare, snapshot) theo settings"""
+        data_dir = Path(settings.COA_DATA_DIR)
+        return (
+            data_dir / settings.COA_99_FILE,
+            data_dir / settings.COA_200_FILE,
+            data_dir / settings.COA_COMPARE_FILE,
+            data_dir / settings.COA_SNAPSHOT_FILE,
+        )
+
+    def _try_snapshot(self, coa_99_file: Path, coa_200_file: Path, coa_compare_file: Path,
+                      snapshot_file: Path) -> tuple:
+        """
+        Snapshot còn khớp mtime JSON nguồn -> 1 pickle.load, bỏ qua parse JSON + build indexes.
+
+        Returns:
+            (state hoặc None, snapshot_key)
+        """
+        snapshot_key = (SNAPSHOT_VERSION, self._source_mtimes(coa_99_file, coa_200_file, coa_compare_file))
+        return self._load_snapshot(snapshot_file, snapshot_key), snapshot_key
 
     def _load_data(self):
         """Lazy load data từ JSON files"""
         if self._loaded:
             return
 
-        data_dir = Path(settings.COA_DATA_DIR)
-        coa_99_file = data_dir / settings.COA_99_FILE
-        coa_200_file = data_dir / settings.COA_200_FILE
-        coa_compare_file = data_dir / settings.COA_COMPARE_FILE
-
-        # Load TT99
-        if coa_99_file.exists():
-            with open(coa_99_file, "r", encoding="utf-8") as f:
-                self._data_99 = json.load(f)
-        else:
-            print(f"[WARN] {coa_99_file} not found")
+        with self._load_lock:
+            if self._loaded:
+                return
+            coa_99_file, coa_200_file, coa_compare_file, snapshot_file = self._source_files()
+            state, snapshot_key = self._try_snapshot(coa_99_file, coa_200_file, coa_compare_file, snapshot_file)
+            if state is not None:
+                self._publish(state, "Loaded snapshot")
+                return
+            self._build_and_publish(
+                _parse_json_file(coa_99_file), _parse_json_file(coa_200_file), _parse_json_file(coa_compare_file),
+                snapshot_file, snapshot_key,
+            )
+
+    async def load_async(self):
+        """
+        Load eager từ lifespan: 3 file JSON parse song song trên thread pool (orjson nhả GIL khi parse),
+        build indexes cũng trong thread - event loop không bị block.
 
-        # Load TT200
-        if coa_200_file.exists():
-            with open(coa_200_file, "r", encoding="utf-8") as f:
-                self._data_200 = json.load(f)
-        else:
-            print(f"[WARN] {coa_200_file} not found")
+        Sync _load_data vẫn là đường lazy cho request đầu nếu chưa load.
+        """
+        if self._loaded:
+            return
 
-        # Load Compare
-        if coa_compare_file.exists():
-            with open(coa_compare_file, "r", encoding="utf-8") as f:
-                self._compare_data = json.load(f)
-        else:
-            print(f"[WARN] {coa_compare_file} not found")
+        coa_99_file, coa_200_file, coa_compare_file, snapshot_file = self._source_files()
+        state, snapshot_key = await asyncio.to_thread(
+            self._try_snapshot, coa_99_file, coa_200_file, coa_compare_file, snapshot_file
+        )
+        if state is not None:
+            await asyncio.to_thread(self._finish_load, None, None, None, snapshot_file, snapshot_key, state)
+            return
 
-        # Build indexes
-        self._build_indexes()
-        self._loaded = True
-        print(f"[COAIndex] Loaded: {len(self._data_99)} TT99, {len(self._data_200)} TT200")
+        raw_99, raw_200, raw_compare = await asyncio.gather(
+            asyncio.to_thread(_parse_json_file, coa_99_file),
+            asyncio.to_thread(_parse_json_file, coa_200_file),
+            asyncio.to_thread(_parse_json_file, coa_compare_file),
+        )
+        await asyncio.to_thread(self._finish_load, raw_99, raw_200, raw_compare, snapshot_file, snapshot_key)
+
+    def _finish_load(self, raw_99: Optional[list], raw_200: Optional[list], raw_compare: Optional[list],
+                     snapshot_file: Path, snapshot_key: tuple, state: Optional[dict] = None):
+        """Bước cuối của load_async (trong lock): publish snapshot state, hoặc build từ JSON đã parse"""
+        with self._load_lock:
+            if self._loaded:
+                return
+            if state is not None:
+                self._publish(state, "Loaded snapshot")
+            else:
+                self._build_and_publish(raw_99, raw_200, raw_compare, snapshot_file, snapshot_key)
+
+    def _build_and_publish(self, raw_99: list, raw_200: list, raw_compare: list,
+                           snapshot_file: Path, snapshot_key: tuple):
+        """JSON đã parse -> Account + build indexes + ghi snapshot -> publish (gọi trong _load_lock)"""
+        state = self._build_indexes(
+            load_accounts(raw_99, "TT99"), load_accounts(raw_200, "TT200"), raw_compare
+        )
+        self._save_snapshot(snapshot_file, snapshot_key, state)
+        self._publish(state, "Loaded")
+
+    def _publish(self, state: dict, label: str):
+        """
+        Gán data + indexes (tên attribute -> giá trị) trong 1 lần update rồi mới bật _loaded.
 
-    def _build_indexes(self):
-        """Build all indexes"""
+        Build/unpickle lỗi giữa chừng thì chưa gán gì -> lần sau load lại từ đầu trên state mới.
+        """
+        self.__dict__.update(state)
+        self._loaded = True
+        logger.info("[COAIndex] %s: %d TT99, %d TT200", label, len(self._data_99), len(self._data_200))
+
+    @staticmethod
+    def _source_mtimes(*files: Path) -> tuple:
+        """mtime (ns) của từng file nguồn, None nếu không tồn tại"""
+        mtimes = []
+        for file in files:
+            try:
+                mtimes.append(file.stat().st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _load_snapshot(self, snapshot_file: Path, snapshot_key: tuple) -> Optional[dict]:
+        """State (data + indexes) từ snapshot; None nếu không có / hỏng / khác version / JSON nguồn đã đổi"""
+        try:
+            with open(snapshot_file, "rb", buffering=1 << 20) as f:
+                snapshot = pickle.load(f)
+            if snapshot[0] != snapshot_key:
+                return None
+            (_, data_99, data_200, compare_data,
+             by_code_99, by_code_200, by_type_99, by_type_200, compare_by_type,
+             compare_by_code, trie_99_bytes, trie_200_bytes,
+             phrase_ac_99, phrase_ac_200) = snapshot
+            return {
+                "_data_99": data_99,
+                "_data_200": data_200,
+                "_compare_data": compare_data,
+                "_names_lower_99": self._lower_names(data_99),
+                "_names_lower_200": self._lower_names(data_200),
+                # Key unpickle không nằm trong bảng intern -> intern lại (xem _build_indexes)
+                **self._freeze_indexes(
+                    {sys.intern(k): v for k, v in by_code_99.items()},
+                    {sys.intern(k): v for k, v in by_code_200.items()},
+                    {sys.intern(k): v for k, v in by_type_99.items()},
+                    {sys.intern(k): v for k, v in by_type_200.items()},
+                    compare_by_type, compare_by_code,
+                ),
+                "_keyword_trie_99": marisa_trie.RecordTrie(KEYWORD_TRIE_FMT).frombytes(trie_99_bytes),
+                "_keyword_trie_200": marisa_trie.RecordTrie(KEYWORD_TRIE_FMT).frombytes(trie_200_bytes),
+                "_phrase_ac_99": phrase_ac_99,
+                "_phrase_ac_200": phrase_ac_200,
+            }
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("[COAIndex] Snapshot %s lỗi, build lại: %s", snapshot_file, e)
+            return None
+
+    @staticmethod
+    def _save_snapshot(snapshot_file: Path, snapshot_key: tuple, state: dict):
+        """Ghi snapshot (file tạm + os.replace: worker khác không đọc phải file ghi dở)"""
+        snapshot = (
+            snapshot_key, state["_data_99"], state["_data_200"], state["_compare_data"],
+            dict(state["_by_code_99"]), dict(state["_by_code_200"]),
+            dict(state["_by_type_99"]), dict(state["_by_type_200"]), dict(state["_compare_by_type"]),
+            dict(state["_compare_by_code"]),
+            state["_keyword_trie_99"].tobytes(), state["_keyword_trie_200"].tobytes(),
+            state["_phrase_ac_99"], state["_phrase_ac_200"],
+        )
+        tmp_file = snapshot_file.with_name(f"{snapshot_file.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_file, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, snapshot_file)
+        except Exception as e:
+            # Snapshot chỉ là cache: data dir read-only (VD: mount trong container), pickle lỗi...
+            # -> chỉ mất snapshot, load vẫn thành công
+            logger.warning("[COAIndex] Không ghi được snapshot %s: %s", snapshot_file, e)
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
+
+    def _build_indexes(self, data_99: List[Account], data_200: List[Account], compare_data: list) -> dict:
+        """Build all indexes vào biến local -> state dict (chưa gán lên instance)"""
+        # Key code/type_name được intern: get_by_code/get_by_type intern tham số -> dict lookup
+        # khớp ngay bằng identity, không so sánh chuỗi
         # Index by code cho TT99
-        for acc in self._data_99:
-            code = acc["code"]
-            self._by_code_99[code] = acc
-            self._by_type_99[acc["type_name"]].append(acc)
-
-            # Keyword index - extract keywords from name
-            self._index_keywords(acc, self._keyword_index_99)
+        by_code_99, by_type_99 = {}, defaultdict(_new_rows)
+        for i, acc in enumerate(data_99):
+            by_code_99[sys.intern(acc.code)] = i
+            by_type_99[sys.intern(acc.type_name)].append(i)
 
         # Index by code cho TT200
-        for acc in self._data_200:
-            code = acc["code"]
-            self._by_code_200[code] = acc
-            self._by_type_200[acc["type_name"]].append(acc)
-            self._index_keywords(acc, self._keyword_index_200)
+        by_code_200, by_type_200 = {}, defaultdict(_new_rows)
+        for i, acc in enumerate(data_200):
+            by_code_200[sys.intern(acc.code)] = i
+            by_type_200[sys.intern(acc.type_name)].append(i)
 
         # Compare data index
-        for item in self._compare_data:
-            self._compare_by_type[item["change_type"]].append(item)
+        compare_by_type, compare_by_code = defaultdict(list), {}
+        for item in compare_data:
+            compare_by_type[item["change_type"]].append(item)
+            account_number = item.get("account_number")
+            if account_number:
+                # setdefault: giữ item đầu tiên như scan tuần tự trước đây
+                compare_by_code.setdefault(account_number, item)
 
-    def _index_keywords(self, acc: dict, index: dict):
-        """Index keywords từ account name"""
-        name_lower = acc["name"].lower()
-        name_en_lower = acc.get("name_en", "").lower()
+        return {
+            "_data_99": data_99,
+            "_data_200": data_200,
+            "_compare_data": compare_data,
+            "_names_lower_99": self._lower_names(data_99),
+            "_names_lower_200": self._lower_names(data_200),
+            **self._freeze_indexes(by_code_99, by_code_200, by_type_99, by_type_200, compare_by_type, compare_by_code),
+            # Keyword trie - extract keywords from name
+            "_keyword_trie_99": marisa_trie.RecordTrie(KEYWORD_TRIE_FMT, self._keyword_records(data_99)),
+            "_keyword_trie_200": marisa_trie.RecordTrie(KEYWORD_TRIE_FMT, self._keyword_records(data_200)),
+            # Phrase automaton trên tên TK (tiếng Việt + tiếng Anh)
+            "_phrase_ac_99": self._build_phrase_automaton(data_99),
+            "_phrase_ac_200": self._build_phrase_automaton(data_200),
+        }
 
-        # Extract keywords (split by space)
-        for word in name_lower.split():
-            if len(word) > 2:  # Skip quá ngắn
-                index[word].append(acc)
+    @staticmethod
+    def _freeze_indexes(by_code_99, by_code_200, by_type_99, by_type_200, compare_by_type, compare_by_code) -> dict:
+        """
+        Sau build: defaultdict -> dict thường, bọc MappingProxyType (read-only).
 
-        # English keywords
-        for word in name_en_lower.split():
-            if len(word) > 2:
-                index[word].append(acc)
+        Lookup không qua __missing__, và index[key_không_có] không lặng lẽ thêm list rỗng lúc query.
+        """
+        return {
+            "_by_code_99": MappingProxyType(dict(by_code_99)),
+            "_by_code_200": MappingProxyType(dict(by_code_200)),
+            "_by_type_99": MappingProxyType(dict(by_type_99)),
+            "_by_type_200": MappingProxyType(dict(by_type_200)),
+            "_compare_by_type": MappingProxyType(dict(compare_by_type)),
+            "_compare_by_code": MappingProxyType(dict(compare_by_code)),
+        }
+
+    @staticmethod
+    def _lower_names(data: List[Account]) -> List[Tuple[str, str]]:
+        """(name, name_en) lowercase 1 lần lúc load - substring fallback không lower lại mỗi query"""
+        return [(acc.name.lower(), acc.name_en.lower()) for acc in data]
+
+    @staticmethod
+    def _keyword_records(data: List[Account]) -> Iterator[Tuple[str, Tuple[int]]]:
+        """(word, (account_index,)) từ tên tiếng Việt + tiếng Anh của mỗi account"""
+        for i, acc in enumerate(data):
+            for word in _TOKEN_RE.findall(acc.name.lower()):
+                yield word, (i,)
+            for word in _TOKEN_RE.findall(acc.name_en.lower()):
+                yield word, (i,)
+
+    @staticmethod
+    def _build_phrase_automaton(data: List[Account]) -> ahocorasick.Automaton:
+        """Automaton: tên lowercase -> (len(tên), tuple vị trí account); nhiều TK trùng tên (138/1388) gộp 1 key"""
+        rows_by_name: Dict[str, List[int]] = defaultdict(list)
+        for i, acc in enumerate(data):
+            for name in (acc.name.lower(), acc.name_en.lower()):
+                if len(name) >= MIN_KEYWORD_LEN and i not in rows_by_name[name]:
+                    rows_by_name[name].append(i)
+
+        automaton = ahocorasick.Automaton()
+        for name, rows in rows_by_name.items():
+            automaton.add_word(name, (len(name), tuple(rows)))
+        if rows_by_name:
+            automaton.make_automaton()
+        return automaton
 
     # ========================================================================
     # PUBLIC API
@@ -132,8 +442,31 @@ class COAIndex:
             Account dict or None
         """
         self._load_data()
-        index = self._by_code_200 if use_tt200 else self._by_code_99
-        return index.get(code)
+        code = sys.intern(code)
+        if use_tt200:
+            row = self._by_code_200.get(code)
+            return self._data_200[row].to_dict() if row is not None else None
+        row = self._by_code_99.get(code)
+        return self._data_99[row].to_dict() if row is not None else None
+
+    def get_by_code_bytes(self, code: str, use_tt200: bool = False) -> Optional[Tuple[bytes, str]]:
+        """
+        Account đã serialize JSON (orjson) + ETag - cho endpoint trả thẳng bytes.
+
+        Data tĩnh giữa các lần deploy -> mỗi code chỉ serialize + hash 1 lần (LRU).
+
+        Returns:
+            (body, etag) hoặc None nếu không có tài khoản
+        """
+        self._load_data()
+        return self._code_bytes_cached(code, use_tt200)
+
+    def _get_by_code_bytes_impl(self, code: str, use_tt200: bool) -> Optional[Tuple[bytes, str]]:
+        acc = self.get_by_code(code, use_tt200=use_tt200)
+        if acc is None:
+            return None
+        body = orjson.dumps(acc)
+        return body, f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
 
     def get_by_type(self, type_name: str, use_tt200: bool = False) -> List[dict]:
         """
@@ -147,59 +480,119 @@ class COAIndex:
             List of accounts
         """
         self._load_data()
+        return [acc.to_dict() for acc in self._type_cached(sys.intern(type_name), use_tt200)]
+
+    def _get_by_type_impl(self, type_name: str, use_tt200: bool) -> Tuple[Account, ...]:
         index = self._by_type_200 if use_tt200 else self._by_type_99
-        return index.get(type_name, [])
+        data = self._data_200 if use_tt200 else self._data_99
+        return tuple(data[i] for i in index.get(type_name, ()))
 
     def search_by_keyword(self, keyword: str, use_tt200: bool = False, limit: int = 20) -> List[dict]:
         """
-        Fast keyword search using pre-built index.
+        Fast keyword search using prefix lookup trên keyword trie.
+
+        Mỗi từ (>= 3 ký tự) của keyword khớp mọi từ trong tên account bắt đầu bằng nó
+        ("thu" -> "thu", "thuế"...; "recei" -> "receivable"); nhiều từ -> account phải
+        khớp tất cả. Trie không ra kết quả (từ < 3 ký tự như "nợ", mảnh giữa từ như "iền mặ")
+        -> fallback substring trên tên lowercase tính sẵn. Query lặp lại lấy từ LRU cache.
 
         Args:
-            keyword: Keyword to search
+            keyword: Keyword to search (1 hoặc nhiều từ)
             use_tt200: If True, search TT200
             limit: Max results
 
         Returns:
-            List of matching accounts
+            List of matching accounts (theo thứ tự trong data)
         """
         self._load_data()
-        keyword_lower = keyword.lower()
-        index = self._keyword_index_200 if use_tt200 else self._keyword_index_99
-
-        # Direct keyword match from index
-        if keyword_lower in index:
-            results = index[keyword_lower]
-            # Deduplicate by code
-            seen = set()
-            unique = []
-            for acc in results:
-                if acc["code"] not in seen:
-                    seen.add(acc["code"])
-                    unique.append(acc)
-            return unique[:limit]
-
-        # Fallback: substring search (slower but still indexed)
-        return self._substring_search(keyword_lower, use_tt200, limit)
-
-    def _substring_search(self, keyword_lower: str, use_tt200: bool, limit: int) -> List[dict]:
-        """Fallback substring search với optimization"""
+        return [acc.to_dict() for acc in self._search_cached(keyword.lower(), use_tt200, limit)]
+
+    def _search_by_keyword_impl(self, keyword_lower: str, use_tt200: bool, limit: int) -> Tuple[Account, ...]:
+        return (
+            self._trie_search(keyword_lower, use_tt200, limit)
+            or self._substring_search(keyword_lower, use_tt200, limit)
+        )
+
+    def _trie_search(self, keyword_lower: str, use_tt200: bool, limit: int) -> Tuple[Account, ...]:
+        words = _TOKEN_RE.findall(keyword_lower)
+        if not words:
+            return ()
+
+        trie = self._keyword_trie_200 if use_tt200 else self._keyword_trie_99
+        data = self._data_200 if use_tt200 else self._data_99
+
+        # Dedupe bằng set int (id account), giao giữa các từ
+        matched = None
+        for word in words:
+            ids = {i for _, (i,) in trie.items(word)}
+            matched = ids if matched is None else matched & ids
+            if not matched:
+                return ()
+
+        return tuple(data[i] for i in sorted(matched)[:limit])
+
+    def _substring_search(self, keyword_lower: str, use_tt200: bool, limit: int) -> Tuple[Account, ...]:
+        """Fallback substring search (scan tuần tự, chỉ khi trie không ra kết quả)"""
+        if not keyword_lower:
+            return ()
         data = self._data_200 if use_tt200 else self._data_99
+        names_lower = self._names_lower_200 if use_tt200 else self._names_lower_99
 
         results = []
-        for acc in data:
-            if keyword_lower in acc["name"].lower() or keyword_lower in acc.get("name_en", "").lower():
+        for acc, (name_lower, name_en_lower) in zip(data, names_lower):
+            if keyword_lower in name_lower or keyword_lower in name_en_lower:
                 results.append(acc)
                 if len(results) >= limit:
                     break
-        return results
+        return tuple(results)
+
+    def search_phrase(self, query: str, use_tt200: bool = False, limit: int = 20) -> List[dict]:
+        """
+        Tìm mọi tài khoản có tên xuất hiện nguyên cụm trong query (1 lần quét Aho-Corasick).
+
+        VD: "hạch toán tiền mặt và phải thu khác" -> TK 111, 138, 1388.
+        Chỉ nhận match trọn từ ("thuế" không match trong "thuếx"); tên dài hơn (cụ thể hơn) xếp trước.
+
+        Args:
+            query: Câu/cụm từ tự do
+            use_tt200: If True, search TT200
+            limit: Max results
+
+        Returns:
+            List of matching accounts
+        """
+        self._load_data()
+        automaton = self._phrase_ac_200 if use_tt200 else self._phrase_ac_99
+        if automaton.kind != ahocorasick.AHOCORASICK:
+            return []
+        data = self._data_200 if use_tt200 else self._data_99
+
+        query_lower = query.lower()
+        last = len(query_lower) - 1
+        matches = []
+        for end, (length, rows) in automaton.iter(query_lower):
+            start = end - length + 1
+            # Bỏ match nằm giữa từ khác
+            if (start > 0 and query_lower[start - 1].isalnum()) or (end < last and query_lower[end + 1].isalnum()):
+                continue
+            matches.append((length, rows))
+
+        matches.sort(key=lambda m: -m[0])
+        seen = set()
+        results = []
+        for _, rows in matches:
+            for i in rows:
+                if i not in seen:
+                    seen.add(i)
+                    results.append(data[i].to_dict())
+                    if len(results) >= limit:
+                        return results
+        return results[:limit]
 
     def get_compare_by_code(self, code: str) -> Optional[dict]:
-        """Get compare data for a specific account code"""
+        """Get compare data for a specific account code (O(1) dict lookup)"""
         self._load_data()
-        for item in self._compare_data:
-            if item.get("account_number") == code:
-                return item
-        return None
+        return self._compare_by_code.get(code)
 
     def get_compare_by_type(self, change_type: str) -> List[dict]:
         """Get compare data by change type"""
@@ -220,11 +613,23 @@ class COAIndex:
 # =============================================================================
 
 _coa_index_instance: Optional[COAIndex] = None
+_coa_lock = threading.Lock()
 
 
 def get_coa_index() -> COAIndex:
     """Get singleton COA index instance"""
     global _coa_index_instance
-    if _coa_index_instance is None:
-        _coa_index_instance = COAIndex()
-    return _coa_index_instance
+    # Đọc global 1 lần vào local: hot path chỉ 1 LOAD_GLOBAL + 1 check
+    inst = _coa_index_instance
+    if inst is None:
+        with _coa_lock:
+            # Double-check locking: 2 request lúc startup không tạo 2 instance
+            inst = _coa_index_instance
+            if inst is None:
+                inst = COAIndex()
+                _coa_index_instance = inst
+    return inst
+
+
+if __name__ == "__main__":
+    compact_data_files()
@@ -2,24 +2,46 @@
 bflow_ai_v2 - Main Application
 COA Agent Only - Chart of Accounts Query Service
 """
+import asyncio
+import logging
 from contextlib import asynccontextmanager
+import orjson
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 import uvicorn
 
+from app.core.compression import SelectiveGZip
 from app.core.config import settings
+from app.core.cors import FastCORS
+from app.core.logging_config import setup_logging, shutdown_logging
 from app.api.endpoints import router as coa_router
+from app.agents.coa_langgraph import warmup
+from app.services.coa_index import get_coa_index
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler"""
     # Startup
-    print(f"[{settings.APP_NAME}] Starting on {settings.HOST}:{settings.PORT}")
-    print(f"[{settings.APP_NAME}] Ollama: {settings.OLLAMA_BASE_URL}")
-    print(f"[{settings.APP_NAME}] Model: {settings.GENERATION_MODEL}")
+    logger.info("[%s] Starting on %s:%s", settings.APP_NAME, settings.HOST, settings.PORT)
+    logger.info("[%s] Ollama: %s", settings.APP_NAME, settings.OLLAMA_BASE_URL)
+    logger.info("[%s] Model: %s", settings.APP_NAME, settings.GENERATION_MODEL)
+    # Load COA index (JSON/snapshot + indexes) trước request đầu, kể cả khi tắt warm-up.
+    # Lỗi data dir chỉ log - app vẫn boot, request đầu sẽ thử load lại.
+    # (Ollama client đã tạo lúc import app.core.ollama_client)
+    try:
+        await get_coa_index().load_async()
+    except Exception as e:
+        logger.error("[%s] Load COA index lỗi: %s", settings.APP_NAME, e)
+    if settings.WARMUP_ON_STARTUP:
+        # Request đầu không phải chịu cold start (load index, cache rỗng, model chưa load)
+        await asyncio.to_thread(warmup)
     yield
-    # Shutdown (if needed)
+    # Shutdown: ghi nốt log còn trong queue
+    shutdown_logging()
 
 
 def create_app() -> FastAPI:
@@ -30,28 +52,35 @@ def create_app() -> FastAPI:
         docs_url=f"{settings.API_PREFIX}/docs",
         redoc_url=f"{settings.API_PREFIX}/redoc",
         openapi_url=f"{settings.API_PREFIX}/openapi.json",
+        # Route trả dict/model -> serialize bằng orjson thay vì json stdlib
+        default_response_class=ORJSONResponse,
         lifespan=lifespan,
     )
 
+    # Gzip response JSON >= 512 bytes (client gửi Accept-Encoding: gzip); add trước CORS -> CORS bọc ngoài.
+    # /ask stream text/plain không gzip: buffer zlib sẽ dồn các chunk tới cuối response
+    app.add_middleware(
+        SelectiveGZip, minimum_size=512, exclude_paths=(f"{settings.API_PREFIX}/ai-bflow/ask",)
+    )
+
     # CORS
     app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
+        FastCORS, allow_origins=settings.CORS_ORIGINS, allow_credentials=settings.CORS_ALLOW_CREDENTIALS
     )
 
     # Routes
     app.include_router(coa_router, prefix=settings.API_PREFIX, tags=["COA"])
 
+    # Payload tĩnh: serialize 1 lần khi tạo app, mỗi request chỉ trả bytes
+    root_bytes = orjson.dumps({
+        "name": settings.APP_NAME,
+        "version": settings.APP_VERSION,
+        "status": "running"
+    })
+
     @app.get("/")
     async def root():
-        return {
-            "name": settings.APP_NAME,
-            "version": settings.APP_VERSION,
-            "status": "running"
-        }
+        return Response(content=root_bytes, media_type="application/json")
 
     return app
 
@@ -64,5 +93,8 @@ if __name__ == "__main__":
         "main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=True
+        reload=True,
+        # uvloop + httptools (có sẵn trong uvicorn[standard]): event loop / HTTP parser bản C
+        loop="uvloop",
+        http="httptools",
     )